@@ -13,7 +13,7 @@ meta = {'version': "1.0.0",
         'contact': "webmaster-bbcf@epfl.ch"}
 
 in_parameters = [{'id': 'track', 'type': 'track', 'required': True, 'label': 'Features', 'help_text': 'Select features file (e.g. bed)'},
-                 {'id': 'assembly', 'type': 'assembly', 'label': 'Assembly', 'help_text': 'Reference genome', 'options': genrep.GenRep().assemblies_available(), 'prompt_text': None},
+                 {'id': 'assembly', 'type': 'assembly', 'label': 'Assembly', 'help_text': 'Reference genome', 'options': assemblies_available(), 'prompt_text': None},
                  {'id': 'promoter', 'type': 'int', 'required': True, 'label': 'Promoter size: ', 'help_text': 'Upstream distance from TSS in bp to be included in the promoter', 'value': prom_def},
                  {'id': 'intergenic', 'type': 'int', 'required': True, 'label': 'Intergenic distance: ', 'help_text': 'Maximum distance to be associated with a gene', 'value': inter_def},
                  {'id': 'UTR', 'type': 'int', 'required': True, 'label': "3' UTR ratio: ", 'help_text': "3' UTR to promoter ratio in %", 'value': utr_def}]
@@ -25,7 +25,7 @@ class AnnotateForm(BaseForm):
                             help_text='Select features file (e.g. bed)',
                             validator=twb.BsFileFieldValidator(required=True))
     assembly = twf.SingleSelectField(label='Assembly: ',
-                                     options=genrep.GenRep().assemblies_available(),
+                                     options=assemblies_available(),
                                      prompt_text=None,
                                      help_text='Reference genome')
     promoter = twf.TextField(label='Promoter size: ',
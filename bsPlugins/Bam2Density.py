@@ -1,9 +1,10 @@
 from bsPlugins import *
+from bsPlugins.base.parallel import pool_map, nprocs, write_by_chrom, open_track, processes_parameter
 from bein import execution
 from bbcflib.track import track, convert
 from bbcflib.mapseq import bam_to_density
 from bbcflib.gfminer.stream import merge_scores
-import os, sys, pysam
+import os, sys, time, pysam
 
 __requires__ = ["pysam"]
 output_opts=["sql", "bedGraph", "bigWig"]
@@ -21,8 +22,8 @@ in_parameters = [{'id': 'sample', 'type': 'bam', 'required': True, 'multiple': T
                  {'id': 'read_extension', 'type': 'int', 'label': 'Read extension: ','help_text': 'Read extension (in bp) to be applied when constructing densities (will use read length if negative)', 'value': -1 },
                  {'id': 'no_nh_flag', 'type':'boolean', 'required':True, 'label': 'Do not use NH flag: ', 'help_text': 'Do not use NH (multiple mapping counts) as weights', 'value': False},
                  {'id': 'single_end', 'type':'boolean', 'required':True, 'label': 'As single end: ', 'help_text': 'Considered a paired-end bam as single-end (default: False, namely whole-fragment densities instead of read densities)', 'value': False},
-                 {'id': 'stranded', 'type':'boolean', 'required':True, 'label': 'As strand-specific: ', 'help_text': 'If the sequencing protocol was paired-end strand-specific, generate plus and minus densities (default: False)', 'value': False}
-]
+                 {'id': 'stranded', 'type':'boolean', 'required':True, 'label': 'As strand-specific: ', 'help_text': 'If the sequencing protocol was paired-end strand-specific, generate plus and minus densities (default: False)', 'value': False},
+                 processes_parameter]
 out_parameters = [{'id': 'density_merged', 'type': 'track'},
                   {'id': 'density_fwd', 'type': 'track'},
                   {'id': 'density_rev', 'type': 'track'},
@@ -70,6 +71,42 @@ class Bam2DensityForm(BaseForm):
     submit = twf.SubmitButton(id="submit", value='bam2density')
 
 
+def _split_strands(bamfile, outnames):
+    """Writes the proper pairs of *bamfile* to the BAM files *outnames['_plus_']*
+    and *outnames['_minus_']* according to the strand of the fragment,
+    one chromosome after the other if the file is indexed, else in file order.
+    Returns the number of reads read and the time it took."""
+    t0 = time.time()
+    nreads = 0
+    bam = pysam.Samfile(bamfile, "rb")
+    trout = {}
+    try:
+        for orient, outname in outnames.iteritems():
+            trout[orient] = pysam.Samfile(outname, "wb", template=bam)
+        plus = trout['_plus_'].write
+        minus = trout['_minus_'].write
+        if os.path.exists(bamfile+".bai") or os.path.exists(os.path.splitext(bamfile)[0]+".bai"):
+            reads = (read for chrom in bam.references for read in bam.fetch(chrom))
+        else:
+            reads = bam.fetch(until_eof=True)
+        for read in reads:
+            nreads += 1
+            if not (read.is_paired and read.is_proper_pair): continue
+            if (read.is_read1 and read.is_reverse) or (read.is_read2 and read.mate_is_reverse):
+                plus(read)
+            elif (read.is_read2 and read.is_reverse) or (read.is_read1 and read.mate_is_reverse):
+                minus(read)
+    finally:
+        for t in trout.values(): t.close()
+        bam.close()
+    return nreads, time.time()-t0
+
+
+def _average_chrom(chrom, sfiles):
+    return merge_scores([open_track(f, format='sql', fields=['start','end','score']).read(chrom)
+                         for f in sfiles])
+
+
 class Bam2DensityPlugin(BasePlugin):
     """From a BAM file, creates a track file of the read count/density along the whole genome,
 in the chosen format.
@@ -135,22 +172,19 @@ each alignment will be considered, default is read length).
         if stranded:
             output = {'_plus_': [], '_minus_': []}
             samples = {'_plus_': [], '_minus_': []}
-            trout = {}
+            jobs = []
             for bam in bamfiles:
+                outnames = {}
                 for orient in output:
                     bamname = self.temporary_path(fname= bam.name+orient+".bam")
-                    trout[orient] = pysam.Samfile(bamname, "wb", template=bam.filehandle)
+                    outnames[orient] = bamname
                     samples[orient].append(os.path.abspath(bamname))
                     outname = self.temporary_path(fname=bam.name+orient)
                     output[orient].append(os.path.abspath(outname))
-                bam.open()
-                for read in bam.filehandle:
-                    if not (read.is_paired and read.is_proper_pair): continue
-                    if (read.is_read1 and read.is_reverse) or (read.is_read2 and read.mate_is_reverse):
-                        trout['_plus_'].write(read)
-                    elif (read.is_read2 and read.is_reverse) or (read.is_read1 and read.mate_is_reverse):
-                        trout['_minus_'].write(read)
-                (t.close() for t in trout.values())
+                jobs.append((os.path.abspath(bam.path), outnames))
+            for bam, (nsplit, elapsed) in zip(bamfiles, pool_map(_split_strands, jobs, kw.get('processes'))):
+                self.debug("%s: %i reads split in %.1fs (%.0f reads/s)"
+                           % (bam.name, nsplit, elapsed, nsplit/max(elapsed,1e-6)))
         format = kw.get('output', 'sql')
         info = {'datatype': 'quantitative', 'read_extension': read_extension}
         if merge_strands >= 0:
@@ -159,14 +193,23 @@ each alignment will be considered, default is read length).
         else:
             suffixes = ["fwd", "rev"]
         chrmeta = bamfiles[0].chrmeta
-        files = {}
+        files = dict((o,[None]*len(sample)) for o,sample in samples.items())
+        jobs = [(o,n,s) for o,sample in samples.items() for n,s in enumerate(sample)]
+        maxjobs = nprocs(kw.get('processes'))
         with execution(None) as ex:
-            files = dict((o,[bam_to_density( ex, s, output[o][n], nreads=_nreads[n],
-                                             merge=merge_strands,
-                                             read_extension=read_extension,
-                                             sql=True, se=single_end, args=b2wargs )
-                             for n,s in enumerate(sample)])
-                         for o,sample in samples.items())
+            running = []
+            for o,n,s in jobs:
+                if len(running) >= maxjobs:
+                    o0,n0,job = running.pop(0)
+                    files[o0][n0] = job.wait()
+                job = bam_to_density.nonblocking( ex, s, output[o][n], nreads=_nreads[n],
+                                                  merge=merge_strands,
+                                                  read_extension=read_extension,
+                                                  sql=True, se=single_end, args=b2wargs,
+                                                  via='local' )
+                running.append((o,n,job))
+            for o,n,job in running:
+                files[o][n] = job.wait()
         for suf in suffixes:
             all_s_files = dict((o,[x for y in f for x in y if x.endswith(suf+".sql")])
                                for o,f in files.items())
@@ -175,14 +218,14 @@ each alignment will be considered, default is read length).
                 if len(sfiles) > 1:
                     x = self.temporary_path(fname="Density_average"+orient+suf+".sql")
                     tsql = track( x, fields=['start', 'end', 'score'], chrmeta=chrmeta, info=info )
-                    insql = []
                     for f in sfiles:
                         t = track( f, format='sql', fields=['start', 'end', 'score'],
                                    chrmeta=chrmeta, info=info )
                         t.save()
-                        insql.append(t)
-                    for c in tsql.chrmeta:
-                        tsql.write(merge_scores([t.read(c) for t in insql]),chrom=c)
+                        t.close()
+                    write_by_chrom(tsql, _average_chrom, tsql.chrmeta, args=(sfiles,),
+                                   processes=kw.get('processes'),
+                                   tmpdir=self.temporary_path(fname='partials'))
                 else:
                     x = sfiles[0]
                     tsql = track( x, format='sql', fields=['start', 'end', 'score'],
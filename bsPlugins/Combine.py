@@ -1,7 +1,9 @@
 from bsPlugins import *
-from bbcflib.gfminer.stream import combine
-from bbcflib.track import track, FeatureStream
+from bsPlugins.base.parallel import write_by_chrom, open_track, processes_parameter
+from bsPlugins.base.intervals import sweep_combine
+from bbcflib.track import track
 from bbcflib import genrep
+import numpy
 
 
 class CombineForm(BaseForm):
@@ -17,11 +19,17 @@ class CombineForm(BaseForm):
                                    validator=twc.Validator(required=True),
                                    help_text='Format of the output file')
     assembly = twf.SingleSelectField(label='Assembly: ',
-                                     options=genrep.GenRep().assemblies_available(),
+                                     options=assemblies_available(),
                                      help_text='Reference genome')
     submit = twf.SubmitButton(id="submit", value="Quantify")
 
 
+class IntersectForm(CombineForm):
+    min_tracks = twf.TextField(label='Minimum number of tracks: ',
+                               validator=twc.IntValidator(required=False),
+                               help_text='Keep the regions covered by at least this number of tracks (default: all)')
+
+
 meta = {'version': "1.0.0",
         'author': "BBCF",
         'contact': "webmaster-bbcf@epfl.ch"}
@@ -29,7 +37,10 @@ meta = {'version': "1.0.0",
 output_opts=["sql","bed","sga"],
 in_parameters = [{'id': 'tracks', 'type': 'track', 'multiple': True, 'required': True, 'label': 'Tracks: ', 'help_text': 'Select files to combine', },
                  {'id': 'output', 'type': 'listing', 'required': True, 'label': 'Otput format: ', 'help_text': 'Format of the output file', 'options': output_opts, 'prompt_text': None},
-                 {'id': 'assembly', 'type': 'assembly', 'label': 'Assembly: ', 'help_text': 'Reference genome', 'options': genrep.GenRep().assemblies_available()}]
+                 {'id': 'assembly', 'type': 'assembly', 'label': 'Assembly: ', 'help_text': 'Reference genome', 'options': assemblies_available()},
+                 processes_parameter]
+intersect_parameters = in_parameters+[
+                 {'id': 'min_tracks', 'type': 'int', 'label': 'Minimum number of tracks: ', 'help_text': 'Keep the regions covered by at least this number of tracks (default: all)'}]
 out_parameters = [{'id': 'combined', 'type': 'track'}]
 
 
@@ -41,7 +52,12 @@ def _get_chrmeta(**kw):
         chrmeta = assembly.chrmeta
     return chrmeta
 
-def _combine(func,output,**kw):
+def _combine_chrom(chrom, plugin, paths, chrmeta, whole_chrom=False):
+    trackList = [open_track(sig, chrmeta=chrmeta).read(chrom) for sig in paths]
+    length = chrmeta[chrom]['length'] if whole_chrom else None
+    return sweep_combine(trackList, plugin._func, chrom=chrom, length=length)
+
+def _combine(plugin,output,whole_chrom=False,**kw):
     chrmeta = _get_chrmeta(**kw)
     format = kw.get('output') or 'sql'
     output += format
@@ -49,14 +65,14 @@ def _combine(func,output,**kw):
     tracks = kw['tracks']
     if not isinstance(tracks, list):
         tracks = [tracks]
-    tracks = [track(sig, chrmeta=chrmeta) for sig in tracks]
-    chrmeta = tracks[0].chrmeta
+    chrmeta = track(tracks[0], chrmeta=chrmeta).chrmeta
     tout = track(output, chrmeta=chrmeta, info={'datatype': 'qualitative'})
-    for chrom in chrmeta:
-        trackList = [sig.read(chrom) for sig in tracks]
-        res = combine(trackList, fn=func)
+    def _set_fields(res, chrom):
         tout.fields = res.fields
-        tout.write(res, chrom=chrom, clip=True)
+        return res
+    write_by_chrom(tout, _combine_chrom, chrmeta, args=(plugin, tracks, chrmeta, whole_chrom),
+                   processes=kw.get('processes'), wrap=_set_fields,
+                   tmpdir=plugin.temporary_path(fname='partials'))
     tout.close()
     return output
 
@@ -66,16 +82,20 @@ class IntersectPlugin(BasePlugin):
         'title': 'Intersection of a set of tracks',
         'description': 'Returns a new track with only regions covered in every input track.',
         'path': ['Intervals', 'Intersect'],
-#        'output': CombineForm,
-        'in': in_parameters,
+#        'output': IntersectForm,
+        'in': intersect_parameters,
         'out': out_parameters,
         'meta': meta,
         }
+    min_tracks = 0
     def _func(self,X):
-        return all(X)
+        if self.min_tracks:
+            return numpy.sum(X, axis=0) >= self.min_tracks
+        return numpy.all(X, axis=0)
     def __call__(self, **kw):
+        self.min_tracks = int(kw.get('min_tracks') or 0)
         output = self.temporary_path(fname='combined.')
-        output = _combine(self._func,output,**kw)
+        output = _combine(self,output,**kw)
         self.new_file(output, 'combined')
         return self.display_time()
 
@@ -90,10 +110,10 @@ class UnionPlugin(BasePlugin):
         'meta': meta,
         }
     def _func(self,X):
-        return any(X)
+        return numpy.any(X, axis=0)
     def __call__(self, **kw):
         output = self.temporary_path(fname='combined.')
-        output = _combine(self._func,output,**kw)
+        output = _combine(self,output,**kw)
         self.new_file(output, 'combined')
         return self.display_time()
 
@@ -108,10 +128,10 @@ class SubtractPlugin(BasePlugin):
         'meta': meta,
         }
     def _func(self,X):
-        return X[0] and not any(X[1:])
+        return numpy.logical_and(X[0], numpy.logical_not(numpy.any(X[1:], axis=0)))
     def __call__(self, **kw):
         output = self.temporary_path(fname='combined.')
-        output = _combine(self._func,output,**kw)
+        output = _combine(self,output,**kw)
         self.new_file(output, 'combined')
         return self.display_time()
 
@@ -128,35 +148,10 @@ class ComplementPlugin(BasePlugin):
     def _func(self,X):
         """Same as for Subtract, since Complement is subtraction from whole chromosome of a set of features.
            Same as the others with func = 'not any(X)' would forget the extremities of the chromosome."""
-        return X[0] and not any(X[1:])
+        return numpy.logical_and(X[0], numpy.logical_not(numpy.any(X[1:], axis=0)))
     def __call__(self, **kw):
-        # Create a track with the whole chromosome
-        chrmeta = _get_chrmeta(**kw)
-        #sig0 = track(kw['TrackMulti']['tracks'][0])
-        sig0 = track(kw['tracks'][0])
-        fields = sig0.fields
-        format = sig0.format
-        is_chr = 'chr' in fields
-        _f0 = ('chr','start','end') if is_chr else ('start','end')
-        _f1 = [f for f in fields if f not in _f0]
-        whole_chr = []
-        if is_chr:
-            for chr in chrmeta:
-                whole_chr.append( (chr,0,chrmeta[chr]['length'])+('0',)*len(_f1) )
-        else:
-            fields = [f for f in fields if f not in ['start','end']]
-            fields = ['start','end']+fields
-            for chr in chrmeta:
-                whole_chr.append( (0,chrmeta[chr]['length'])+('0',)*len(_f1) )
-        whole_chr = FeatureStream(whole_chr,fields=fields)
-        temp = self.temporary_path()+'.'+format
-        with track(temp,fields=fields) as wc:
-            wc.write(whole_chr)
-
-        #kw['TrackMulti']['tracks'] = [temp] + kw['TrackMulti']['tracks']
-        kw['tracks'] = [temp] + kw['tracks']
         output = self.temporary_path(fname='combined.')
-        output = _combine(self._func,output,**kw)
+        # The whole chromosomes are added from their lengths in the sweep
+        output = _combine(self,output,whole_chrom=True,**kw)
         self.new_file(output, 'combined')
         return self.display_time()
-
@@ -1,11 +1,120 @@
 from bsPlugins import *
-from bbcflib.track import convert, _track_map
-from bbcflib import genrep
+from bsPlugins.base.parallel import write_by_chrom, nprocs, processes_parameter
+from bbcflib.track import track, convert, _track_map, FeatureStream
+from collections import OrderedDict
 import os
 
 format_list = ['bedgraph', 'wig', 'bed', 'sql', 'gff', 'sga', 'bigwig']
 to_map = {'sql': ['dtype', 'assembly'], 'bigwig': ['assembly']}
 dtype_opts = ['quantitative', 'qualitative']
+# Text formats with the chromosome in the first column of every feature line
+split_formats = ['bed', 'bedgraph', 'gff']
+_comments = ('track', 'browser', '#')
+_block = 1 << 16
+
+
+class NotSortedError(ValueError):
+    """The input track is not sorted by chromosome."""
+    pass
+
+
+def _data_line(f, offset):
+    """Offset and chromosome of the first feature line starting at or after *offset*."""
+    if offset > 0:
+        f.seek(offset-1)
+        f.readline()
+    else:
+        f.seek(0)
+    while True:
+        pos = f.tell()
+        line = f.readline()
+        if not line:
+            return pos, None
+        if line.strip() and not line.startswith(_comments):
+            return pos, line.split(None, 1)[0]
+
+
+def _chrom_ranges(path):
+    """
+    Locate the chromosomes of a text track sorted by chromosome with a few
+    seeks: a part of the file starting and ending on the same chromosome is
+    assumed to contain only this chromosome, other parts are bisected until
+    they are small enough to be scanned.
+    :return: the header (lines before the first feature), and the list of
+        ``(chrom, start, end)`` byte ranges, or None if a chromosome is found twice.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        first, chrom = _data_line(f, 0)
+        f.seek(0)
+        header = f.read(first)
+        if chrom is None:
+            return header, []
+        starts = [(first, chrom)]
+
+        def _scan(lo, hi):
+            f.seek(lo)
+            pos, current = lo, starts[-1][1]
+            while pos < hi:
+                line = f.readline()
+                if line.strip() and not line.startswith(_comments):
+                    c = line.split(None, 1)[0]
+                    if c != current:
+                        starts.append((pos, c))
+                        current = c
+                pos += len(line)
+
+        def _bisect(lo, clo, hi, chi):
+            if clo == chi:
+                return
+            if hi-lo <= _block:
+                return _scan(lo, hi)
+            mid, cmid = _data_line(f, (lo+hi)//2)
+            if mid >= hi:
+                return _scan(lo, hi)
+            _bisect(lo, clo, mid, cmid)
+            if cmid != starts[-1][1]:
+                starts.append((mid, cmid))
+            _bisect(mid, cmid, hi, chi)
+
+        _bisect(first, chrom, size, None)
+    chroms = [c for _,c in starts]
+    if len(set(chroms)) < len(chroms):
+        return header, None
+    ends = [pos for pos,_ in starts[1:]]+[size]
+    return header, [(c, pos, end) for (pos,c),end in zip(starts, ends)]
+
+
+def _convert_chrom(chrom, infile, format, header, ranges, chrmeta, tmpdir):
+    """
+    Copy the header and the byte range of *chrom* to a part file, checking
+    that it contains only this chromosome, and parse it. The part file is
+    deleted once the stream is read.
+    """
+    start, end = ranges[chrom]
+    part = os.path.join(tmpdir, 'part_%s.%s' % (chrom, format))
+    with open(infile, 'rb') as fin:
+        with open(part, 'wb') as fout:
+            fout.write(header)
+            fin.seek(start)
+            remaining = end-start
+            for line in fin:
+                if remaining <= 0: break
+                remaining -= len(line)
+                if line.strip() and not line.startswith(_comments) \
+                        and line.split(None, 1)[0] != chrom:
+                    raise NotSortedError("File %s is not sorted by chromosome." % infile)
+                fout.write(line)
+    tpart = track(part, format=format, chrmeta=chrmeta)
+    stream = tpart.read(chrom)
+    def _read():
+        try:
+            for x in stream: yield x
+        finally:
+            tpart.close()
+            os.remove(part)
+    return FeatureStream(_read(), fields=stream.fields)
+
 
 class FileConvertForm(BaseForm):
     hover_help = True
@@ -26,7 +135,7 @@ class FileConvertForm(BaseForm):
         options=['quantitative', 'qualitative'],
         help_text='Choose sql data type attribute')
     assembly = twf.SingleSelectField(label='Assembly: ',
-        options=genrep.GenRep().assemblies_available(),
+        options=assemblies_available(),
         help_text='Reference genome')
     submit = twf.SubmitButton(id="submit", value="Convert")
 
@@ -38,7 +147,8 @@ meta = {'version': "1.0.0",
 in_parameters = [{'id': 'infile', 'type': 'track', 'required': True, 'label': 'File: ', 'help_text': 'Select file'},
                  {'id': 'to', 'type': 'list', 'required': True, 'label': 'Output format: ', 'help_text': 'Select the format of your result', 'options': format_list, 'mapping': to_map, 'prompt_text': None },
                  {'id': 'dtype', 'type': 'list', 'label': 'Output datatype: ', 'help_text':'Choose sql data type attribute', 'options': dtype_opts, 'prompt_text':None},
-                 {'id': 'assembly', 'type': 'assembly', 'label': 'Assembly: ', 'help_text': 'Reference genome', 'options': genrep.GenRep().assemblies_available()}]
+                 {'id': 'assembly', 'type': 'assembly', 'label': 'Assembly: ', 'help_text': 'Reference genome', 'options': assemblies_available()},
+                 processes_parameter]
 
 out_parameters = [{'id': 'converted_file', 'type': 'track'}]
 
@@ -56,13 +166,47 @@ class FileConvertPlugin(BasePlugin):
         'meta': meta,
         }
 
+    def _convert_chunks(self, infile, outfile, chrmeta, info, processes=None):
+        """
+        Convert a text track sorted by chromosome, one chromosome per worker;
+        each worker writes its part to a temporary sql file, and the parts are
+        written to *outfile* in order with the bulk writer of its format.
+        Return False if there is only one process or if the input cannot be
+        split by chromosome.
+        """
+        if nprocs(processes) <= 1:
+            return False
+        with track(infile, chrmeta=chrmeta or 'guess') as tin:
+            format = tin.format.lower()
+            fields, chrmeta = tin.fields, tin.chrmeta
+        if format not in split_formats:
+            return False
+        header, ranges = _chrom_ranges(infile)
+        if ranges is None:
+            return False
+        # Chromosomes in the order of the file
+        ranges = OrderedDict((c, (start, end)) for c,start,end in ranges if c in chrmeta)
+        partmeta = OrderedDict((c, chrmeta[c]) for c in ranges)
+        tmpdir = self.temporary_path(fname='partials')
+        os.mkdir(tmpdir)
+        try:
+            with track(outfile, chrmeta=chrmeta, fields=fields, info=info) as tout:
+                write_by_chrom(tout, _convert_chrom, partmeta,
+                               args=(infile, format, header, ranges, chrmeta, tmpdir),
+                               processes=processes, tmpdir=tmpdir)
+        except NotSortedError:
+            if os.path.exists(outfile): os.remove(outfile)
+            return False
+        return True
+
     def __call__(self, **kw):
         ext = kw.get('to','sql')
         info = {'datatype': kw.get('datatype') or 'qualitative'}
         infile = kw.get('infile')
         fname = os.path.splitext(os.path.split(infile)[-1])[0]
         outfile = self.temporary_path(fname=fname, ext=ext)
-        convert(infile, outfile,
-                chrmeta=kw.get('assembly') or None, info=info)
+        if not self._convert_chunks(infile, outfile, kw.get('assembly'), info, kw.get('processes')):
+            convert(infile, outfile,
+                    chrmeta=kw.get('assembly') or None, info=info)
         self.new_file(outfile, 'converted_file')
         return self.display_time()
@@ -1,6 +1,9 @@
 from bsPlugins import *
-from bbcflib.track import track,stats
+from bbcflib.track import track
 from bbcflib import genrep
+from bsPlugins.base.arrays import stream_chunks
+from bsPlugins.base.parallel import chrom_map, open_track, close_tracks, processes_parameter
+from bsPlugins.base.statistics import TrackStats
 import os
 
 output_list = ['txt','pdf']
@@ -12,10 +15,21 @@ meta = {'version': "1.0.0",
 in_parameters = [
         {'id':'sample', 'type':'track', 'required':True, 'label': 'Input file: ', 'help_text': 'Select the file to examine'},
         {'id':'output', 'type':'list', 'required':True, 'label': 'Ouput: ', 'help_text': 'Type of report', 'options': output_list, 'prompt_text': None},
-        {'id':'by_chrom', 'type':'boolean', 'required':True, 'label': 'By chromosome: ', 'help_text': 'Split statistics by chromosome (default: whole genome)', 'value': False}]
+        {'id':'by_chrom', 'type':'boolean', 'required':True, 'label': 'By chromosome: ', 'help_text': 'Split statistics by chromosome (default: whole genome)', 'value': False},
+        processes_parameter]
 out_parameters = [{'id':'stats', 'type':'file'},
                   {'id':'pdf', 'type':'file'}]
 
+def _stats_chrom(chrom, path):
+    """Statistics of the features of track *path* on *chrom*, read by chunks."""
+    t = open_track(path, chrmeta="guess")
+    fields = ['start','end']+(['score'] if 'score' in t.fields else [])
+    st = TrackStats()
+    for chunk in stream_chunks(t.read(chrom, fields=fields), fields=fields):
+        st.add(*chunk)
+    return st
+
+
 class FileStatisticsForm(BaseForm):
     child = twd.HidingTableLayout()
     sample = twb.BsFileField(label='Input file: ',
@@ -34,7 +48,8 @@ class FileStatisticsForm(BaseForm):
 
 class FileStatisticsPlugin(BasePlugin):
     """Calculates diverse statistics from a track file,
-    such as a distribution of scores and feature lengths, and prints them to the output file."""
+    such as a distribution of scores and feature lengths, and prints them to the output file.
+    The track is read once. Medians and quartiles are approximate."""
     info = {
         'title': 'Basic track statistics',
         'description': __doc__,
@@ -109,20 +124,23 @@ points(men,ypos,pch=19,col='blue')
             out = open(output,"w")
         else:
             out = {}
+        results = chrom_map(_stats_chrom, sample.chrmeta, (kw['sample'],), kw.get('processes'))
+        close_tracks()
         if by_chrom:
-            chromlist = sample.chrmeta.keys()
+            sections = zip(sample.chrmeta, results)
         else:
-            chromlist = [None]
-        for chrom in chromlist:
+            genome = TrackStats()
+            for st in results: genome.merge(st)
+            sections = [(None, genome)]
+        for chrom, st in sections:
             if outf == 'txt':
                 if chrom:
                     out.write("Chromosome %s\n--------------------\n"%chrom)
-                stats(sample,out=out,selection=chrom)
+                st.write(out)
+                if chrom:
+                    out.write("\n--------------------\n")
             else:
-                out[chrom] = {}
-                stats(sample,out=out[chrom],selection=chrom)
-            if outf == 'txt' and chrom:
-                out.write("\n--------------------\n")
+                out[chrom] = st.as_dict()
         if outf == 'txt':
             out.close()
             self.new_file(output, 'stats')
@@ -1,5 +1,6 @@
 from bsPlugins import *
-import tarfile, os, sys, pysam
+from bsPlugins.base.parallel import pool_map, processes_parameter
+import tarfile, os, sys, time, subprocess, pysam
 
 meta = {'version': "1.0.0",
         'author': "BBCF",
@@ -7,7 +8,8 @@ meta = {'version': "1.0.0",
 
 in_parameters = [{'id': 'bamfiles', 'type': 'bam', 'required': True, 'multiple': True, 'label': 'Paired-ended BAM files: ' },
                  {'id': 'minlength', 'type': 'int', 'label': 'Minimum fragment length: '},
-                 {'id': 'maxlength', 'type': 'int', 'label': 'Maximum fragment length: '}]
+                 {'id': 'maxlength', 'type': 'int', 'label': 'Maximum fragment length: '},
+                 processes_parameter]
 out_parameters = [{'id': 'fragment_track', 'type': 'track'},
                   {'id': 'fragment_track_tar', 'type': 'file'}]
 
@@ -22,6 +24,49 @@ class FragLengthForm(BaseForm):
                               validator=twc.IntValidator(required=False))
     submit = twf.SubmitButton(id="submit", value="Filter")
 
+def _in_range(read, minlength, maxlength):
+    if not read.is_proper_pair: return False
+    if read.is_reverse:
+        size = -read.isize
+    else:
+        size = read.isize
+    return size >= minlength and size <= maxlength
+
+def _filter_chrom(bampath, chrom, part, minlength, maxlength):
+    """Write the reads of *chrom* in the fragment length range to BAM file *part*.
+    Returns the number of reads read and the time it took."""
+    t0 = time.time()
+    nreads = 0
+    bam = pysam.Samfile(bampath, 'rb')
+    out = pysam.Samfile(part, 'wb', template=bam)
+    try:
+        for read in bam.fetch(chrom):
+            nreads += 1
+            if _in_range(read, minlength, maxlength): out.write(read)
+    finally:
+        out.close()
+        bam.close()
+    return nreads, time.time()-t0
+
+def _concatenate(parts, outname):
+    """Concatenate BAM files with the same header, without recompressing them if samtools is available."""
+    if len(parts) == 1:
+        os.rename(parts[0], outname)
+        return
+    try:
+        subprocess.check_call(['samtools', 'cat', '-o', outname]+parts)
+    except (OSError, subprocess.CalledProcessError):
+        first = pysam.Samfile(parts[0], 'rb')
+        out = pysam.Samfile(outname, 'wb', template=first)
+        first.close()
+        for part in parts:
+            bam = pysam.Samfile(part, 'rb')
+            for read in bam: out.write(read)
+            bam.close()
+        out.close()
+    for part in parts: os.remove(part)
+
+
 class FragLengthPlugin(BasePlugin):
     """Computes BAM files with fragment lengths between minlength and maxlength."""
     info = {
@@ -46,22 +91,38 @@ class FragLengthPlugin(BasePlugin):
             if minlength > maxlength:
                 raise ValueError("Empty range: %i:%i" %(minlength,maxlength))
         all_tracks = []
+        jobs = []
         for bam in bamfiles:
             tname = bam.filename.split("/")[-1].split(".")[0]+"_minlength"+str(minlength)+"_maxlength"+str(maxlength)+".bam"
             outname = self.temporary_path(fname=tname)
             all_tracks.append(outname)
+            if os.path.exists(bam.filename+".bai"):
+                # Filtered by chromosome in parallel, each part compressed by its own process
+                parts = [outname+".%i.part" %n for n in range(len(bam.references))]
+                jobs.append((bam.filename, outname, parts))
+                continue
             trout = pysam.Samfile(outname, "wb", template=bam)
             for read in bam:
-                if not read.is_proper_pair: continue
-                if read.is_reverse:
-                    size = -read.isize
-                else:
-                    size = read.isize
-                if (size >= minlength and size <= maxlength):
+                if _in_range(read, minlength, maxlength):
                     trout.write(read)
+            trout.close()
+        if jobs:
+            chroms = dict((bam.filename, bam.references) for bam in bamfiles)
+            args = [(path, chrom, part, minlength, maxlength)
+                    for path, outname, parts in jobs
+                    for chrom, part in zip(chroms[path], parts)]
+            results = iter(pool_map(_filter_chrom, args, kw.get('processes')))
+            for path, outname, parts in jobs:
+                counts = [results.next() for part in parts]
+                nreads = sum(n for n,t in counts)
+                elapsed = sum(t for n,t in counts)
+                self.debug("%s: %i reads filtered in %.1fs (%.0f reads/s)"
+                           % (os.path.basename(path), nreads, elapsed, nreads/max(elapsed,1e-6)))
+                _concatenate(parts, outname)
         if len(all_tracks) > 1:
-            tarname = self.temporary_path(fname='BAM_filtered_by_fragment_length.tgz')
-            tar_tracks = tarfile.open(tarname, "w:gz")
+            # BAM files are compressed already
+            tarname = self.temporary_path(fname='BAM_filtered_by_fragment_length.tar')
+            tar_tracks = tarfile.open(tarname, "w")
             [tar_tracks.add(f,arcname=os.path.basename(f)) for f in all_tracks]
             tar_tracks.close()
             self.new_file(tarname, 'fragment_track_tar')
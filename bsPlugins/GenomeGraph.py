@@ -11,7 +11,7 @@ meta = {'version': "1.0.0",
 in_parameters = [{'id': 'signals_plus', 'type': 'track', 'multiple': True, 'label': 'Positive signals: ', 'help_text': 'Signal files (e.g. bedgraph) to plot above the axis'},
                  {'id': 'signals_minus', 'type': 'track', 'multiple': True, 'label': 'Negative signals: ', 'help_text': 'Signal files (e.g. bedgraph) to plot below the axis'},
                  {'id': 'features', 'type': 'track', 'multiple': True, 'label': 'Features: ','help_text': 'Features files (e.g. bed) to plot as segments on the axis'},
-                 {'id': 'assembly', 'type': 'assembly', 'label': 'Assembly: ', 'help_text': 'Reference genome', 'options': genrep.GenRep().assemblies_available()}]
+                 {'id': 'assembly', 'type': 'assembly', 'label': 'Assembly: ', 'help_text': 'Reference genome', 'options': assemblies_available()}]
 out_parameters = [{'id': 'genome_graph', 'type': 'pdf'}]
 
 class GenomeGraphForm(BaseForm):
@@ -31,7 +31,7 @@ class GenomeGraphForm(BaseForm):
                                    help_text='Features files (e.g. bed) to plot as segments on the axis',
                                    validator=twb.BsFileFieldValidator(required=False))
     assembly = twf.SingleSelectField(label='Assembly: ',
-                                     options=genrep.GenRep().assemblies_available(),
+                                     options=assemblies_available(),
                                      help_text='Reference genome')
     submit = twf.SubmitButton(id="submit", value="Plot")
 
@@ -69,7 +69,7 @@ class GenomeGraphPlugin(BasePlugin):
             chrmeta = ftracks[0].chrmeta
         else:
             raise ValueError("No data provided")
-        if assembly in [x[0] for x in genrep.GenRep().assemblies_available()]:
+        if assembly in [x[0] for x in assemblies_available()]:
             chrnames = genrep.Assembly(assembly).chrnames
         else:
             chrnames = [x[1] for x in sorted([(v['length'],c) for c,v in chrmeta.iteritems()],reverse=True)]
@@ -1,5 +1,5 @@
 from bsPlugins import *
-from itertools import combinations
+from itertools import combinations, izip
 from bbcflib.gfminer.figure import venn
 import os, tarfile
 
@@ -27,6 +27,48 @@ out_parameters = [{'id': 'intersections', 'type': 'track'},
                   {'id': 'venn_diagram', 'type': 'file'}]
 
 
+def _element_masks(files_list, idx=0):
+    """
+    Read each file once and return the elements in order of first appearance,
+    the bitmask of the files containing each of them (bit i for file i),
+    and the number of lines of each file.
+    """
+    masks = {}
+    elements = []
+    nlines = []
+    for i,f in enumerate(files_list):
+        bit = 1 << i
+        n = 0
+        with open(f) as fin:
+            for line in fin:
+                n += 1
+                x = line.strip().split()[idx]
+                if x not in masks:
+                    masks[x] = 0
+                    elements.append(x)
+                masks[x] |= bit
+        nlines.append(n)
+    return elements, [masks[x] for x in elements], nlines
+
+
+def _combination_members(elements, masks):
+    """
+    Map each combination of files, as a bitmask, to the elements common to
+    all of them. Elements are grouped by mask, then each group is added to
+    every sub-combination of its mask, so the work is proportional to the output.
+    """
+    groups = {}
+    for x,m in izip(elements, masks):
+        groups.setdefault(m, []).append(x)
+    members = {}
+    for m, group in groups.iteritems():
+        sub = m
+        while sub:
+            members.setdefault(sub, []).extend(group)
+            sub = (sub-1) & m
+    return members
+
+
 class IntersectionsPlugin(BasePlugin):
     """Returns the elements that are common to a set of text files,
 for instance the list of genes common to several lists of genes or annotation files.
@@ -36,8 +78,9 @@ are performed (2-by-2, 3-by-3, etc.), in the manner of a Venn diagram.
 If the elements to intersect are not in the first column, one can specify the column to consider
 by its index (first column is 1).
 
-Since the number of comparisons is approximately 2^(number of files), it is unadvised to compare more
-that a dozen of files (10 input files -> 2^10-11=1013 comparisons).
+Each file is read once, and every element is labeled by the set of files that contain it,
+so that all intersections are obtained by grouping the elements by label. The number of
+output files is still approximately 2^(number of files) (15 input files -> 2^15-16=32752 lists).
 
 The output is a compressed folder containing a summary file and a sub-folder with all the possible
 intersections, i.e. for each intersection one text file with the list of common elements.
@@ -51,17 +94,6 @@ intersections, i.e. for each intersection one text file with the list of common
         'out': out_parameters,
         'meta': meta,
         }
-
-    def intersect(self, files_list, idx=0):
-        common = set()
-        for n,f in enumerate(files_list):
-            col = set(line.strip().split()[idx] for line in open(f))
-            if n==0:
-                common = col
-            else:
-                common &= col
-        return common
-
     def compare(self, files_list, output, idx=0):
         if not os.path.exists(output):
             os.mkdir(output)
@@ -74,10 +106,11 @@ intersections, i.e. for each intersection one text file with the list of common
             legend[i] = f
         summary.write("\n### Files\tnb_elements\n")
         summary.write("\n# Self\n\n")
+        elements, masks, nlines = _element_masks(files_list, idx)
+        members = _combination_members(elements, masks)
         for i,f in enumerate(files_list):
-            nlines = len(open(f).readlines())
-            summary.write("%d\t%d\n" % (i,nlines))
-            counts[str(i)] = nlines
+            summary.write("%d\t%d\n" % (i,nlines[i]))
+            counts[str(i)] = nlines[i]
         for k in range(2,len(files_list)+1):
             summary.write("\n# %d-by-%d\n\n" % (k,k))
             path = os.path.join(output,"%s-by-%s/" % (k,k))
@@ -88,7 +121,7 @@ intersections, i.e. for each intersection one text file with the list of common
                 names = sorted([str(x) for x in cb])
                 name = "|".join(names)
                 out = open(os.path.join(path,"%s.txt" % name), 'wb')
-                common = self.intersect([files_list[i] for i in cb], idx)
+                common = members.get(sum(1 << i for i in cb), [])
                 summary.write("%s\t%s\n" % (name,len(common)))
                 counts[name] = len(common)
                 for x in common:
@@ -7,7 +7,7 @@ import os
 class List2TrackForm(BaseForm):
     child = twd.HidingTableLayout()
     assembly = twf.SingleSelectField(label='Assembly: ',
-        options=genrep.GenRep().assemblies_available(),
+        options=assemblies_available(),
         help_text='Reference genome',
         validator=twc.Validator(required=True), )
     feature_type = twf.SingleSelectField(label='Feature type: ',
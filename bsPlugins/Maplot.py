@@ -1,6 +1,5 @@
 from bsPlugins import *
 from bbcflib.track import track
-from bbcflib import genrep
 import os, shutil
 from bbcflib.maplot import MAplot
 
@@ -54,7 +53,7 @@ class MaplotForm(BaseForm):
         value=prom_down_def,
         help_text='Size of promoter downstream of TSS')
     assembly = twf.SingleSelectField(label='Assembly: ',
-        options=genrep.GenRep().assemblies_available(),
+        options=assemblies_available(),
         validator=twc.Validator(required=True),
         help_text='Reference genome')
     submit = twf.SubmitButton(id="submit", value="Submit")
@@ -72,7 +71,7 @@ in_parameters = [
         {'id': 'feature_type', 'type': 'list', 'required': True, 'label': 'Feature type: ', 'help_text': 'Choose a feature set or upload your own', 'options': ftypes, 'prompt_text': None, 'mapping': f_map},
         {'id': 'upstream', 'type': 'int', 'required': True, 'label': 'Promoter upstream distance: ', 'help_text': 'Size of promoter upstream of TSS', 'value': prom_up_def},
         {'id': 'downstream', 'type': 'int', 'required': True, 'label': 'Promoter downstream distance: ', 'help_text': 'Size of promoter downstream of TSS', 'value': prom_down_def},
-        {'id': 'assembly', 'type': 'assembly', 'required': True, 'label': 'Assembly: ', 'help_text': 'Reference genome','options': genrep.GenRep().assemblies_available()},
+        {'id': 'assembly', 'type': 'assembly', 'required': True, 'label': 'Assembly: ', 'help_text': 'Reference genome','options': assemblies_available()},
         {'id': 'features', 'type': 'track', 'required': True, 'label': 'Custom feature set: ', 'help_text': 'Select a feature file (e.g. bed)'}]
 
 out_parameters = [{'id': 'MA-plot', 'type': 'file'}]
@@ -1,8 +1,11 @@
 from bsPlugins import *
+from bsPlugins.base.parallel import write_by_chrom, open_track, processes_parameter
+from bsPlugins.base.columns import read_stream
+from bsPlugins.base.arrays import aligned_chunks
+from bsPlugins.base.shift import estimate_shift
 from bbcflib.gfminer.stream import merge_scores
-from bbcflib.gfminer.numeric import correlation
 from bbcflib.track import track, FeatureStream
-from bbcflib import genrep
+import numpy
 
 output_opts = ['sql','bed','bedGraph','wig','bigWig','sga']
 method_opts = ['mean','min','max','geometric','median','sum']
@@ -16,7 +19,7 @@ in_parameters = [{'id': 'forward', 'type': 'track', 'required': True, 'label': '
                  {'id': 'reverse', 'type': 'track', 'required': True, 'label': 'Reverse: ',
                   'help_text': 'Select reverse density file' },
                  {'id': 'assembly', 'type': 'assembly', 'label': 'Assembly: ',
-                  'help_text': 'Reference genome', 'options': genrep.GenRep().assemblies_available()},
+                  'help_text': 'Reference genome', 'options': assemblies_available()},
                  {'id': 'shift', 'type': 'int', 'required': True, 'label': 'Shift: ',
                   'help_text': 'Enter positive downstream shift ([fragment_size-read_length]/2), \nor a negative value to estimate shift by cross-correlation', 'value': 0},
                  {'id': 'format', 'type': 'listing', 'label': 'Output format: ',
@@ -24,9 +27,17 @@ in_parameters = [{'id': 'forward', 'type': 'track', 'required': True, 'label': '
                   'options': output_opts, 'prompt_text': None},
                  {'id': 'method', 'type': 'radio', 'label': 'Method: ',
                   'help_text': 'Select the score combination method',
-                  'options': method_opts, 'value': 'mean'}]
+                  'options': method_opts, 'value': 'mean'},
+                 processes_parameter]
 out_parameters = [{'id': 'density_merged', 'type': 'track'}]
 
+_reductions = {'mean': lambda x: x.mean(axis=0),
+               'min': lambda x: x.min(axis=0),
+               'max': lambda x: x.max(axis=0),
+               'geometric': lambda x: numpy.prod(x, axis=0)**(1./len(x)),
+               'median': lambda x: numpy.median(x, axis=0),
+               'sum': lambda x: x.sum(axis=0)}
+
 
 class MergeTracksForm(BaseForm):
     forward = twb.BsFileField(label='Forward: ',
@@ -36,7 +47,7 @@ class MergeTracksForm(BaseForm):
                               help_text='Select reverse density file',
                               validator=twb.BsFileFieldValidator(required=True))
     assembly = twf.SingleSelectField(label='Assembly: ',
-                                     options=genrep.GenRep().assemblies_available(),
+                                     options=assemblies_available(),
                                      help_text='Reference genome')
     shift = twf.TextField(label='Shift: ',
                           validator=twc.IntValidator(required=True),
@@ -54,6 +65,43 @@ class MergeTracksForm(BaseForm):
     submit = twf.SubmitButton(id="submit", value='Merge tracks')
 
 
+def _shift(stream, shift):
+    istart = stream.fields.index('start')
+    iend = stream.fields.index('end')
+    i1 = min(istart, iend)
+    i2 = max(istart, iend)
+
+    def _apply_shift(x):
+        return x[:i1] + (x[i1] + shift,) + x[i1 + 1:i2] + (x[i2] + shift,) + x[i2 + 1:]
+    return FeatureStream((_apply_shift(x) for x in stream),
+                         fields=stream.fields)
+
+
+def _merge_columns(chrom, streams, shifts, method, fields):
+    """Shift, align and reduce the (start, end, score) columns of the streams by chunks."""
+    reduce = _reductions[method]
+    for start, end, scores in aligned_chunks(streams, shifts=shifts):
+        score = reduce(scores).tolist()
+        columns = {'chr': [chrom]*len(score), 'start': start.tolist(),
+                   'end': end.tolist(), 'score': score}
+        for x in zip(*[columns[f] for f in fields]):
+            yield x
+
+
+def _merge_chrom(chrom, forward, reverse, chrmeta, shiftval, method, fields):
+    if method in _reductions and all(f in ['chr','start','end','score'] for f in fields):
+        streams = [read_stream(forward, chrom, chrmeta, ['start','end','score']),
+                   read_stream(reverse, chrom, chrmeta, ['start','end','score'])]
+        return FeatureStream(_merge_columns(chrom, streams, [shiftval, -shiftval], method, fields),
+                             fields=fields)
+    # Other fields (names, strands) are merged feature by feature
+    tfwd = open_track(forward, chrmeta=chrmeta)
+    trev = open_track(reverse, chrmeta=chrmeta)
+    return merge_scores([_shift(tfwd.read(selection=chrom),  shiftval),
+                         _shift(trev.read(selection=chrom), -shiftval)],
+                        method=method)
+
+
 class MergeTracksPlugin(BasePlugin):
     """Shift and average scores from forward and reverse strand densities.
 
@@ -71,53 +119,31 @@ The output is the average of all the input signals, position by position.
         'out': out_parameters,
         'meta': meta,
         }
-
     def __call__(self, **kw):
-        def _shift(stream, shift):
-            istart = stream.fields.index('start')
-            iend = stream.fields.index('end')
-            i1 = min(istart, iend)
-            i2 = max(istart, iend)
-
-            def _apply_shift(x):
-                return x[:i1] + (x[i1] + shift,) + x[i1 + 1:i2] + (x[i2] + shift,) + x[i2 + 1:]
-            return FeatureStream((_apply_shift(x) for x in stream),
-                                       fields=stream.fields)
-
         assembly = kw.get('assembly') or 'guess'
         tfwd = track(kw.get('forward'), chrmeta=assembly)
         trev = track(kw.get('reverse'), chrmeta=assembly)
         chrmeta = tfwd.chrmeta
 
         shiftval = int(kw.get('shift', 0))
+        confidence = None
         if shiftval < 0:  # Determine shift automatically
-            shiftval = None
-            xcor_lim = 300
-            for chrom, v in chrmeta.iteritems():
-                chrsize = v['length']
-                xcor_lim = min(xcor_lim, 0.01 * chrsize)
-                xcor = correlation([tfwd.read(chrom), trev.read(chrom)], regions=(1, chrsize),
-                                   limits=(-xcor_lim, xcor_lim))
-                max_xcor_idx = xcor.argmax()
-                if xcor[max_xcor_idx] > 0.2:
-                    shiftval = (max_xcor_idx - xcor_lim - 1)/2
-                    break
-            if not shiftval:
+            shiftval, confidence = estimate_shift(kw.get('forward'), kw.get('reverse'), chrmeta)
+            if confidence <= 0.2 or not shiftval:
                 raise ValueError("Unable to detect shift automatically. Must specify a shift value.")
 
         output = self.temporary_path(fname=tfwd.name+'-'+trev.name+'_merged', 
                                      ext=kw.get('format',tfwd.format))
         outfields = [f for f in tfwd.fields if f in trev.fields]
-        tout = track(output, chrmeta=chrmeta, fields=outfields,
-                     info={'datatype': 'quantitative', 'shift': shiftval})
-        mode = 'write'
+        info = {'datatype': 'quantitative', 'shift': shiftval}
+        if confidence is not None: info['shift_confidence'] = confidence
+        tout = track(output, chrmeta=chrmeta, fields=outfields, info=info)
         method = kw.get("method","mean")
-        for chrom in chrmeta.keys():
-            tout.write(merge_scores([_shift(tfwd.read(selection=chrom),  shiftval),
-                                     _shift(trev.read(selection=chrom), -shiftval)],
-                                    method=method),
-                       chrom=chrom, mode=mode, clip=True)
-            mode = 'append'
+        write_by_chrom(tout, _merge_chrom, chrmeta,
+                       args=(kw.get('forward'), kw.get('reverse'), chrmeta, shiftval, method,
+                             outfields),
+                       processes=kw.get('processes'), mode='write',
+                       tmpdir=self.temporary_path(fname='partials'))
         tout.close()
         trev.close()
         tfwd.close()
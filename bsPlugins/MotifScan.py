@@ -9,7 +9,7 @@ import os
 
 g = genrep.GenRep()
 available_motifs = g.motifs_available()
-assembly_list = g.assemblies_available()
+assembly_list = assemblies_available()
 
 input_types = [(0, 'Fasta upload'), (1, 'Select regions from genome')]
 input_map = {0: ['fastafile'], 1: ['regions']}
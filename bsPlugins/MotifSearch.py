@@ -10,7 +10,7 @@ input_types = [(0, 'Fasta upload'), (1, 'Select regions from genome')]
 input_map = {0: ['fastafile'], 1: ['assembly', 'regions']}
 _nm = 4
 
-assembly_list = genrep.GenRep().assemblies_available()
+assembly_list = assemblies_available()
 
 meta = {'version': "1.0.0",
         'author': "BBCF",
@@ -79,7 +79,7 @@ class MotifSearchPlugin(BasePlugin):
             if str(input_type) in [str(x[0]) for x in input_types]:
                 input_type = int(input_type)
             if input_type in input_types[0]: #fasta
-                if ass in [x[0] for x in genrep.GenRep().assemblies_available()]:
+                if ass in [x[0] for x in assemblies_available()]:
                     assembly = genrep.Assembly(ass)
                 else:
                     assembly = genrep.Assembly(ex=ex,fasta=fasta)
@@ -1,9 +1,12 @@
 from bsPlugins import *
+from bsPlugins.base.parallel import pool_map, processes_parameter
+from bsPlugins.base.arrays import CHUNK_SIZE
+from bsPlugins.base.expressions import compile_expression
 from bbcflib import genrep
-from bbcflib.track import track
-from bbcflib.gfminer.common import score_threshold, apply
-from math import log10, sqrt, log
+from bbcflib.track import track, FeatureStream
+from itertools import islice
 import os, tarfile
+import numpy
 
 class NumericOperationForm(BaseForm):
     class SigMulti(twb.BsMultiple):
@@ -15,6 +18,9 @@ class NumericOperationForm(BaseForm):
                                       prompt_text=None,
                                       options=["log2","log10","sqrt"],
                                       help_text='Select a function')
+    expression = twf.TextField(label='Expression: ',
+                               validator=twc.Validator(required=False),
+                               help_text='Arithmetic expression of the score x, e.g. log2(x+1), instead of the operation')
     format = twf.SingleSelectField(label='Output format: ',
                                    options=["sql","bedgraph","bigwig","wig"],
                                    validator=twc.Validator(required=False),
@@ -28,12 +34,33 @@ meta = {'version': "1.0.0",
 
 in_parameters = [{'id': 'track', 'type': 'track', 'required': True, 'multiple': True, 'label': 'Signals: ', 'help_text': 'Select files (e.g. bedgraph)'},
                 {'id': 'function', 'type': 'listing', 'label': 'Operation: ', 'help_text': 'Select a function', 'options': ["log2","log10","sqrt"], 'prompt_text': None},
-                {'id': 'output', 'type': 'listing', 'label': 'Output format: ', 'help_text': 'Output file(s) format, by default: same format as input file(s) format(s)', 'options': ["sql","bedgraph","bigwig","wig"] }]
+                {'id': 'expression', 'type': 'text', 'label': 'Expression: ', 'help_text': 'Arithmetic expression of the score x, e.g. log2(x+1), instead of the operation'},
+                {'id': 'output', 'type': 'listing', 'label': 'Output format: ', 'help_text': 'Output file(s) format, by default: same format as input file(s) format(s)', 'options': ["sql","bedgraph","bigwig","wig"] },
+                processes_parameter]
 out_parameters = [{'id': 'converted_track_tar', 'type': 'file'},
                   {'id': 'converted_track', 'type': 'track'}]
 
-def log2(x):
-    return log(x,2)
+def _transform_chunks(stream, transform):
+    """Apply *transform* to the scores by chunks, dropping the features where it is not finite."""
+    iscore = stream.fields.index('score')
+    while True:
+        rows = list(islice(stream, CHUNK_SIZE))
+        if not rows: break
+        scores = transform([x[iscore] for x in rows])
+        values = scores.tolist()
+        for n in numpy.flatnonzero(numpy.isfinite(scores)):
+            yield tuple(rows[n][:iscore])+(values[n],)+tuple(rows[n][iscore+1:])
+
+def _numeric_operation(tname, outtemp, expression):
+    transform = compile_expression(expression)
+    tinput = track(tname)
+    out_track = track(outtemp,chrmeta=tinput.chrmeta)
+    stream = tinput.read()
+    out_track.write(FeatureStream(_transform_chunks(stream, transform), fields=stream.fields),
+                    mode='write')
+    out_track.close()
+    tinput.close()
+    return outtemp
 
 class NumericOperationPlugin(BasePlugin):
     """Apply a numeric transformation to the track scores - such as logarithm or square root."""
@@ -49,22 +76,27 @@ class NumericOperationPlugin(BasePlugin):
 
     def __call__(self, **kw):
         func = kw.get('function',"log2")
+        expression = kw.get('expression')
+        if expression:
+            compile_expression(expression)  # fails early if invalid
+            func = 'expression'
+        elif func in ["log2","log10","sqrt"]:
+            expression = func+"(x)"
+        else:
+            raise ValueError("Unknown function: %s" % func)
         #l_track = kw.get('SigMulti', {}).get('track',[])
         l_track = kw.get('track',[])
         if not isinstance(l_track, list): l_track = [l_track]
-        outall = []
+        jobs = []
         for tname in l_track :
             tinput = track(tname)
             if 'score' not in tinput.fields: continue
             format = kw.get('output',tinput.format)
             out_name = tinput.name+'_'+func+'.'+format
             outtemp = self.temporary_path(out_name)
-            out_track = track(outtemp,chrmeta=tinput.chrmeta)
-            filtered = score_threshold(tinput, strict=(func[:3] == "log"))
-            out_track.write(apply(filtered,'score',eval(func)), mode='write')
-            out_track.close()
-            outall.append(outtemp)
             tinput.close()
+            jobs.append((tname, outtemp, expression))
+        outall = pool_map(_numeric_operation, jobs, kw.get('processes'))
         if len(outall) == 1:
             self.new_file(outall[0], 'converted_track')
         elif len(outall) > 1:
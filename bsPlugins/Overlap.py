@@ -1,6 +1,7 @@
 from bsPlugins import *
-from bbcflib.gfminer.stream import overlap
-from bbcflib.track import track
+from bsPlugins.base.parallel import write_by_chrom, open_track, processes_parameter
+from bsPlugins.base.intervals import IntervalIndex, filter_stream
+from bbcflib.track import track, FeatureStream
 from bbcflib import genrep
 
 class OverlapForm(BaseForm):
@@ -16,7 +17,7 @@ class OverlapForm(BaseForm):
         validator=twc.Validator(required=True),
         help_text='Format of the output file')
     assembly = twf.SingleSelectField(label='Assembly: ',
-        options=genrep.GenRep().assemblies_available(),
+        options=assemblies_available(),
         help_text='Reference genome')
     submit = twf.SubmitButton(id="submit", value="Submit")
 
@@ -28,10 +29,17 @@ meta = {'version': "1.0.0",
 in_parameters = [{'id': 'filter', 'type': 'userfile', 'required': True, 'label': 'Filter file: ', 'help_text': 'Upload your own file'},
                  {'id': 'features', 'type': 'track', 'required': True, 'label': 'Features file: ', 'help_text': 'Upload your own file'},
                  {'id': 'output', 'type': 'listing', 'label': 'Output format: ', 'help_text': 'Format of the output file','options': ["txt","bed","sql","bedGraph","bigWig"]},
-                 {'id': 'assembly', 'type': 'assembly', 'label': 'Assembly: ', 'help_text': 'Reference genome', 'options': genrep.GenRep().assemblies_available()}]
+                 {'id': 'assembly', 'type': 'assembly', 'label': 'Assembly: ', 'help_text': 'Reference genome', 'options': assemblies_available()},
+                 processes_parameter]
 out_parameters = [{'id': 'filtered', 'type': 'track'}]
 
 
+def _overlap_chrom(chrom, features, filter, chrmeta):
+    stream = open_track(features, chrmeta=chrmeta).read(chrom)
+    index = IntervalIndex.from_stream(open_track(filter, chrmeta=chrmeta).read(chrom))
+    return FeatureStream(filter_stream(stream, index), fields=stream.fields)
+
+
 class OverlapPlugin(BasePlugin):
     """Returns only the regions of the first input file that overlap
 (or contain) some feature from the second ('filter')."""
@@ -61,8 +69,10 @@ class OverlapPlugin(BasePlugin):
         output = self.temporary_path(fname=features.name+'_filtered.'+format)
         tout = track(output, format, fields=filter.fields,
                      chrmeta=chrmeta, info={'datatype':'qualitative'})
-        for chrom in chrmeta:
-            tout.write(overlap(features.read(chrom),filter.read(chrom)), chrom=chrom,clip=True)
+        write_by_chrom(tout, _overlap_chrom, chrmeta,
+                       args=(kw['features'], kw['filter'], chrmeta),
+                       processes=kw.get('processes'),
+                       tmpdir=self.temporary_path(fname='partials'))
         tout.close()
         self.new_file(output, 'filtered')
         return self.display_time()
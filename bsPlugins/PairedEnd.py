@@ -1,9 +1,12 @@
 from bsPlugins import *
-from bbcflib.track import track
+from bsPlugins.base.parallel import chrom_map, write_by_chrom, processes_parameter
+from bsPlugins.base.arrays import arrays_stream
+from bbcflib.track import track, FeatureStream
 from bbcflib import genrep
 import rpy2.robjects as robjects
 import rpy2.robjects.numpy2ri as numpy2ri
-import os, tarfile
+import os, tarfile, array
+import numpy, pysam
 
 meta = {'version': "1.0.0",
         'author': "BBCF",
@@ -12,7 +15,8 @@ meta = {'version': "1.0.0",
 in_parameters = [{'id': 'bamfiles', 'type': 'bam', 'required': True, 'multiple': True, 'label': 'Paired-end BAM files: ', 'help_text': 'Select bam files'},
                  {'id': 'output', 'type': 'listing', 'label': 'Output format: ', 'help_text': 'Format of the output file', 'options': ['sql', 'bedGraph', 'bigWig'], 'prompt_text':None},
                  {'id': 'midpoint', 'type': 'boolean', 'label': 'At fragment midpoint: ', 'help_text': 'Attribute fragment length to its midpoint only (default: all positions in the fragment)', 'value': False},
-                 {'id': 'plot_only', 'type': 'boolean', 'label': 'Only the plot: ', 'help_text':'Do not compute the density', 'value': False}]
+                 {'id': 'plot_only', 'type': 'boolean', 'label': 'Only the plot: ', 'help_text':'Do not compute the density', 'value': False},
+                 processes_parameter]
 
 out_parameters = [{'id': 'statistics_plot', 'type': 'pdf'},
                   {'id': 'fragment_track', 'type': 'track'},
@@ -39,6 +43,90 @@ class PairedEndForm(BaseForm):
     submit = twf.SubmitButton(id="submit", value="Analyze")
 
 
+def _add_hist(a, b):
+    if len(a) < len(b): a, b = b, a
+    a = a.copy()
+    a[:len(b)] += b
+    return a
+
+
+def _fragment_density(starts, ends, sizes):
+    """Average size of the fragments covering each position, as (start, end, score) runs."""
+    pos = numpy.concatenate((starts, ends))
+    order = numpy.argsort(pos, kind='mergesort')
+    pos = pos[order]
+    dsum = numpy.concatenate((sizes, -sizes))[order].cumsum()
+    dcnt = numpy.concatenate((numpy.ones(len(starts), dtype=int),
+                              -numpy.ones(len(ends), dtype=int)))[order].cumsum()
+    # Keep the state after the last event at each position
+    last = numpy.append(pos[1:] != pos[:-1], True)
+    pos, dsum, dcnt = pos[last], dsum[last], dcnt[last]
+    keep = dcnt[:-1] > 0
+    start, end = pos[:-1][keep], pos[1:][keep]
+    score = dsum[:-1][keep]/dcnt[:-1][keep].astype(float)
+    if not len(score):
+        return start, end, score
+    new = numpy.ones(len(score), dtype=bool)
+    new[1:] = (score[1:] != score[:-1]) | (start[1:] != end[:-1])
+    first = numpy.flatnonzero(new)
+    last = numpy.append(first[1:], len(score))-1
+    return start[first], end[last], score[first]
+
+
+def _pe_stats(chrom, bampath, chrmeta):
+    """
+    One pass over the properly paired forward reads of *chrom*: their positions
+    and sizes, and the histograms of fragment sizes and of fragment redundancy
+    (copies of the same position and size).
+
+    Every read is counted: the legacy loop left out of both histograms the
+    first read at each position.
+    """
+    positions = array.array('l')
+    sizes = array.array('l')
+    bam = pysam.Samfile(bampath, 'rb')
+    try:
+        for read in bam.fetch(chrom, 0, chrmeta[chrom]['length']):
+            if read.is_reverse or not read.is_proper_pair or read.isize < 0: continue
+            positions.append(read.pos)
+            sizes.append(read.isize)
+    finally:
+        bam.close()
+    if not len(positions):
+        empty = numpy.zeros(0, dtype=int)
+        return empty, empty, (0, numpy.zeros(1, dtype=int), numpy.zeros(1, dtype=int))
+    pos = numpy.frombuffer(positions, dtype=positions.typecode).astype(int)
+    size = numpy.frombuffer(sizes, dtype=sizes.typecode).astype(int)
+    size_hist = numpy.bincount(size)
+    # Copies of each (position, size) pair
+    order = numpy.lexsort((size, pos))
+    p, s = pos[order], size[order]
+    new = numpy.ones(len(p), dtype=bool)
+    new[1:] = (p[1:] != p[:-1]) | (s[1:] != s[:-1])
+    copies = numpy.diff(numpy.append(numpy.flatnonzero(new), len(p)))
+    rep_hist = numpy.bincount(copies)
+    return pos, size, (len(pos), size_hist, rep_hist)
+
+
+def _pe_chrom_stats(chrom, bampath, chrmeta):
+    return _pe_stats(chrom, bampath, chrmeta)[2]
+
+
+def _pe_chrom(chrom, bampath, chrmeta, midpoint):
+    """The fragment size track of *chrom* and its statistics (see :func:`_pe_stats`)."""
+    pos, size, stats = _pe_stats(chrom, bampath, chrmeta)
+    if midpoint:
+        starts = pos+size//2
+        ends = starts+1
+    else:
+        starts, ends = pos, pos+size
+    if len(pos):
+        frags = _fragment_density(starts, ends, size)
+    else:
+        frags = (pos, pos, numpy.zeros(0))
+    return FeatureStream(arrays_stream(*frags), fields=['start','end','score']), stats
+
+
 class PairedEndPlugin(BasePlugin):
     """Computes statistics and genome-wide distribution of fragment sizes from mapped paired-end reads.
     The result will consist of a pdf showing the distribution of fragment lengths and of fragment multiplicities, and a genome-wide density (in the format specifiied) with the average fragment size at every position.
@@ -53,25 +141,6 @@ class PairedEndPlugin(BasePlugin):
         'out': out_parameters,
         'meta': meta }
 
-    def _compute_stats(self, bam):
-        _plast = -1
-        _buff = {}
-        for read in bam:
-            if read.is_reverse or not read.is_proper_pair or read.isize<0: continue
-            self.nb_frag += 1
-            _p = read.pos
-            _s = read.isize
-            if _p == _plast:
-                _buff[_s] = _buff.get(_s,0)+1
-            else:
-                for _size,_rep in _buff.iteritems():
-                    self.frag_size[_size] = self.frag_size.get(_size,0)+_rep
-                    self.frag_rep[_rep] = 1+self.frag_rep.get(_rep,0)
-                _plast = _p
-                _buff = {}
-        for _rep in _buff.values():
-            self.frag_rep[_rep] = 1+self.frag_rep.get(_rep,0)
-
     def _plot_stats(self, bam_name):
         robjects.r.assign('rep_cnt',numpy2ri.numpy2ri(self.frag_rep.keys()))
         robjects.r.assign('rep_freq',numpy2ri.numpy2ri(self.frag_rep.values()))
@@ -126,15 +195,20 @@ title(main=main,outer=T)
                 all_tracks.append(outname)
                 trout = track(outname, fields=_f, chrmeta=bam.chrmeta,
                               info={'datatype': 'quantitative', 'PE_midpoint': midpoint})
-            self.frag_rep = {}
-            self.frag_size = {}
-            self.nb_frag = 0
-            for chrom,cval in bam.chrmeta.iteritems():
-                self._compute_stats(bam.fetch(chrom, 0, cval['length']))
-                if not plot_only:
-                    trout.write( bam.PE_fragment_size(chrom,midpoint=midpoint), 
-                                 fields=_f, chrom=chrom )
-            if not plot_only: trout.close()
+            args = (os.path.abspath(bam.path), bam.chrmeta)
+            if plot_only:
+                results = chrom_map(_pe_chrom_stats, bam.chrmeta, args=args,
+                                    processes=kw.get('processes'))
+            else:
+                results = write_by_chrom(trout, _pe_chrom, bam.chrmeta, args=args+(midpoint,),
+                                         processes=kw.get('processes'), results=True,
+                                         tmpdir=self.temporary_path(fname='partials'), fields=_f)
+                trout.close()
+            self.nb_frag = sum(r[0] for r in results)
+            size_hist = reduce(_add_hist, [r[1] for r in results])
+            rep_hist = reduce(_add_hist, [r[2] for r in results])
+            self.frag_size = dict((n, int(c)) for n,c in enumerate(size_hist) if c)
+            self.frag_rep = dict((n, int(c)) for n,c in enumerate(rep_hist) if c)
             if self.nb_frag > 1:
                 self._plot_stats(bam.name)
             else:
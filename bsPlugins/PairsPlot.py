@@ -25,7 +25,7 @@ in_parameters = [{'id': 'signals', 'type': 'track', 'required': True, 'multiple'
                  {'id': 'features', 'type': 'track', 'label':'Custom feature set: ', 'help_text':'Select a feature file (e.g. bed)'},
                  {'id': 'upstream', 'type': 'int', 'required': True, 'label':'Promoter upstream distance: ', 'help_text':'Size of promoter upstream of TSS', 'value':prom_up_def},
                  {'id': 'downstream', 'type': 'int', 'required': True, 'label':'Promoter downstream distance: ', 'help_text':'Size of promoter downstream of TSS', 'value':prom_down_def},
-                 {'id': 'assembly', 'type': 'assembly', 'label': 'Assembly: ', 'help_text':'Reference genome','options':genrep.GenRep().assemblies_available()},
+                 {'id': 'assembly', 'type': 'assembly', 'label': 'Assembly: ', 'help_text':'Reference genome','options':assemblies_available()},
                  {'id': 'highlights', 'type': 'track', 'multiple': 'HiMulti', 'label':'features to highlight: ', 'help_text':'Select a feature file (e.g. bed)'},
                  {'id': 'mode', 'type': 'list', 'required': True, 'label': 'Plot type: ', 'options': plot_types, 'mapping':{1: ['cormax','individual']},'prompt_text':None},
                  {'id': 'cormax', 'type': 'int', 'label':'Spatial range: ', 'help_text':'Maximum lag in bp to compute correlations', 'value': _cormax},
@@ -59,7 +59,7 @@ class PairsPlotForm(BaseForm):
                                value=prom_down_def,
                                help_text='Size of promoter downstream of TSS')
     assembly = twf.SingleSelectField(label='Assembly: ',
-                                     options=genrep.GenRep().assemblies_available(),
+                                     options=assemblies_available(),
                                      help_text='Reference genome')
     class HiMulti(twb.BsMultiple):
         label='features to highlight: '
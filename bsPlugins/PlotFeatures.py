@@ -1,4 +1,6 @@
 from bsPlugins import *
+from bsPlugins.base.columns import read_stream
+from bsPlugins.base.parallel import close_tracks
 from bbcflib.gfminer.common import add_name_field
 from bbcflib.gfminer.numeric import feature_matrix
 from bbcflib.gfminer.figure import heatmap, lineplot
@@ -111,6 +113,7 @@ class PlotFeaturesPlugin(BasePlugin):
         #signals = kw.get('SigMulti',{}).get('signals', [])
         signals = kw.get('signals', [])
         if not isinstance(signals, list): signals = [signals]
+        sigpaths = signals
         signals = [track(sig) for sig in signals]
         snames = [sig.name for sig in signals]
         labels = None
@@ -141,20 +144,27 @@ class PlotFeaturesPlugin(BasePlugin):
             ymax = float(kw.get('ymax'))
         except (ValueError, TypeError):
             ymax = None
-        for chrom in features.chrmeta:
-            if 'name' in features.fields: _fread = features.read(chrom)
-            else: _fread = add_name_field(features.read(chrom))
-            _l, _d = feature_matrix([s.read(chrom) for s in signals], _fread,
-                                    segment=True, nbins=nbins, 
-                                    upstream=upstr, downstream=downstr)
-            if _d.size == 0:
-                continue
-            if data is None:
-                labels = _l
-                data = _d
-            else:
-                labels = concatenate((labels, _l))
-                data = vstack((data, _d))
+        try:
+            for chrom in features.chrmeta:
+                if 'name' in features.fields: _fread = features.read(chrom)
+                else: _fread = add_name_field(features.read(chrom))
+                # Sorted features let feature_matrix sweep each signal once
+                _is, _ie = _fread.fields.index('start'), _fread.fields.index('end')
+                _fread = FeatureStream(sorted(_fread, key=lambda x: (x[_is], x[_ie])),
+                                       fields=_fread.fields)
+                _l, _d = feature_matrix([read_stream(sig, chrom) for sig in sigpaths], _fread,
+                                        segment=True, nbins=nbins, 
+                                        upstream=upstr, downstream=downstr)
+                if _d.size == 0:
+                    continue
+                if data is None:
+                    labels = _l
+                    data = _d
+                else:
+                    labels = concatenate((labels, _l))
+                    data = vstack((data, _d))
+        finally:
+            close_tracks()
         outf = str(kw.get('output'))
         if outf not in output_list:
             outf = output_list[0]
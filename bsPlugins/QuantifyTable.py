@@ -1,8 +1,12 @@
 from bsPlugins import *
-from bbcflib.gfminer.stream import neighborhood, score_by_feature
-from bbcflib.track import track
+from bsPlugins.base.parallel import write_by_chrom, open_track, processes_parameter
+from bsPlugins.base.signal_index import SignalIndex
+from bsPlugins.base.cache import ResultCache, RESULTS_CACHE, file_digest
+from bbcflib.gfminer.stream import neighborhood
+from bbcflib.track import track, FeatureStream
 from bbcflib import genrep
 import os
+import numpy
 
 prom_up_def = 1000
 prom_down_def = 100
@@ -20,8 +24,9 @@ in_parameters = [{'id': 'signals', 'type': 'track', 'required': True, 'multiple'
                  {'id': 'score_op', 'type': 'list', 'label': 'Score operation: ', 'help_text': 'Operation performed on scores within each feature', 'options': funcs, 'prompt_text':None},
                  {'id': 'upstream', 'type': 'int', 'required': True, 'label':'Promoter upstream distance: ', 'help_text':'Size of promoter upstream of TSS', 'value':prom_up_def},
                  {'id': 'downstream', 'type': 'int', 'required': True, 'label':'Promoter downstream distance: ', 'help_text':'Size of promoter downstream of TSS', 'value':prom_down_def},
-                 {'id': 'assembly', 'type': 'assembly', 'label': 'Assembly: ', 'help_text':'Reference genome','options':genrep.GenRep().assemblies_available()},
-                 {'id': 'output', 'type': 'listing', 'required': True, 'label': 'Output format: ', 'help_text':'Format of the output file', 'options': ['txt', 'sql'], 'prompt_text': None}]
+                 {'id': 'assembly', 'type': 'assembly', 'label': 'Assembly: ', 'help_text':'Reference genome','options':assemblies_available()},
+                 {'id': 'output', 'type': 'listing', 'required': True, 'label': 'Output format: ', 'help_text':'Format of the output file', 'options': ['txt', 'sql'], 'prompt_text': None},
+                 processes_parameter]
 out_parameters = [{'id': 'features_quantification', 'type': 'track'}]
 
 class QuantifyTableForm(BaseForm):
@@ -55,7 +60,7 @@ class QuantifyTableForm(BaseForm):
                                help_text='Size of promoter downstream of TSS')
     assembly = twf.SingleSelectField(label='Assembly: ',
                                      prompt_text=None,
-                                     options=genrep.GenRep().assemblies_available(),
+                                     options=assemblies_available(),
                                      help_text='Reference genome')
     format = twf.SingleSelectField(label='Output format: ',
                                    prompt_text=None,
@@ -66,6 +71,43 @@ class QuantifyTableForm(BaseForm):
 
 
 
+_assemblies = {}
+
+def _get_assembly(assembly_id):
+    if assembly_id not in _assemblies:
+        _assemblies[assembly_id] = genrep.Assembly(assembly_id)
+    return _assemblies[assembly_id]
+
+def _features(feature_type, assembly_id, features_file, chrmeta, prom_pars):
+    if feature_type in ftypes[3]:
+        return open_track(features_file, chrmeta=chrmeta).read
+    assembly = _get_assembly(assembly_id)
+    if feature_type in ftypes[0]:
+        return assembly.gene_track
+    elif feature_type in ftypes[1]:
+        return lambda c: neighborhood(assembly.gene_track(c), **prom_pars)
+    elif feature_type in ftypes[2]:
+        return assembly.exon_track
+
+def _indexed_scores(chrom, signals, chrmeta, func, stream):
+    fields = stream.fields
+    rows = list(stream)
+    starts = numpy.array([x[fields.index('start')] for x in rows], dtype=int)
+    ends = numpy.array([x[fields.index('end')] for x in rows], dtype=int)
+    scores = [SignalIndex.open(sig, chrmeta)[chrom].query(func, starts, ends).tolist()
+              for sig in signals]
+    names = [x[fields.index('name')] for x in rows] if 'name' in fields else ['']*len(rows)
+    for n,x in enumerate(rows):
+        yield (chrom, x[fields.index('start')], x[fields.index('end')], names[n]) \
+              + tuple(s[n] for s in scores)
+
+def _quantify_chrom(chrom, signals, chrmeta, func, features):
+    _f = ["score%i"%i for i in range(len(signals))] if len(signals) > 1 else ["score"]
+    stream = _features(*features)(chrom)
+    return FeatureStream(_indexed_scores(chrom, signals, chrmeta, func, stream),
+                         fields=['chr','start','end','name']+_f)
+
+
 class QuantifyTablePlugin(BasePlugin):
     """Quantify signal tracks on a set of regions.
 
@@ -83,6 +125,7 @@ Scores can be the sum/mean/median/min/max of the tag count in the interval."""
         'out': out_parameters,
         'meta': meta,
         }
+    cache_results = RESULTS_CACHE  # reuse the output of identical runs, see base.cache
     def quantify(self,**kw):
         feature_type = kw.get('feature_type', 0)
         if str(feature_type) in [str(x[0]) for x in ftypes]:
@@ -92,33 +135,35 @@ Scores can be the sum/mean/median/min/max of the tag count in the interval."""
         format = kw.get('output') or 'txt'
         chrmeta = "guess"
         if assembly_id:
-            assembly = genrep.Assembly(assembly_id)
+            assembly = _get_assembly(assembly_id)
             chrmeta = assembly.chrmeta
-            genes = assembly.gene_track
-            exons = assembly.exon_track
         elif not(feature_type in ftypes[3]):
             raise ValueError("Please specify an assembly")
         #signals = kw['SigMulti'].get('signals',[])
         signals = kw.get('signals',[])
         if not isinstance(signals, list): signals = [signals]
+        sigfiles = signals
         signals = [track(sig, chrmeta=chrmeta) for sig in signals]
-        if feature_type in ftypes[0]:
-            features = genes
-        elif feature_type in ftypes[1]:
+        prom_pars = {}
+        if feature_type in ftypes[1]:
             prom_pars = {'before_start': int(kw.get('upstream') or prom_up_def),
                          'after_start': int(kw.get('downstream') or prom_down_def),
                          'on_strand': True}
-            features = lambda c: neighborhood(genes(c), **prom_pars)
-        elif feature_type in ftypes[2]:
-            features = exons
         elif feature_type in ftypes[3]:
             assert os.path.exists(str(kw.get('features'))), "Features file not found: '%s'" % kw.get("features")
             _t = track(kw['features'], chrmeta=chrmeta)
             chrmeta = _t.chrmeta
-            features = _t.read
-        else:
+        elif not(feature_type in ftypes[0] or feature_type in ftypes[2]):
             raise ValueError("Take feature_type in %s." %ftypes)
+        features = (feature_type, assembly_id, kw.get('features'), chrmeta, prom_pars)
         output = self.temporary_path(fname='quantification.'+format)
+        if self.cache_results:
+            results = ResultCache('quantify')
+            key = results.key(self.unique_id(), func, feature_type, prom_pars, assembly_id, format,
+                              [(file_digest(sig), os.path.basename(sig)) for sig in sigfiles],
+                              kw.get('features') and file_digest(kw['features']))
+            if results.get(key, output):
+                return output
         if len(signals) > 1:
             _f = ["score%i"%i for i in range(len(signals))]
         else:
@@ -128,10 +173,15 @@ Scores can be the sum/mean/median/min/max of the tag count in the interval."""
         if format == 'txt': 
             header = ['#chr','start','end','name']+[s.name for s in signals]
             tout.make_header("\t".join(header))
-        for chrom in chrmeta:
-            sread = [sig.read(chrom) for sig in signals]
-            tout.write(score_by_feature(sread, features(chrom), method=func),
-                       chrom=chrom, clip=True, mode="append")
+        # Build the missing indexes once, before the workers load their chromosome
+        for sig in sigfiles: SignalIndex.open(sig, chrmeta)
+        write_by_chrom(tout, _quantify_chrom, chrmeta,
+                       args=(sigfiles, chrmeta, func, features),
+                       processes=kw.get('processes'), mode="append",
+                       tmpdir=self.temporary_path(fname='partials'))
+        tout.close()
+        if self.cache_results:
+            results.put(key, output)
         return output
 
 
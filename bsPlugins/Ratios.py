@@ -1,12 +1,15 @@
 from bsPlugins import *
-from bbcflib.gfminer.stream import merge_scores, window_smoothing
+from bsPlugins.base.arrays import aligned_chunks, arrays_stream, CHUNK_SIZE
+from bsPlugins.base.parallel import write_by_chrom, processes_parameter
+from bsPlugins.base.columns import read_stream
+from bbcflib.gfminer.stream import window_smoothing
 from bbcflib.gfminer.figure import density_boxplot
 from bbcflib.gfminer.common import unroll
 from bbcflib.track import track, FeatureStream
-from bbcflib import genrep
 from math import log
 from numpy.random import poisson
 from numpy import median
+import numpy
 
 size_def = 1
 pseudo_def = 0.5
@@ -18,13 +21,14 @@ meta = {'version': "1.0.0",
 
 in_parameters = [{'id': 'numerator', 'type': 'track', 'required': True, 'label':'Numerator: ', 'help_text':'Select the track with the numerators'},
                  {'id': 'denominator', 'type': 'track', 'required': True, 'label': 'Denominator', 'help_text':'Select the track with the denominators' },
-                 {'id': 'assembly', 'type': 'assembly', 'label':'Assembly: ', 'help_text': 'Reference genome', 'options': genrep.GenRep().assemblies_available()},
+                 {'id': 'assembly', 'type': 'assembly', 'label':'Assembly: ', 'help_text': 'Reference genome', 'options': assemblies_available()},
                  {'id': 'output', 'type': 'listing', 'required': True, 'label': 'Output format: ', 'help_text': 'Format of the output file', 'options':['bedGraph','sql','wig','bigWig','sga'], 'prompt_text': None },
                  {'id': 'window_size', 'type': 'int', 'label': 'Window size: ', 'help_text': 'Size of the sliding window in bp (default: 1)', 'value': size_def},
                  {'id': 'pseudo', 'type': 'float', 'label': 'Pseudo-count: ', 'help_text': 'Value to be added to both signals (default: 0.5)', 'value': pseudo_def},
                  {'id': 'threshold', 'type': 'float', 'label': 'Threshold: ', 'help_text': 'This sets ratio=1 at each genomic position satisfying numerator value < threshold (default: 0)', 'value': threshold_def},
                  {'id': 'log', 'type':'boolean', 'label': 'Log ratios: ','help_text': 'Computes the log2 of the ratios', 'value': False},
-                 {'id': 'distribution', 'type':'boolean', 'label': 'Plot distribution: ', 'help_text': 'Creates a graphical representation of the distributions of the ratios based on a sample of genomic regions', 'value': False}]
+                 {'id': 'distribution', 'type':'boolean', 'label': 'Plot distribution: ', 'help_text': 'Creates a graphical representation of the distributions of the ratios based on a sample of genomic regions', 'value': False},
+                 processes_parameter]
 out_parameters = [{'id': 'ratios', 'type': 'track'}, 
                   {'id': 'boxplot', 'type': 'pdf'}]
 
@@ -40,7 +44,7 @@ class RatiosForm(BaseForm):
         validator=twb.BsFileFieldValidator(required=True))
     assembly = twf.SingleSelectField(
         label='Assembly: ',
-        options=genrep.GenRep().assemblies_available(),
+        options=assemblies_available(),
         help_text='Reference genome')
     format = twf.SingleSelectField(
         label='Output format ',
@@ -79,6 +83,7 @@ class RatiosPlugin(BasePlugin):
 
     sample_length = 200
     sample_num = 50000
+    batch_size = CHUNK_SIZE  # features read at a time from each track
 
     info = {
         'title': 'Score ratios',
@@ -90,32 +95,37 @@ class RatiosPlugin(BasePlugin):
         'meta': meta,
         }
 
-    def _divide(self,x):
-        if len(x) > 1:
-            if self.log:
-                if x[0] < self.threshold:
-                    return 0
-                else:
-                    return log(self.pseudo+x[0],2)-log(self.pseudo+x[1],2)
-            else:
-                if x[0] < self.threshold:
-                    return 1
-                else:
-                    return (self.pseudo+x[0])/(self.pseudo+x[1])
+    def _divide_arrays(self, num, den):
+        """Ratios of arrays of numerators and denominators (0 where missing)."""
         if self.log:
-            if x[0] < self.threshold:
-                return 0
-            else:
-                return log(self.pseudo+x[0],2)+self.baseline
-        if x[0] < self.threshold:
-            return 1
+            ratios = numpy.log(self.pseudo+num)/log(2)-numpy.log(self.pseudo+den)/log(2)
+            ratios[num < self.threshold] = 0
         else:
-            return (self.pseudo+x[0])/self.pseudo
+            ratios = (self.pseudo+num)/(self.pseudo+den)
+            ratios[num < self.threshold] = 1
+        return ratios
+
+    def _divide_chunks(self, s1, s2):
+        def _stream():
+            for start, end, scores in aligned_chunks([s1,s2], size=self.batch_size):
+                for x in arrays_stream(start, end, self._divide_arrays(*scores)):
+                    yield x
+        return FeatureStream(_stream(), fields=['start','end','score'])
+
+    def _chrom_ratios(self, chrom, numerator, denominator, chrmeta, wsize):
+        s1 = read_stream(numerator, chrom, chrmeta)
+        s2 = read_stream(denominator, chrom, chrmeta)
+        if wsize > 1:
+            s1 = window_smoothing(s1,window_size=wsize,step_size=1,featurewise=False)
+            s2 = window_smoothing(s2,window_size=wsize,step_size=1,featurewise=False)
+        return self._divide_chunks(s1,s2)
 
     def _sample_stream(self, stream, limit):
+        """Copies the scores of sample windows spaced by `self.shifts` to the `self.ratios` buffer."""
         start = 0
         end = -1
-        scores = []
+        window = None
+        L = self.sample_length
         ist = stream.fields.index('start')
         ien = stream.fields.index('end')
         isc = stream.fields.index('score')
@@ -123,18 +133,28 @@ class RatiosPlugin(BasePlugin):
             yield x
             if start > limit: continue
             if x[ist] >= end:
-                self.ratios.extend(scores)
-                scores = [0]*self.sample_length
-                start += self.shifts[0]
-                end = start+self.sample_length
+                if window is not None: self.nsamples += 1
+                if self.nshifts >= len(self.shifts):
+                    start = limit+1
+                    continue
+                window = self.ratios[self.nsamples*L:(self.nsamples+1)*L]
+                window[:] = 0
+                start += self.shifts[self.nshifts]
+                end = start+L
                 if end <= limit:
-                    self.shifts.pop(0)
+                    self.nshifts += 1
                 else:
                     start = limit+1
             elif x[ien] > start:
                 _s = max(0,x[ist]-start)
-                _e = min(self.sample_length,x[ien]-start)
-                scores[_s:_e] = [x[isc]]*(_e-_s)
+                _e = min(L,x[ien]-start)
+                window[_s:_e] = x[isc]
+
+    def __getstate__(self):
+        # sent to worker processes, which do not sample
+        state = self.__dict__.copy()
+        for k in ['shifts','ratios']: state.pop(k, None)
+        return state
 
     def __call__(self,**kw):
         assembly = kw.get('assembly') or 'guess'
@@ -149,7 +169,6 @@ class RatiosPlugin(BasePlugin):
             self.pseudo = float(kw.get('pseudo'))
         except:
             self.pseudo = pseudo_def
-        self.baseline = -log(self.pseudo,2)
         try:
             self.threshold = float(kw.get('threshold'))
         except:
@@ -159,30 +178,30 @@ class RatiosPlugin(BasePlugin):
             distribution = (distribution.lower() in ['1', 'true', 't','on'])
         if distribution:
             genome_length = sum((v['length'] for v in t1.chrmeta.values()))
-            self.shifts = list(poisson(float(genome_length)/float(self.sample_num),self.sample_num))
-            self.ratios = []
+            self.shifts = poisson(float(genome_length)/float(self.sample_num),self.sample_num)
+            self.ratios = numpy.zeros(self.sample_num*self.sample_length)
+            self.nshifts = 0
+            self.nsamples = 0
 
         output = self.temporary_path(fname='ratios_%s-%s.%s'%(t1.name,t2.name,format))
+        if distribution:
+            wrap = lambda s,chrom: FeatureStream(self._sample_stream(s,t1.chrmeta[chrom]['length']),fields=s.fields)
+        else:
+            wrap = None
         with track(output, chrmeta=t1.chrmeta, fields=t1.fields,
                    info={'datatype': 'quantitative',
                          'log': self.log,
                          'pseudocounts': self.pseudo,
                          'threshold': self.threshold,
                          'window_size': wsize}) as tout:
-            for chrom,vchr in t1.chrmeta.iteritems():
-                if wsize > 1:
-                    s1 = window_smoothing(t1.read(chrom),window_size=wsize,step_size=1,featurewise=False)
-                    s2 = window_smoothing(t2.read(chrom),window_size=wsize,step_size=1,featurewise=False)
-                else:
-                    s1 = t1.read(chrom)
-                    s2 = t2.read(chrom)
-                s3 = merge_scores([s1,s2],method=self._divide)
-                if distribution:
-                    s3 = FeatureStream(self._sample_stream(s3,vchr['length']),fields=s3.fields)
-                tout.write(s3, chrom=chrom, clip=True)
+            write_by_chrom(tout, (self,'_chrom_ratios'), t1.chrmeta,
+                           args=(kw['numerator'],kw['denominator'],t1.chrmeta,wsize),
+                           processes=kw.get('processes'), wrap=wrap,
+                           tmpdir=self.temporary_path(fname='partials'))
         self.new_file(output, 'ratios')
 
         if distribution:
+            self.ratios = self.ratios[:self.nsamples*self.sample_length]
             pdf = self.temporary_path(fname='%s-%s_ratios_distribution.pdf'%(t1.name,t2.name))
             density_boxplot(self.ratios,output=pdf,
                             name="%s/%s (median=%.2f)" %(t1.name,t2.name,median(self.ratios)))
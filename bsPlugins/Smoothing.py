@@ -1,7 +1,8 @@
 from bsPlugins import *
-from bbcflib.gfminer.stream import window_smoothing
-from bbcflib.track import track
-from bbcflib import genrep
+from bsPlugins.base.parallel import write_by_chrom, processes_parameter
+from bsPlugins.base.columns import read_stream
+from bsPlugins.base.smoothing import bp_smoothing, feature_smoothing
+from bbcflib.track import track, FeatureStream
 
 size_def = 11
 step_def = 1
@@ -11,11 +12,12 @@ meta = {'version': "1.0.0",
         'contact': "webmaster-bbcf@epfl.ch"}
 
 in_parameters = [{'id': 'track', 'type': 'track', 'required': True, 'label': 'Signal: ', 'help_text': 'Select signal file (e.g. bedgraph)'},
-                 {'id': 'assembly', 'type': 'assembly' ,'label': 'Assembly: ', 'help_text': 'Reference genome' ,'options': genrep.GenRep().assemblies_available()},
+                 {'id': 'assembly', 'type': 'assembly' ,'label': 'Assembly: ', 'help_text': 'Reference genome' ,'options': assemblies_available()},
                  {'id': 'window_size', 'type': 'int', 'required': True, 'label': 'Window size: ', 'help_text': 'Size of the sliding window', 'value': size_def},
                  {'id': 'window_step', 'type': 'int', 'required': True, 'label': 'Window step: ', 'help_text': 'Size of steps between windows', 'value': step_def },
                  {'id': 'by_feature', 'type': 'boolean', 'label': 'Window size in features (not basepairs): ', 'help_text': 'Will count size and step parameters in number of features, not in basepairs', 'value':False},
-                 {'id': 'output', 'type': 'listing', 'label': 'Output format: ', 'help_text': 'Format of the output file', 'options':['sql','bedGraph','wig','bigWig','sga'], 'prompt_text': None}]
+                 {'id': 'output', 'type': 'listing', 'label': 'Output format: ', 'help_text': 'Format of the output file', 'options':['sql','bedGraph','wig','bigWig','sga'], 'prompt_text': None},
+                 processes_parameter]
 out_parameters = [{'id': 'smoothed_track', 'type': 'track'}]
 
 
@@ -26,7 +28,7 @@ class SmoothingForm(BaseForm):
         validator=twb.BsFileFieldValidator(required=True))
     assembly = twf.SingleSelectField(
         label='Assembly: ',
-        options=genrep.GenRep().assemblies_available(),
+        options=assemblies_available(),
         help_text='Reference genome')
     window_size = twf.TextField(
         label='Window size: ',
@@ -49,6 +51,13 @@ class SmoothingForm(BaseForm):
         help_text='Format of the output file', )
     submit = twf.SubmitButton(id="submit", value="Submit")
 
+def _smooth_chrom(chrom, path, chrmeta, fields, wsize, wstep, featurewise):
+    stream = read_stream(path, chrom, chrmeta, fields)
+    if featurewise:
+        return FeatureStream(feature_smoothing(stream, wsize, wstep), fields=stream.fields)
+    return FeatureStream(bp_smoothing(stream, wsize, wstep, chrom=chrom), fields=fields)
+
+
 class SmoothingPlugin(BasePlugin):
     """Applies a moving average transformation to smooth the signal of a quantitative track. """
 
@@ -61,7 +70,6 @@ class SmoothingPlugin(BasePlugin):
         'out': out_parameters,
         'meta': meta,
         }
-
     def __call__(self, **kw):
         tinput = track(kw.get('track'), chrmeta=kw.get('assembly') or None)
         outformat = kw.get('output',tinput.format)
@@ -78,12 +86,10 @@ class SmoothingPlugin(BasePlugin):
             outfields = ["chr","start", "end", "score"]
             datatype = "quantitative"
         tout = track(output, format=outformat, fields=outfields, chrmeta=tinput.chrmeta, info={'datatype': datatype})
-        for chrom in tout.chrmeta.keys():
-            s = window_smoothing(
-                tinput.read(selection=chrom, fields=outfields),
-                window_size=wsize, step_size=wstep,
-                featurewise=featurewise)
-            tout.write(s, chrom=chrom, clip=True)
+        write_by_chrom(tout, _smooth_chrom, tout.chrmeta,
+                       args=(kw.get('track'), tinput.chrmeta, outfields, wsize, wstep, featurewise),
+                       processes=kw.get('processes'),
+                       tmpdir=self.temporary_path(fname='partials'))
         tout.close()
         self.new_file(output, 'smoothed_track')
         return self.display_time()
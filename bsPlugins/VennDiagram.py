@@ -1,11 +1,15 @@
 from bsPlugins import *
-from bbcflib.track import track, FeatureStream
-from bbcflib.gfminer.common import cobble
-from bbcflib.gfminer.stream import concatenate
+from bbcflib.track import track
 from bbcflib.gfminer.figure import venn
 from bbcflib import genrep
-from itertools import combinations
-import os, re, sys
+from bsPlugins.base.arrays import CHUNK_SIZE
+from bsPlugins.base.columns import read_columns
+from bsPlugins.base.expressions import compile_filter
+from bsPlugins.base.intervals import coverage_masks
+from bsPlugins.base.parallel import chrom_map, close_tracks, processes_parameter
+from itertools import combinations, islice
+import numpy
+import os, sys
 
 meta = {'version': "1.0.0",
         'author': "BBCF",
@@ -20,14 +24,67 @@ in_parameters = [{'id': 'input_type', 'type': 'radio', 'label': 'Input from: ',
                 {'id': 'table', 'type': 'txt', 'required': True, 'label': 'Table: ', 'help_text': 'Select table'},
                 {'id': 'id_columns', 'type': 'text', 'required': True, 'label': 'Column id: ', 'help_text':'Comma separated list of columns id (e.g. 3,5)'},
                 {'id': 'filters', 'type': 'text', 'required': True, 'label': 'Filters: ', 'help_text': 'comma separated list of filtering expressions (e.g. >2,<0.05,>=2 OR <=-2,>=-2 AND <2,==2,!=2)'},
-                {'id': 'output', 'type': 'listing', 'label': 'Format: ', 'help_text': 'Output figure format', 'options' :["png","pdf"], 'prompt_text': None}
-                ]
+                {'id': 'output', 'type': 'listing', 'label': 'Format: ', 'help_text': 'Output figure format', 'options' :["png","pdf"], 'prompt_text': None},
+                processes_parameter]
 
 out_parameters = [{'id':'venn_diagram', 'type':'file'},
                   {'id':'venn_summary', 'type':'file'}]
 
 
 
+def _table_counts(infile, col_ind, tests, size=CHUNK_SIZE):
+    """
+    Number of rows of *infile* by bitmask of the columns passing their test
+    (bit n for column col_ind[n]), with the rows read and tested by chunks.
+    :return: array of length 2^len(col_ind) indexed by mask.
+    """
+    counts = numpy.zeros(1 << len(col_ind), dtype=int)
+    rows = iter(infile)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk: break
+        masks = numpy.zeros(len(chunk), dtype=int)
+        for n,(i,test) in enumerate(zip(col_ind, tests)):
+            num = numpy.asarray([row[i] for row in chunk], dtype=float)
+            num = numpy.clip(num, -sys.maxint, sys.maxint)
+            masks |= test(num).astype(int) << n
+        counts += numpy.bincount(masks, minlength=len(counts))
+    return counts
+
+
+def _superset_sums(values):
+    """
+    For each mask m, the sum of *values* over all masks containing m, i.e. the
+    totals of each combination from those of each exact combination.
+    """
+    sums = numpy.array(values)
+    masks = numpy.arange(len(sums))
+    bit = 1
+    while bit < len(sums):
+        without = masks[(masks & bit) == 0]
+        sums[without] += sums[without | bit]
+        bit <<= 1
+    return sums
+
+
+def _mask(combination, tlabels):
+    return sum(1 << tlabels.index(x) for x in combination)
+
+
+def _venn_chrom(chrom, filenames):
+    """
+    Covered basepairs and integrated score (score x bp) of each bitmask of
+    the tracks *filenames* (bit n for the n-th track) on *chrom*.
+    :return: two arrays of length 2^len(filenames) indexed by mask.
+    """
+    columns = [read_columns(f, chrom, 'guess') for f in filenames]
+    starts, ends, masks, scores = coverage_masks(columns)
+    lengths = ends-starts
+    nmasks = 1 << len(filenames)
+    return (numpy.bincount(masks, weights=lengths, minlength=nmasks),
+            numpy.bincount(masks, weights=lengths*scores, minlength=nmasks))
+
+
 class VennDiagramForm(BaseForm):
     child = twd.HidingTableLayout()
 
@@ -78,8 +135,8 @@ of the genome covered by each possible combination of the input tracks. For inst
 If tracks A and B are given, it will show the portions covered by A only, B only, or
 A and B.
 
-If it has the value 'score', the diagram will show the percent of the total score
-due to each combination of the input tracks, as above.
+If it has the value 'score', the diagram will show the total score (integrated over the
+basepairs) due to each combination of the input tracks, as above.
 
 The output includes the figure of the Venn diagram and a text summary of the different statistics.
 If more than 4 samples are given, no graph is produced, but the text summary still contains
@@ -101,23 +158,6 @@ Rules (possibly empty) must be specified in the same order as column numbers.
         }
 
     def __call__(self, **kw):
-
-        def _parse_logic(string):
-            s = re.sub(r'[^\w\d!=><\. ]', '', string)
-            s = re.sub(r' OR ', ')or(%f ', s)
-            s = re.sub(r' AND ', ')and(%f ', s)
-            return "(%f "+s+")"
-
-        def _run_test(row, indx, cond):
-            num = float(row[col_ind[indx]])
-            num = max(-sys.maxint,min(sys.maxint,num))
-            num = (num,)*c.count("%f")
-            return eval(cond % (num))
-
-        def _add_label(s,x):
-            _f = s.fields+['track_name']
-            return FeatureStream((y+(x,) for y in s), fields=_f)
-
         venn_options = {} # tune it here
         tracks = []
         intype = kw.get("input_type") or "Table"
@@ -127,21 +167,20 @@ Rules (possibly empty) must be specified in the same order as column numbers.
             infile = track(kw.get('table',''),format='txt',header=True)
             col_ind = [int(i)-1 for i in s_cols.split(",")]
             legend = [infile.fields[i] if i<len(infile.fields) else str(i) for i in col_ind]
-            conds = [_parse_logic(x) for x in s_filters.split(",")]
             tlabels = [chr(k+65) for k in range(len(col_ind))]
-            conds += ["1"]*(len(col_ind)-len(conds))
             combn = [tuple(sorted(x)) for k in range(len(tlabels)) 
                      for x in combinations(tlabels,k+1)]
             c1 = dict(("|".join(c),0) for c in combn)
             c2 = dict(("|".join(c),0) for c in combn)
-            indx = dict((c,[tlabels.index(x) for x in c]) for c in combn)
-            for row in infile:
-                tests = [_run_test(row,i,c) for i,c in enumerate(conds)]
-                for c in combn:
-                    c1["|".join([tlabels[n] for n,t in enumerate(tests) if t])] += 1
-                    c2["|".join(c)] += all([tests[i] for i in indx[c]])
+            filters = s_filters.split(",")
+            filters += [""]*(len(col_ind)-len(filters))
+            counts = _table_counts(infile, col_ind, [compile_filter(x) for x in filters])
+            totals = _superset_sums(counts)
+            for c in combn:
+                c1["|".join(c)] = int(counts[_mask(c,tlabels)])
+                c2["|".join(c)] = int(totals[_mask(c,tlabels)])
             nsamples = len(col_ind)
-            combn = ['|'.join(y) for x in combn for y in x]
+            combn = ['|'.join(x) for x in combn]
         elif intype == "Tracks":
             #filenames = kw['TrMulti']['files']
             filenames = kw['files']
@@ -154,28 +193,23 @@ Rules (possibly empty) must be specified in the same order as column numbers.
             combn = ['|'.join(sorted(y)) for x in combn for y in x]
             c1 = dict(zip(combn,[0]*len(combn)))
             c2 = dict(zip(combn,[0]*len(combn)))
-            total_cov = 0.0
             _scored = (kw.get('type') == 'score')
             chromset = set([c for t in tracks for c in t.chrmeta])
-            for chrom in chromset:
-                streams = [_add_label(t.read(chrom),tlabels[n]) for n,t in enumerate(tracks)]
-                s = cobble(concatenate(streams),scored=_scored)
-                name_idx = s.fields.index('track_name')
-                start_idx = s.fields.index('start')
-                end_idx = s.fields.index('end')
-                if _scored: score_idx = s.fields.index('score')
-                for x in s:
-                    length = x[end_idx]-x[start_idx]
-                    total_cov += length
-                    sub = sorted(list(set(x[name_idx].split('|')))) # avoid 'A|A'
-                    cb = [combinations(sub,k) for k in range(1,len(sub)+1)]
-                    cb = ['|'.join(sorted(y)) for c in cb for y in c]
-                    if _scored:
-                        c1['|'.join(sub)] += x[score_idx]
-                        for c in cb: c2[c] += x[score_idx]
-                    else:
-                        c1['|'.join(sub)] += length
-                        for c in cb: c2[c] += length
+            chrmeta = {}
+            for t in tracks:
+                for chrom, v in t.chrmeta.iteritems(): chrmeta.setdefault(chrom, v)
+            coverage = numpy.zeros(1 << nsamples)
+            integral = numpy.zeros(1 << nsamples)
+            for cov, integ in chrom_map(_venn_chrom, chrmeta, (filenames,), kw.get('processes')):
+                coverage += cov
+                integral += integ
+            close_tracks()
+            weights = integral if _scored else coverage
+            totals = _superset_sums(weights)
+            total_cov = float(coverage.sum())
+            for c in combn:
+                c1[c] = float(weights[_mask(c.split('|'),tlabels)])
+                c2[c] = float(totals[_mask(c.split('|'),tlabels)])
             if total_cov < 1:
                 output = self.temporary_path(fname='venn_summary.txt')
                 with open(output,'wb') as summary:
@@ -1,13 +1,17 @@
 from bsPlugins import *
-from bbcflib.gfminer.figure import smoothScatter
+from bsPlugins.base.histogram import Histogram2D
+from bsPlugins.base.regions import sweep_regions
 from bbcflib.track import track
-from numpy import asarray, concatenate, mean
+import rpy2.robjects as robjects
+import rpy2.robjects.numpy2ri as numpy2ri
 import tarfile, os
 
 #nbin_x_def = 500
 #nbin_y_def = 500
 #bandwidth_x_def = 0.1
 #bandwidth_y_def = 0.1
+bin_size_def = 5
+region_batch = 1000
 
 meta = {'version': "1.0.0",
         'author': "BBCF",
@@ -22,8 +26,10 @@ in_parameters = [{'id': 'bamfiles', 'type': 'bam', 'required': True, 'multiple':
                  #{'id': 'bandwidth_x', 'type': 'float'},
                  #{'id': 'bandwidth_y', 'type': 'float'},
                  {'id': 'ymin', 'type': 'int', 'label': 'Minimum y value: ', 'help_text': 'The default values: ymin=0 in lin scale and ymin=50 in log scale'},
-                 {'id': 'ymax', 'type': 'int', 'label': 'Maximum y value: ', 'help_text': 'The default value: ymax=maximum fragment length in the selected regions'}]
+                 {'id': 'ymax', 'type': 'int', 'label': 'Maximum y value: ', 'help_text': 'The default value: ymax=maximum fragment length in the selected regions'},
+                 {'id': 'bin_size', 'type': 'int', 'label': 'Bin size: ', 'help_text': 'Size of the bins along both axes, in bp (default: %i)' %bin_size_def, 'value': bin_size_def}]
 out_parameters = [{'id': 'Vplot', 'type': 'png'},
+                  {'id': 'Vplot_matrix', 'type': 'txt'},
                   {'id': 'Vplots_archive', 'type': 'file'}]
 
 
@@ -63,9 +69,29 @@ class VplotForm(BaseForm):
     ymax = twf.TextField(label='Maximum y value: ',
                                 validator=twc.IntValidator(required=False),
                                 help_text='The default value: ymax=maximum fragment length in the selected regions')
+    bin_size = twf.TextField(label='Bin size: ',
+                                validator=twc.IntValidator(required=False),
+                                value=bin_size_def,
+                                help_text='Size of the bins along both axes, in bp (default: %i)' %bin_size_def)
     submit = twf.SubmitButton(id="submit", value="Plot")
 
 
+def _plot_hist(hist, main, xlab, ylab, xlim, ylim, log, color):
+    """Image of the counts of *hist*, scaled like smoothScatter's densities."""
+    xe, ye = hist.xedges(), hist.yedges()
+    robjects.r.assign('x', numpy2ri.numpy2ri((xe[:-1]+xe[1:])/2.))
+    robjects.r.assign('y', numpy2ri.numpy2ri((ye[:-1]+ye[1:])/2.))
+    robjects.r.assign('z', numpy2ri.numpy2ri(hist.counts.astype(float)**.25))
+    robjects.r.assign('nx', hist.counts.shape[0])
+    robjects.r.assign('ny', hist.counts.shape[1])
+    robjects.r("""
+z = matrix(z, nrow=nx, ncol=ny)
+image(x, y, z, col=colorRampPalette(c(%s))(256), main='%s', xlab='%s', ylab='%s',
+      xlim=c(%i,%i), ylim=c(%i,%i), log='%s')
+box()
+""" %(",".join(["'%s'" %c for c in color]), main, xlab, ylab, xlim[0], xlim[1], ylim[0], ylim[1], log))
+
+
 class VplotPlugin(BasePlugin):
     """Draw the dotplot of the mean fragment lengths (associated to the fragment middle points) corresponding to a paired-end BAM file and a set of regions (features)."""
     info = {
@@ -106,17 +132,24 @@ class VplotPlugin(BasePlugin):
 #                     float(kw.get('bandwidth_y') or bandwidth_y_def))
         xlab = "Position in window [bp]"
         ylab = "Fragment size [bp]"
-        new = True
+        bin_size = int(kw.get('bin_size') or bin_size_def)
         extra_window = 1000
         strand = 1
         pnglist = []
+        matrices = []
+        # The histograms span the widest region, so that no fragment of a longer region is dropped
+        regions = list(features.read())
+        width = max([r[2]-r[1] for r in regions] or [0])
         for bam_nb, bam in enumerate(bamfiles):
-            XL = None; XR = None; Y = None
-            for region_nb, region in enumerate(features.read()):
+            HL = HR = None
+            _XL = []; _XR = []; _Y = []
+            for region_nb, (region, reads) in enumerate(sweep_regions(bam.fetch, regions, padding=extra_window)):
                 if strandi > -1: strand = region[strandi]
                 chrom,start,end = region[:3]
-                _XL = []; _XR = []; _Y = []
-                for read in bam.fetch(chrom,max(0,start-extra_window),end+extra_window):
+                if HR is None:
+                    HR = Histogram2D(0, width, bin_size, bin_size)
+                    if left_right: HL = Histogram2D(0, width, bin_size, bin_size)
+                for read in reads:
                     if read.is_proper_pair and read.isize>0 and not read.is_reverse:
                         _rs = read.isize
                         if strand < 0: rpos = end-read.pos-_rs
@@ -129,37 +162,40 @@ class VplotPlugin(BasePlugin):
                             _XR.append(rpos+_rs)
                         else:
                             _XR.append(rpos+_rs/2)
-                if Y is None:
-                    if left_right: XL = asarray(_XL)
-                    XR = asarray(_XR)
-                    Y = asarray(_Y)
-                else:
-                    if left_right: XL = concatenate((XL,asarray(_XL)))
-                    XR = concatenate((XR,asarray(_XR)))
-                    Y = concatenate((Y,asarray(_Y)))
-            ylims = (int(kw.get('ymin') or ymin_def), int(kw.get('ymax') or max(Y)))
-            xlims = (0,end-start)
-            colrs = ["lightgrey","blue","red"]
+                if (region_nb+1) % region_batch == 0:
+                    if left_right: HL.add(_XL, _Y)
+                    HR.add(_XR, _Y)
+                    _XL = []; _XR = []; _Y = []
+            if HR is None: continue
+            if left_right: HL.add(_XL, _Y)
+            HR.add(_XR, _Y)
+            ylims = (int(kw.get('ymin') or ymin_def), int(kw.get('ymax') or HR.ymax or 1))
+            xlims = (0,width)
             mlabel = bam.name
             png = self.temporary_path(fname='Vplot_%s.png'%mlabel)
+            robjects.r('png("%s",width=800,height=%i)' %(png, 1200 if left_right else 600))
             if left_right:
-                smoothScatter( XL, Y, output=png, new=True, last=False, main=mlabel+" left fragment end",
-                               xlab=xlab, ylab=ylab, xlim=xlims, ylim=ylims, log=log, color=["white","red"],
-                               mfrow=[2,1] )#, nbin=nbin, bandwidth=bandwidth )
-                colrs = ["white","blue"]
-                mlabel += " right fragment end"
-                new = False
-            smoothScatter( XR, Y, output=png, new=new, last=True, main=mlabel,
-                           xlab=xlab, ylab=ylab, xlim=xlims, ylim=ylims, log=log, color=colrs )
-                           #,nbin=nbin, bandwidth=bandwidth )
-            new = True
+                robjects.r('par(mfrow=c(2,1))')
+                _plot_hist(HL, mlabel+" left fragment end", xlab, ylab, xlims, ylims, log, ["white","red"])
+                matrices.append(HL.save(self.temporary_path(fname='Vplot_%s_left.txt'%mlabel),
+                                        'position', 'size'))
+                _plot_hist(HR, mlabel+" right fragment end", xlab, ylab, xlims, ylims, log, ["white","blue"])
+                matrices.append(HR.save(self.temporary_path(fname='Vplot_%s_right.txt'%mlabel),
+                                        'position', 'size'))
+            else:
+                _plot_hist(HR, mlabel, xlab, ylab, xlims, ylims, log, ["lightgrey","blue","red"])
+                matrices.append(HR.save(self.temporary_path(fname='Vplot_%s.txt'%mlabel),
+                                        'position', 'size'))
+            robjects.r('dev.off()')
             pnglist.append(png)
         if len(pnglist) > 1:
             tar_png_name = self.temporary_path('Vplots.tgz')
             tar_png = tarfile.open(tar_png_name, "w:gz")
-            [tar_png.add(f,arcname=os.path.basename(f)) for f in pnglist]
+            [tar_png.add(f,arcname=os.path.basename(f)) for f in pnglist+matrices]
             tar_png.close()
             self.new_file(tar_png_name, 'Vplots_archive')
         elif len(pnglist) == 1:
             self.new_file(pnglist[0], 'Vplot')
+            for matrix in matrices:
+                self.new_file(matrix, 'Vplot_matrix')
         return self.display_time()
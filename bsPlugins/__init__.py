@@ -10,6 +10,7 @@ except ImportError:
 
 
 from base import BasePlugin
+from base.cache import assemblies_available
 try:
     from bs.operations.base import BaseForm, Multi, DynForm
 except ImportError:
@@ -44,6 +44,13 @@ class BasePlugin(object):
         t = max(0.0,self.end_time-self.start_time)
         return 'Time elapsed %0.3fs.' % t
 
+    def debug(self, msg):
+        """
+        Append *msg* to self.debug_stack, and print it if self.is_debug is set.
+        """
+        self.debug_stack.append(msg)
+        if self.is_debug: print msg
+
     def html_doc_link(self):
         """
         The default link to the plugin documentation. You can override this function
@@ -0,0 +1,112 @@
+"""
+Conversions between feature streams and numpy arrays, used by the vectorized
+engines of the plugins.
+"""
+from itertools import islice, izip
+import numpy
+
+CHUNK_SIZE = 100000
+
+
+def stream_chunks(stream, fields=('start','end','score'), size=CHUNK_SIZE):
+    """
+    Read a stream by chunks of *size* features.
+    :param fields: the fields to extract, in this order.
+    :return: generator of lists of arrays, one array per field.
+    """
+    idx = [stream.fields.index(f) for f in fields]
+    while True:
+        rows = list(islice(stream, size))
+        if not rows: break
+        yield [numpy.asarray([x[i] for x in rows]) for i in idx]
+
+
+def stream_arrays(stream, fields=('start','end','score')):
+    """Read the whole stream (typically one chromosome) into one array per field."""
+    idx = [stream.fields.index(f) for f in fields]
+    rows = list(stream)
+    return [numpy.asarray([x[i] for x in rows]) for i in idx]
+
+
+def arrays_stream(*arrays):
+    """Iterate over the rows of a set of columns, as tuples of python scalars."""
+    return izip(*[a.tolist() for a in arrays])
+
+
+def segment_values(starts, ends, scores, bounds):
+    """
+    Values of a piecewise constant signal (sorted, non-overlapping features)
+    on the segments ``[bounds[k], bounds[k+1])``, which must not cross a feature
+    boundary. Returns the values (0 where not covered) and the coverage mask.
+    """
+    pos = bounds[:-1]
+    idx = numpy.searchsorted(starts, pos, side='right')-1
+    covered = idx >= 0
+    idx[~covered] = 0
+    if len(starts):
+        covered &= ends[idx] > pos
+        values = numpy.where(covered, scores[idx], 0)
+    else:
+        values = numpy.zeros(len(pos))
+    return values, covered
+
+
+def aligned_chunks(streams, size=CHUNK_SIZE, shifts=None):
+    """
+    Read several signal streams (features sorted and non-overlapping within
+    each stream) by chunks, and cut them at the union of their breakpoints,
+    like :func:`bbcflib.gfminer.stream.merge_scores`.
+
+    :param shifts: optional offset added to the coordinates of each stream.
+    :return: generator of ``(start, end, scores)`` where *scores* is a 2D array
+        with one row per stream (0 where a stream has no feature). Only the
+        segments covered by at least one stream are returned.
+    """
+    readers = [stream_chunks(s, size=size) for s in streams]
+    empty = [numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int), numpy.zeros(0)]
+    buffers = [list(empty) for _ in readers]
+    alive = [True]*len(readers)
+
+    def _fill(n):
+        try:
+            chunk = next(readers[n])
+        except StopIteration:
+            alive[n] = False
+            return
+        if shifts is not None and shifts[n]:
+            chunk[0] += shifts[n]
+            chunk[1] += shifts[n]
+        buffers[n] = [numpy.concatenate((b, c)) for b,c in zip(buffers[n], chunk)]
+
+    for n in range(len(readers)):
+        _fill(n)
+    while any(len(b[0]) for b in buffers):
+        for n,b in enumerate(buffers):
+            if alive[n] and len(b[0]) < size: _fill(n)
+        # Features starting after cut may still be followed by unread ones
+        cut = min([b[0][-1] if len(b[0]) else -1 for n,b in enumerate(buffers) if alive[n]]
+                  or [numpy.inf])
+        if cut <= min(b[0][0] for b in buffers if len(b[0])):
+            for n in range(len(readers)):
+                if alive[n]: _fill(n)
+            continue
+        if numpy.isinf(cut):
+            parts = buffers
+            buffers = [list(empty) for _ in readers]
+        else:
+            parts = []
+            for n,(s,e,v) in enumerate(buffers):
+                k = numpy.searchsorted(s, cut)
+                parts.append((s[:k], numpy.minimum(e[:k], cut), v[:k]))
+                keep = e > cut
+                keep[k:] = True
+                buffers[n] = [numpy.maximum(s[keep], cut), e[keep], v[keep]]
+        bounds = numpy.unique(numpy.concatenate([p[0] for p in parts]+[p[1] for p in parts]))
+        if len(bounds) < 2: continue
+        values = []
+        covered = numpy.zeros(len(bounds)-1, dtype=bool)
+        for s,e,v in parts:
+            val, cov = segment_values(s, e, v, bounds)
+            values.append(val)
+            covered |= cov
+        yield bounds[:-1][covered], bounds[1:][covered], numpy.vstack(values)[:, covered]
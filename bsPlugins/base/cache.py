@@ -0,0 +1,219 @@
+"""
+On-disk caches shared by all plugins.
+
+Everything is stored under CACHE_DIR, which can be moved with the
+BSPLUGINS_CACHE environment variable. Caching the output files of the
+plugins (see :class:`ResultCache`) is enabled by setting
+BSPLUGINS_RESULTS_CACHE to 1.
+"""
+import os
+import time
+import json
+import shutil
+import hashlib
+import tempfile
+
+
+CACHE_DIR = os.environ.get('BSPLUGINS_CACHE',
+                           os.path.join(os.path.expanduser('~'), '.bsPlugins'))
+ASSEMBLIES_TTL = int(os.environ.get('BSPLUGINS_ASSEMBLIES_TTL', 24*3600))
+RESULTS_MAX_SIZE = int(os.environ.get('BSPLUGINS_RESULTS_SIZE', 2**30))
+RESULTS_CACHE = os.environ.get('BSPLUGINS_RESULTS_CACHE', '0') not in ('', '0')
+DIGESTS_MAX = 10000
+
+_assemblies = None
+_digests = {}
+
+
+def cache_path(*names):
+    """
+    Return the path to a file in the cache directory, creating the
+    intermediate directories if needed.
+    """
+    path = os.path.join(CACHE_DIR, *names)
+    dirname = os.path.dirname(path)
+    if not os.path.exists(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            pass
+    return path
+
+
+def load_json(path, ttl=None):
+    """
+    Read a json file from the cache.
+    :param ttl: maximum age of the file in seconds (no limit if None).
+    :return: the decoded content, or None if the file is missing, unreadable or expired.
+    """
+    try:
+        if ttl is not None and time.time()-os.path.getmtime(path) > ttl:
+            return None
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save_json(path, data):
+    """
+    Atomically write *data* as json to *path*, so that concurrent readers
+    never see a partial file. Errors (e.g. read-only cache) are ignored.
+    """
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def file_digest(path):
+    """
+    SHA1 of the content of *path*. Digests are remembered in CACHE_DIR, one
+    file per path, with the size and modification time of the file, so that
+    a file is only read again when it has changed. At most DIGESTS_MAX paths
+    are remembered, the least recently hashed are forgotten first.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime)
+    if key in _digests:
+        return _digests[key]
+    entry = cache_path('digests', hashlib.sha1(path).hexdigest()+'.json')
+    known = load_json(entry)
+    if known is None or [known.get('size'), known.get('mtime')] != [st.st_size, st.st_mtime]:
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), ''):
+                sha.update(block)
+        known = {'path': path, 'size': st.st_size, 'mtime': st.st_mtime, 'sha1': sha.hexdigest()}
+        # Written atomically: concurrent workers hashing the same file write the same entry
+        save_json(entry, known)
+        _prune(os.path.dirname(entry), DIGESTS_MAX)
+    _digests[key] = known['sha1']
+    return known['sha1']
+
+
+def _prune(dirname, max_files):
+    """Remove the oldest files of *dirname* beyond the *max_files* most recent."""
+    try:
+        names = os.listdir(dirname)
+    except OSError:
+        return
+    if len(names) <= max_files: return
+    entries = []
+    for f in names:
+        if f.startswith('tmp'): continue  # being written
+        try:
+            entries.append((os.path.getmtime(os.path.join(dirname, f)), f))
+        except OSError:
+            pass
+    for mtime, f in sorted(entries)[:len(entries)-max_files]:
+        try:
+            os.remove(os.path.join(dirname, f))
+        except OSError:
+            pass
+
+
+class ResultCache(object):
+    """
+    Output files of plugins, stored in CACHE_DIR/*name* under a key computed
+    from everything that determines their content (see :meth:`key`).
+    Least recently used files are removed when the total size exceeds
+    *max_size* bytes (default: RESULTS_MAX_SIZE). Example::
+
+    >>> results = ResultCache('quantify')
+    >>> key = results.key(plugin.unique_id(), [file_digest(f) for f in inputs], params)
+    >>> if not results.get(key, output):
+    ...     compute(output)
+    ...     results.put(key, output)
+    """
+    def __init__(self, name, max_size=None):
+        self.name = name
+        self.max_size = RESULTS_MAX_SIZE if max_size is None else max_size
+
+    def key(self, *parts):
+        """Hash of json-serializable *parts*."""
+        return hashlib.sha1(json.dumps(parts, sort_keys=True)).hexdigest()
+
+    def _path(self, key):
+        return cache_path(self.name, key)
+
+    def get(self, key, dest):
+        """Copy the file cached under *key* to *dest*. Returns False if there is none."""
+        path = self._path(key)
+        try:
+            shutil.copyfile(path, dest)
+            os.utime(path, None)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def put(self, key, src):
+        """Store a copy of file *src* under *key*, then evict old entries if needed."""
+        path = self._path(key)
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            os.close(fd)
+            shutil.copyfile(src, tmp)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        dirname = os.path.dirname(self._path('x'))
+        entries = []
+        for f in os.listdir(dirname):
+            if f.startswith('tmp'): continue  # being written
+            try:
+                st = os.stat(os.path.join(dirname, f))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, f))
+        total = sum(e[1] for e in entries)
+        for mtime, size, f in sorted(entries):
+            if total <= self.max_size: break
+            try:
+                os.remove(os.path.join(dirname, f))
+                total -= size
+            except OSError:
+                pass
+
+
+def assemblies_available(ttl=None, refresh=False):
+    """
+    List of assemblies known to GenRep, as returned by
+    ``genrep.GenRep().assemblies_available()``.
+
+    The list is fetched once, then kept in memory and in CACHE_DIR for *ttl*
+    seconds (default: ASSEMBLIES_TTL), so that importing plugin modules
+    does not query GenRep each time. If GenRep cannot be reached, the
+    last cached list is used whatever its age, or an empty list.
+    :param refresh: ignore the cached list and query GenRep.
+    """
+    global _assemblies
+    if _assemblies is not None and not refresh:
+        return _assemblies
+    if ttl is None: ttl = ASSEMBLIES_TTL
+    path = cache_path('assemblies.json')
+    cached = None if refresh else load_json(path, ttl)
+    if cached is None:
+        try:
+            from bbcflib import genrep
+            cached = [list(a) for a in genrep.GenRep().assemblies_available()]
+            save_json(path, cached)
+        except Exception:
+            cached = load_json(path) or []
+    _assemblies = [tuple(a) for a in cached]
+    return _assemblies
+
+
+if __name__ == '__main__':
+    import sys
+    if '--refresh' in sys.argv:
+        print "%d assemblies cached in %s" % (len(assemblies_available(refresh=True)), CACHE_DIR)
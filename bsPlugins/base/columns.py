@@ -0,0 +1,114 @@
+"""
+Optional columnar copy of the tracks read by the plugins: the start, end
+and score of each chromosome are saved as .npy files in
+CACHE_DIR/columns/<sha1 of the track>/<sha1 of the chrmeta>/ the first time
+they are read, and memory-mapped afterwards instead of parsing the track again.
+The columns keep the types of the track.
+
+Enabled by setting the BSPLUGINS_TRACK_CACHE environment variable to 1.
+The directory of a track is keyed by the content hash of the track only (see
+:func:`file_digest`, itself remembered by path, size and modification time),
+not by its path: copies of a track share their entries, and a modified track
+is read again. The directory can be deleted at any time.
+"""
+import os
+import json
+import hashlib
+import numpy
+
+from bsPlugins.base.arrays import stream_arrays, arrays_stream
+from bsPlugins.base.cache import cache_path, file_digest
+from bsPlugins.base.parallel import open_track, chrmeta_key
+
+TRACK_CACHE = os.environ.get('BSPLUGINS_TRACK_CACHE', '0') not in ('', '0')
+COLUMNS = ('start', 'end', 'score')
+
+_caches = {}
+
+
+def _parse(path, chrom, chrmeta=None):
+    """Columns of *chrom* read from the track (scores are 0 if the track has none)."""
+    t = open_track(path, chrmeta=chrmeta)
+    if 'score' in t.fields:
+        return stream_arrays(t.read(selection=chrom, fields=list(COLUMNS)))
+    s, e = stream_arrays(t.read(selection=chrom, fields=['start','end']), fields=('start','end'))
+    return [s, e, numpy.zeros(len(s))]
+
+
+def _load(path):
+    try:
+        return numpy.load(path, mmap_mode='r')
+    except ValueError:  # empty arrays cannot be mapped
+        return numpy.load(path)
+
+
+class ColumnCache(object):
+    """
+    Columns of the track *path*, one chromosome at a time. Example::
+
+    >>> starts, ends, scores = ColumnCache.open('signal.bedGraph').arrays('chr1')
+    """
+    def __init__(self, path, chrmeta=None):
+        self.path = os.path.abspath(path)
+        self.chrmeta = chrmeta
+        self.digest = file_digest(self.path)
+        self.meta = hashlib.sha1(json.dumps(chrmeta_key(chrmeta))).hexdigest()
+
+    @classmethod
+    def open(cls, path, chrmeta=None):
+        """One instance per track, version of its content and *chrmeta*, for the life of the process."""
+        path = os.path.abspath(path)
+        key = (path, os.path.getmtime(path), chrmeta_key(chrmeta))
+        if key not in _caches:
+            _caches[key] = cls(path, chrmeta)
+        return _caches[key]
+
+    def _file(self, chrom, column):
+        return cache_path('columns', self.digest, self.meta, '%s.%s.npy' % (chrom, column))
+
+    def build(self, chrom):
+        """Read *chrom* from the track and save its columns."""
+        arrays = [numpy.asarray(a) for a in _parse(self.path, chrom, self.chrmeta)]
+        # The score file is renamed last: its presence marks a complete entry
+        for column, a in zip(COLUMNS, arrays):
+            path = self._file(chrom, column)
+            tmp = path+'.%i.npy' % os.getpid()
+            try:
+                numpy.save(tmp, a)
+                os.rename(tmp, path)
+            except (IOError, OSError):
+                return arrays
+        return arrays
+
+    def arrays(self, chrom):
+        """Read-only memory maps of the start, end and score columns of *chrom*."""
+        if not os.path.exists(self._file(chrom, 'score')):
+            return self.build(chrom)
+        return [_load(self._file(chrom, column)) for column in COLUMNS]
+
+
+def read_columns(path, chrom, chrmeta=None):
+    """
+    The start, end and score arrays of *chrom* in track *path*, from the
+    column cache if enabled (see TRACK_CACHE), else parsed from the track.
+    """
+    if TRACK_CACHE:
+        return ColumnCache.open(path, chrmeta).arrays(chrom)
+    return _parse(path, chrom, chrmeta)
+
+
+def read_stream(path, chrom, chrmeta=None, fields=None):
+    """
+    Like ``open_track(path, chrmeta).read(selection=chrom, fields=fields)``,
+    from the column cache if it is enabled and all *fields* (by default the
+    track's) are among chr, start, end and score.
+    """
+    from bbcflib.track import FeatureStream
+    t = open_track(path, chrmeta=chrmeta)
+    fields = fields or t.fields
+    if not (TRACK_CACHE and all(f in ('chr',)+COLUMNS for f in fields)
+            and ('score' not in fields or 'score' in t.fields)):
+        return t.read(selection=chrom, fields=fields)
+    columns = dict(zip(COLUMNS, ColumnCache.open(path, chrmeta).arrays(chrom)))
+    columns['chr'] = numpy.repeat(numpy.array([chrom], dtype=object), len(columns['start']))
+    return FeatureStream(arrays_stream(*[columns[f] for f in fields]), fields=list(fields))
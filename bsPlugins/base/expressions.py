@@ -0,0 +1,88 @@
+"""
+Arithmetic expressions and filtering rules of a score, compiled once into a
+composition of numpy ufuncs applied to whole arrays, without eval.
+"""
+import ast
+import re
+import numpy
+
+FUNCTIONS = {'log': numpy.log, 'log2': numpy.log2, 'log10': numpy.log10,
+             'sqrt': numpy.sqrt, 'exp': numpy.exp, 'abs': numpy.abs}
+_binops = {ast.Add: numpy.add, ast.Sub: numpy.subtract, ast.Mult: numpy.multiply,
+           ast.Div: numpy.true_divide, ast.Pow: numpy.power}
+_unaryops = {ast.USub: numpy.negative, ast.UAdd: lambda x: x}
+
+
+def compile_expression(expr, variable='x'):
+    """
+    Compile an expression of *variable* made of numbers, ``+ - * / **``,
+    parentheses and the functions of FUNCTIONS, e.g. ``'log2(x+1)'``, into
+    a function of a numpy array. Anything else raises a ValueError.
+    """
+    try:
+        tree = ast.parse(expr.strip(), mode='eval').body
+    except SyntaxError:
+        raise ValueError("Invalid expression: %s" % expr)
+
+    def _compile(node):
+        if isinstance(node, ast.Num):
+            value = float(node.n)
+            return lambda x: value
+        if isinstance(node, ast.Name) and node.id == variable:
+            return lambda x: x
+        if isinstance(node, ast.BinOp) and type(node.op) in _binops:
+            op, left, right = _binops[type(node.op)], _compile(node.left), _compile(node.right)
+            return lambda x: op(left(x), right(x))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _unaryops:
+            op, operand = _unaryops[type(node.op)], _compile(node.operand)
+            return lambda x: op(operand(x))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+                and node.func.id in FUNCTIONS and len(node.args) == 1 \
+                and not (node.keywords or getattr(node, 'starargs', None) or getattr(node, 'kwargs', None)):
+            func, arg = FUNCTIONS[node.func.id], _compile(node.args[0])
+            return lambda x: func(arg(x))
+        raise ValueError("Unsupported expression: %s" % expr)
+
+    compiled = _compile(tree)
+
+    def transform(x):
+        x = numpy.asarray(x, dtype=float)
+        with numpy.errstate(all='ignore'):
+            return compiled(x)+numpy.zeros(x.shape)  # constants broadcast to the shape of x
+    return transform
+
+
+_comparisons = {'<': numpy.less, '<=': numpy.less_equal, '>': numpy.greater,
+                '>=': numpy.greater_equal, '==': numpy.equal, '!=': numpy.not_equal}
+_condition = re.compile(r'^\s*(<=|>=|==|!=|<|>)\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*$')
+
+
+def compile_filter(rule):
+    """
+    Compile a filtering rule made of comparisons to numbers joined by AND and
+    OR (AND binding first), e.g. ``'>=2 OR <=-2'``, into a function returning
+    the boolean array of the values passing it. An empty rule passes everything.
+    """
+    clauses = []
+    if rule.strip():
+        for clause in re.split(r'\s+OR\s+', rule.strip()):
+            terms = []
+            for term in re.split(r'\s+AND\s+', clause):
+                m = _condition.match(term)
+                if m is None:
+                    raise ValueError("Invalid filter: %s" % rule)
+                terms.append((_comparisons[m.group(1)], float(m.group(2))))
+            clauses.append(terms)
+
+    def test(x):
+        x = numpy.asarray(x, dtype=float)
+        if not clauses:
+            return numpy.ones(x.shape, dtype=bool)
+        passed = numpy.zeros(x.shape, dtype=bool)
+        for terms in clauses:
+            both = numpy.ones(x.shape, dtype=bool)
+            for op, value in terms:
+                both &= op(x, value)
+            passed |= both
+        return passed
+    return test
@@ -0,0 +1,116 @@
+"""
+Count histograms accumulated by batches of numpy arrays, in bounded memory.
+"""
+import numpy
+
+
+class Histogram2D(object):
+    """
+    Counts of (x, y) pairs in bins of *xbin* x *ybin*, for x in ``[xmin, xmax)``
+    and y >= 0. The number of y bins grows with the largest y seen. Example::
+
+    >>> h = Histogram2D(0, 2000, 5, 5)
+    >>> h.add(positions, sizes)  # any number of times
+    >>> h.counts  # one row per x bin, one column per y bin
+    """
+    def __init__(self, xmin, xmax, xbin=1, ybin=1):
+        self.xmin, self.xbin, self.ybin = xmin, xbin, ybin
+        self.nx = max(1, -(-(xmax-xmin)//xbin))
+        self.counts = numpy.zeros((self.nx, 1), dtype=int)
+        self.total = 0
+        self.ymax = None
+
+    def add(self, x, y):
+        x = numpy.asarray(x, dtype=int)
+        y = numpy.asarray(y, dtype=int)
+        if not len(y): return
+        self.ymax = max(self.ymax, int(y.max())) if self.ymax is not None else int(y.max())
+        xi = (x-self.xmin)//self.xbin
+        yi = y//self.ybin
+        keep = (xi >= 0) & (xi < self.nx) & (yi >= 0)
+        xi, yi = xi[keep], yi[keep]
+        if not len(yi): return
+        ny = self.counts.shape[1]
+        if yi.max() >= ny:
+            grown = numpy.zeros((self.nx, int(yi.max())+1), dtype=int)
+            grown[:, :ny] = self.counts
+            self.counts = grown
+            ny = grown.shape[1]
+        self.counts += numpy.bincount(xi*ny+yi, minlength=self.nx*ny).reshape(self.nx, ny)
+        self.total += len(yi)
+
+    def xedges(self):
+        return self.xmin+numpy.arange(self.nx+1)*self.xbin
+
+    def yedges(self):
+        return numpy.arange(self.counts.shape[1]+1)*self.ybin
+
+    def save(self, path, xlabel='x', ylabel='y'):
+        """Write the counts as a tab-delimited table, one row per x bin, one column per y bin."""
+        with open(path, 'w') as f:
+            f.write("\t".join(["#%s\\%s" % (xlabel, ylabel)]+[str(y) for y in self.yedges()[:-1]])+"\n")
+            for x, row in zip(self.xedges()[:-1].tolist(), self.counts.tolist()):
+                f.write("\t".join([str(x)]+[str(c) for c in row])+"\n")
+        return path
+
+
+class QuantileSketch(object):
+    """
+    Approximate distribution of a stream of values in bounded memory, in the
+    manner of a merging t-digest: values are buffered, then compressed with
+    the current centroids into at most about *compression*/2 weighted
+    centroids, narrower towards the tails. Sketches of disjoint parts of the
+    data can be merged. Example::
+
+    >>> q = QuantileSketch()
+    >>> q.add(scores)  # any number of times
+    >>> q.quantile([.25, .5, .75])
+    """
+    def __init__(self, compression=200):
+        self.compression = compression
+        self.means = numpy.zeros(0)
+        self.weights = numpy.zeros(0)
+        self._buffer = []
+        self._buffered = 0
+
+    def add(self, values, weights=None):
+        values = numpy.asarray(values, dtype=float).ravel()
+        if not len(values): return
+        if weights is None:
+            weights = numpy.ones(len(values))
+        self._buffer.append((values, numpy.asarray(weights, dtype=float)))
+        self._buffered += len(values)
+        if self._buffered > 5*self.compression:
+            self.compress()
+
+    def merge(self, other):
+        other.compress()
+        self.add(other.means, other.weights)
+
+    def compress(self):
+        if not self._buffer: return
+        means = numpy.concatenate([self.means]+[b[0] for b in self._buffer])
+        weights = numpy.concatenate([self.weights]+[b[1] for b in self._buffer])
+        self._buffer = []
+        self._buffered = 0
+        order = numpy.argsort(means, kind='mergesort')
+        means, weights = means[order], weights[order]
+        q = (numpy.cumsum(weights)-weights/2)/weights.sum()
+        # Scale function k1 of the t-digest: small centroids near q = 0 and q = 1
+        k = numpy.floor(self.compression/(2*numpy.pi)*numpy.arcsin(2*q-1))
+        _, group = numpy.unique(k, return_inverse=True)
+        self.weights = numpy.bincount(group, weights=weights)
+        self.means = numpy.bincount(group, weights=weights*means)/self.weights
+
+    @property
+    def count(self):
+        self.compress()
+        return self.weights.sum()
+
+    def quantile(self, q):
+        """Approximate quantile(s) *q* (in [0, 1]), interpolated between the centroids."""
+        self.compress()
+        if not len(self.means):
+            return numpy.zeros(numpy.shape(q))*numpy.nan
+        mid = (numpy.cumsum(self.weights)-self.weights/2)/self.weights.sum()
+        return numpy.interp(q, mid, self.means)
@@ -0,0 +1,231 @@
+"""
+Array-backed interval index, to answer overlap queries on one chromosome
+with vectorized binary searches instead of streaming both tracks, and
+boolean combinations of any number of tracks in one sweep.
+"""
+from itertools import islice
+import numpy
+
+from bsPlugins.base.arrays import CHUNK_SIZE
+
+
+def merge_intervals(starts, ends):
+    """
+    Union of a set of intervals, as sorted, non-overlapping (start, end) arrays.
+    Adjacent intervals are merged.
+    """
+    starts = numpy.asarray(starts)
+    ends = numpy.asarray(ends)
+    if not len(starts):
+        return starts.astype(int), ends.astype(int)
+    order = numpy.argsort(starts, kind='mergesort')
+    starts = starts[order]
+    ends = numpy.maximum.accumulate(ends[order])
+    new = numpy.ones(len(starts), dtype=bool)
+    new[1:] = starts[1:] > ends[:-1]
+    first = numpy.flatnonzero(new)
+    last = numpy.append(first[1:], len(starts))-1
+    return starts[first], ends[last]
+
+
+class IntervalIndex(object):
+    """
+    Intervals of one chromosome, sorted by start, with the running maximum of
+    their ends so that nested intervals do not break the binary searches.
+    ``offsets[k]`` is the position in the original rows (the payload) of
+    the k-th interval. Example::
+
+    >>> index = IntervalIndex.from_stream(peaks.read('chr1'))
+    >>> mask = index.overlaps(starts, ends)
+    >>> index.payload[index.offsets[k]]
+    """
+    def __init__(self, starts, ends, payload=None):
+        starts = numpy.asarray(starts, dtype=int)
+        ends = numpy.asarray(ends, dtype=int)
+        self.offsets = numpy.argsort(starts, kind='mergesort')
+        self.starts = starts[self.offsets]
+        self.ends = ends[self.offsets]
+        if len(ends):
+            self.max_ends = numpy.maximum.accumulate(self.ends)
+        else:
+            self.max_ends = self.ends
+        self.payload = payload
+
+    @classmethod
+    def from_stream(cls, stream, keep=False):
+        """
+        Build the index from a feature stream (one chromosome).
+        :param keep: keep the rows of the stream as payload.
+        """
+        ks, ke = stream.fields.index('start'), stream.fields.index('end')
+        rows = list(stream)
+        return cls([x[ks] for x in rows], [x[ke] for x in rows], rows if keep else None)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlaps(self, starts, ends):
+        """Boolean mask of the queries overlapping at least one indexed interval."""
+        k = numpy.searchsorted(self.starts, numpy.asarray(ends), side='left')
+        return self._max_end(k) > numpy.asarray(starts)
+
+    def _max_end(self, k):
+        """Largest end among the first *k* intervals (-1 if k == 0)."""
+        if not len(self.starts):
+            return numpy.zeros(len(k), dtype=int)-1
+        return numpy.where(k > 0, self.max_ends[numpy.maximum(k-1, 0)], -1)
+
+
+def filter_stream(stream, index, size=CHUNK_SIZE):
+    """
+    Features of *stream* that overlap one interval of *index*, read and
+    tested by chunks of *size* features.
+    """
+    ks, ke = stream.fields.index('start'), stream.fields.index('end')
+    while True:
+        rows = list(islice(stream, size))
+        if not rows: break
+        mask = index.overlaps(numpy.array([x[ks] for x in rows]), numpy.array([x[ke] for x in rows]))
+        for n in numpy.flatnonzero(mask):
+            yield rows[n]
+
+
+COMBINE_FIELDS = ['chr','start','end','score','name','strand']
+
+
+def _combine_columns(rows, fields):
+    """Start, end, score, name and strand columns of a list of rows."""
+    col = lambda f, default: [x[fields.index(f)] for x in rows] if f in fields else [default]*len(rows)
+    return (numpy.asarray(col('start', 0), dtype=int), numpy.asarray(col('end', 0), dtype=int),
+            numpy.asarray(col('score', 0), dtype=float), col('name', ''), col('strand', '.'))
+
+
+def _take_columns(columns, idx):
+    return (columns[0][idx], columns[1][idx], columns[2][idx],
+            [columns[3][i] for i in idx], [columns[4][i] for i in idx])
+
+
+def _concat_columns(a, b):
+    return (numpy.concatenate((a[0], b[0])), numpy.concatenate((a[1], b[1])),
+            numpy.concatenate((a[2], b[2])), a[3]+b[3], a[4]+b[4])
+
+
+def _combine_segments(columns, bounds, fn, chrom, fields):
+    """Rows of the segments between consecutive *bounds* for which ``fn(X)`` is true."""
+    pos = bounds[:-1]
+    covered = numpy.zeros((len(columns), len(pos)), dtype=bool)
+    scores = numpy.zeros(len(pos))
+    for n,(s,e,v,_,_) in enumerate(columns):
+        bys, bye = numpy.argsort(s, kind='mergesort'), numpy.argsort(e, kind='mergesort')
+        ks = numpy.searchsorted(s[bys], pos, side='right')
+        ke = numpy.searchsorted(e[bye], pos, side='right')
+        covered[n] = ks > ke
+        # Sum of the scores of the features started minus those ended before pos
+        started = numpy.concatenate(([0], numpy.cumsum(v[bys])))[ks]
+        ended = numpy.concatenate(([0], numpy.cumsum(v[bye])))[ke]
+        scores += numpy.where(covered[n], started-ended, 0)
+    keep = numpy.flatnonzero(numpy.asarray(fn(covered), dtype=bool))
+    # Names and strands of all the features covering each kept segment
+    members = [[] for k in keep]
+    if 'name' in fields or 'strand' in fields:
+        kpos = pos[keep]
+        for s,e,v,names,strands in columns:
+            first = numpy.searchsorted(kpos, s, side='left')
+            last = numpy.searchsorted(kpos, e, side='left')
+            for i in numpy.flatnonzero(last > first).tolist():
+                for j in xrange(first[i], last[i]):
+                    members[j].append((names[i], strands[i]))
+    for k, feats in zip(keep.tolist(), members):
+        names = [x[0] for x in feats if x[0]]
+        strands = set(x[1] for x in feats)
+        values = {'chr': chrom, 'start': int(bounds[k]), 'end': int(bounds[k+1]),
+                  'score': float(scores[k]), 'name': '|'.join(names),
+                  'strand': strands.pop() if len(strands) == 1 else '.'}
+        yield tuple(values[f] for f in fields)
+
+
+def sweep_combine(streams, fn, chrom=None, length=None, fields=None, size=CHUNK_SIZE):
+    """
+    Cut the features of *streams* (one chromosome, sorted by start as for
+    :func:`bbcflib.gfminer.stream.combine`) at the union of their breakpoints
+    and return the segments for which ``fn(X)`` is true, in one sweep.
+
+    *X* is a boolean array with one row per stream and one column per
+    segment, true where the stream covers the segment, so *fn* is a vectorized
+    formula, e.g. ``numpy.sum(X, axis=0) >= 2`` for "in at least 2 tracks".
+    Scores of the covering features are summed, their names joined with '|'
+    and their strands kept if they agree ('.' otherwise).
+
+    The streams are read by chunks of *size* features: only the features
+    overlapping the current window are kept in memory.
+
+    :param length: if given, a feature covering the whole chromosome is added
+        as first row of *X*, e.g. to compute complements.
+    :param fields: output fields among COMBINE_FIELDS, default: those of the first stream.
+    """
+    from bbcflib.track import FeatureStream
+    if fields is None:
+        fields = [f for f in streams[0].fields if f in COMBINE_FIELDS]
+
+    def _rows():
+        whole = [] if length is None else \
+                [(numpy.array([0]), numpy.array([length]), numpy.zeros(1), [''], ['.'])]
+        buffers = [_combine_columns([], []) for stream in streams]
+        last = [None]*len(streams)  # largest start read from each stream, None once exhausted
+        reading = range(len(streams))
+        lo = None
+        while True:
+            for n in reading:
+                rows = list(islice(streams[n], size))
+                if rows:
+                    chunk = _combine_columns(rows, streams[n].fields)
+                    buffers[n] = _concat_columns(buffers[n], chunk)
+                    last[n] = int(chunk[0][-1])
+                else:
+                    last[n] = None
+            open_streams = [n for n in range(len(streams)) if last[n] is not None]
+            # Features starting after *cut* are unknown, so are the boundaries after it
+            cut = min(last[n] for n in open_streams) if open_streams else None
+            columns = whole+buffers
+            bounds = numpy.unique(numpy.concatenate([c[0] for c in columns]+[c[1] for c in columns]))
+            if lo is not None: bounds = bounds[bounds >= lo]
+            if cut is not None: bounds = bounds[bounds <= cut]
+            if len(bounds) > 1:
+                for row in _combine_segments(columns, bounds, fn, chrom, fields):
+                    yield row
+            if cut is None: break
+            if len(bounds): lo = int(bounds[-1])
+            # Features ended before the next window
+            buffers = [_take_columns(b, numpy.flatnonzero(b[1] > lo)) if lo is not None else b
+                       for b in buffers]
+            reading = [n for n in open_streams if last[n] == cut]
+    return FeatureStream(_rows(), fields=fields)
+
+
+def coverage_masks(columns):
+    """
+    Sweep the features of several tracks (one chromosome), given as
+    ``(starts, ends, scores)`` arrays, and label each segment between two
+    consecutive boundaries with the bitmask of the tracks covering it (bit n
+    for the n-th track) and the sum of the scores of the covering features.
+    :return: ``(starts, ends, masks, scores)`` of the segments covered by at least one track.
+    """
+    bounds = numpy.unique(numpy.concatenate([numpy.asarray(c[0], dtype=int) for c in columns]+
+                                            [numpy.asarray(c[1], dtype=int) for c in columns]))
+    if len(bounds) < 2:
+        return bounds[:0], bounds[:0], bounds[:0], numpy.zeros(0)
+    pos = bounds[:-1]
+    masks = numpy.zeros(len(pos), dtype=int)
+    scores = numpy.zeros(len(pos))
+    for n,(s,e,v) in enumerate(columns):
+        s, e, v = numpy.asarray(s), numpy.asarray(e), numpy.asarray(v, dtype=float)
+        bys, bye = numpy.argsort(s, kind='mergesort'), numpy.argsort(e, kind='mergesort')
+        ks = numpy.searchsorted(s[bys], pos, side='right')
+        ke = numpy.searchsorted(e[bye], pos, side='right')
+        covered = ks > ke
+        masks |= covered.astype(int) << n
+        started = numpy.concatenate(([0], numpy.cumsum(v[bys])))[ks]
+        ended = numpy.concatenate(([0], numpy.cumsum(v[bye])))[ke]
+        scores += numpy.where(covered, started-ended, 0)
+    keep = masks > 0
+    return pos[keep], bounds[1:][keep], masks[keep], scores[keep]
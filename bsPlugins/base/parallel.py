@@ -0,0 +1,161 @@
+"""
+Process pool to run the per-chromosome part of the plugins in parallel.
+
+The number of worker processes is given by the plugin's 'processes' argument
+if any, else by the BSPLUGINS_PROCESSES environment variable (default 1,
+i.e. no worker process; 0 means one per core).
+"""
+import os
+import multiprocessing
+
+PROCESSES = os.environ.get('BSPLUGINS_PROCESSES', 1)
+
+# Declared by the plugins that accept a 'processes' argument
+processes_parameter = {'id': 'processes', 'type': 'int', 'label': 'Processes: ',
+                       'help_text': 'Number of worker processes (default: BSPLUGINS_PROCESSES, 0 for one per core)'}
+
+_tracks = {}
+
+
+def nprocs(value=None):
+    """Number of worker processes to use, see the module documentation."""
+    try:
+        n = int(value)
+    except (TypeError, ValueError):
+        n = int(PROCESSES)
+    if n < 1: n = multiprocessing.cpu_count()
+    return n
+
+
+def _resolve(func):
+    """Functions are sent to the workers by name, methods as an (object, name) pair."""
+    if isinstance(func, tuple): return getattr(*func)
+    return func
+
+
+def _apply(job):
+    """Run one job in a worker, closing the tracks it opened even if it fails."""
+    func, args = job
+    try:
+        return _resolve(func)(*args)
+    finally:
+        close_tracks()
+
+
+def pool_map(func, jobs, processes=None):
+    """
+    Call *func* with each tuple of arguments in *jobs*, in *processes* worker processes.
+    *func* is a module-level function, or a pair (obj, method_name) where *obj* can be pickled.
+    :return: the list of results, in the order of *jobs*.
+    """
+    processes = min(nprocs(processes), len(jobs))
+    if processes <= 1:
+        try:
+            return [_resolve(func)(*args) for args in jobs]
+        finally:
+            close_tracks()
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_apply, [(func, args) for args in jobs], chunksize=1)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return results
+
+
+def chrom_map(func, chrmeta, args=(), processes=None):
+    """
+    Call ``func(chrom, *args)`` for every chromosome of *chrmeta*. The largest
+    chromosomes are dispatched first to balance the load.
+    :return: the list of results, in *chrmeta* order.
+    """
+    chroms = list(chrmeta)
+    order = sorted(range(len(chroms)), key=lambda n: -chrmeta[chroms[n]].get('length', 0))
+    results = pool_map(func, [(chroms[n],)+tuple(args) for n in order], processes)
+    ordered = [None]*len(chroms)
+    for n,res in zip(order, results): ordered[n] = res
+    return ordered
+
+
+def chrmeta_key(chrmeta):
+    """Hashable summary of a *chrmeta* argument: chromosome lengths, or the value itself."""
+    if isinstance(chrmeta, dict):
+        return tuple(sorted((c, v.get('length')) for c,v in chrmeta.iteritems()))
+    return chrmeta
+
+
+def open_track(path, chrmeta=None, **kw):
+    """
+    Open track *path* once per process: the per-chromosome functions call it
+    instead of ``track(path,...)`` to reuse the same track for every chromosome.
+    Tracks opened with a different *chrmeta* or format are distinct.
+    """
+    key = (path, chrmeta_key(chrmeta), kw.get('format'))
+    if key not in _tracks:
+        from bbcflib.track import track
+        _tracks[key] = track(path, chrmeta=chrmeta, **kw)
+    return _tracks[key]
+
+
+def close_tracks():
+    """Close the tracks opened by :func:`open_track` in this process."""
+    for t in _tracks.values(): t.close()
+    _tracks.clear()
+
+
+def _write_partial(chrom, func, paths, chrmeta, args, results):
+    from bbcflib.track import track
+    stream = _resolve(func)(chrom, *args)
+    if results: stream, result = stream
+    else: result = None
+    with track(paths[chrom], format='sql', fields=stream.fields, chrmeta={chrom: chrmeta[chrom]},
+               info={'datatype': 'qualitative'}) as tpart:
+        tpart.write(stream, chrom=chrom, clip=True)
+    return stream.fields, result
+
+
+def write_by_chrom(tout, func, chrmeta, args=(), processes=None, tmpdir=None, wrap=None,
+                   results=False, **kw):
+    """
+    Write the streams returned by ``func(chrom, *args)`` to track *tout*, one
+    chromosome after the other in *chrmeta* order.
+
+    With several processes, each worker writes the chromosomes it gets to partial
+    sql files in *tmpdir*, which are then copied to *tout*.
+    :param func: see :func:`pool_map`.
+    :param wrap: optional function ``wrap(stream, chrom)`` applied to each stream
+        before writing, always in the main process.
+    :param results: if True, *func* returns a pair ``(stream, result)`` and the
+        list of results, in *chrmeta* order, is returned.
+    :param kw: passed to ``tout.write``. If a *mode* is given, it is used for the
+        first chromosome, then 'append'.
+    """
+    def _write(stream, chrom):
+        if wrap is not None: stream = wrap(stream, chrom)
+        tout.write(stream, chrom=chrom, clip=True, **kw)
+        if 'mode' in kw: kw['mode'] = 'append'
+
+    if nprocs(processes) <= 1 or len(chrmeta) < 2:
+        output = []
+        try:
+            for chrom in chrmeta:
+                stream = _resolve(func)(chrom, *args)
+                if results:
+                    stream, result = stream
+                    output.append(result)
+                _write(stream, chrom)
+        finally:
+            close_tracks()
+        return output if results else None
+    from bbcflib.track import track
+    if tmpdir is None: tmpdir = '.'
+    if not os.path.exists(tmpdir): os.mkdir(tmpdir)
+    paths = dict((chrom, os.path.join(tmpdir, 'part%i.sql' % n)) for n,chrom in enumerate(chrmeta))
+    parts = chrom_map(_write_partial, chrmeta, (func, paths, chrmeta, args, results), processes)
+    for chrom, (_fields, result) in zip(chrmeta, parts):
+        with track(paths[chrom], format='sql') as tpart:
+            _write(tpart.read(selection=chrom, fields=_fields), chrom)
+        os.remove(paths[chrom])
+    if results:
+        return [result for _fields, result in parts]
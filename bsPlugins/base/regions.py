@@ -0,0 +1,93 @@
+"""
+Reading the alignments of many regions with one sorted sweep over the BAM file.
+"""
+
+
+def merged_blocks(intervals):
+    """
+    Group sorted (start, end) intervals into blocks of overlapping ones.
+    :return: list of ``(start, end, [indices])``.
+    """
+    blocks = []
+    for n,(s,e) in enumerate(intervals):
+        if blocks and s <= blocks[-1][1]:
+            blocks[-1][1] = max(blocks[-1][1], e)
+            blocks[-1][2].append(n)
+        else:
+            blocks.append([s, e, [n]])
+    return blocks
+
+
+def _sweep(fetch, regions, padding):
+    """
+    The reads overlapping each region, with one fetch per block of overlapping
+    regions: :func:`sweep_regions` without the reordering.
+    :return: generator of ``(index, region, reads)``, in the order the regions are completed.
+    """
+    bychrom = {}
+    chroms = []
+    for n,r in enumerate(regions):
+        if r[0] not in bychrom:
+            bychrom[r[0]] = []
+            chroms.append(r[0])
+        bychrom[r[0]].append((n, r))
+    for chrom in chroms:
+        regs = sorted(bychrom.pop(chrom), key=lambda x: (x[1][1], x[1][2]))
+        padded = [(max(0, r[1]-padding), r[2]+padding) for n,r in regs]
+        for bstart, bend, members in merged_blocks(padded):
+            pending = list(reversed(members))
+            active = []
+            # Reads that may overlap the next pending region
+            recent = []
+            limit = 64
+            for read in fetch(chrom, bstart, bend):
+                pos = read.pos
+                while pending and padded[pending[-1]][0] <= pos:
+                    k = pending.pop()
+                    active.append((k, [r for r in recent if r.aend > padded[k][0]]))
+                if any(padded[k][1] <= pos for k,_ in active):
+                    done = [a for a in active if padded[a[0]][1] <= pos]
+                    active = [a for a in active if padded[a[0]][1] > pos]
+                    for k, reads in done:
+                        yield regs[k][0], regs[k][1], reads
+                for k, reads in active:
+                    reads.append(read)
+                if pending:
+                    recent.append(read)
+                    if len(recent) > limit:
+                        recent = [r for r in recent if r.aend > padded[pending[-1]][0]]
+                        limit = max(64, 2*len(recent))
+                elif recent:
+                    recent = []
+            for k, reads in active:
+                yield regs[k][0], regs[k][1], reads
+            for k in reversed(pending):
+                yield regs[k][0], regs[k][1], [r for r in recent if r.aend > padded[k][0]]
+
+
+def sweep_regions(fetch, regions, padding=0, ordered=False):
+    """
+    Dispatch the reads overlapping each region, extended by *padding* on both
+    sides, like ``fetch(chrom, start-padding, end+padding)`` would, but with one
+    ``fetch(chrom, start, end)`` per block of overlapping regions instead of one
+    per region, so that nearby regions do not decode the same part of the BAM
+    file again. Reads starting before a region and overlapping it are included.
+
+    Regions are swept sorted by start within each chromosome, and returned as
+    they are completed. If *ordered*, they are returned in input order instead,
+    but the reads of the regions completed early are then kept in memory until
+    the preceding regions are returned (all of them for an unsorted input).
+    :param regions: iterable of rows starting with (chrom, start, end).
+    :return: generator of ``(region, reads)``, *reads* being sorted by position.
+    """
+    if not ordered:
+        for n, region, reads in _sweep(fetch, regions, padding):
+            yield region, reads
+        return
+    done = {}
+    following = 0
+    for n, region, reads in _sweep(fetch, regions, padding):
+        done[n] = (region, reads)
+        while following in done:
+            yield done.pop(following)
+            following += 1
@@ -0,0 +1,154 @@
+"""
+Lazy plugin registry.
+
+Serves the description of every plugin (info, in/out parameters and unique id)
+from a manifest file, so that listing the plugins does not import their modules
+(and rpy2, pysam, numpy, bbcflib...). A plugin module is only imported when the
+plugin class is requested, typically to run a job.
+
+The manifest is built once, e.g. at deployment::
+
+    python -m bsPlugins.base.registry [manifest_path]
+
+Entries of modules modified since are rebuilt on the fly, including those of
+modules that failed to import.
+"""
+import os
+import cPickle as pickle
+import inspect
+import tempfile
+
+import bsPlugins
+from bsPlugins import PLUGINS_FILES, BasePlugin
+
+MANIFEST = os.environ.get('BSPLUGINS_MANIFEST',
+                          os.path.join(bsPlugins.__path__[0], 'plugins.manifest'))
+
+
+def _module_file(name):
+    return os.path.join(bsPlugins.__path__[0], name+'.py')
+
+
+def _import(name):
+    return __import__('bsPlugins.'+name, fromlist=[name])
+
+
+def describe_module(name):
+    """
+    Import plugin module *name* and return the description of each plugin it defines.
+    """
+    module = _import(name)
+    entries = []
+    for cname, cls in inspect.getmembers(module, inspect.isclass):
+        if not issubclass(cls, BasePlugin) or cls.__module__ != module.__name__:
+            continue
+        plugin = cls()
+        entries.append({'module': name,
+                        'class': cname,
+                        'uid': plugin.unique_id(),
+                        'title': plugin.title,
+                        'description': plugin.description,
+                        'path': plugin.path,
+                        'in': plugin.in_parameters,
+                        'out': plugin.out_parameters,
+                        'meta': plugin.meta,
+                        'deprecated': plugin.deprecated})
+    return entries
+
+
+def build_manifest(path=None, modules=None, manifest=None):
+    """
+    Import the plugin modules and write their description to the manifest.
+    :param modules: names of the modules to (re)describe, default: all of PLUGINS_FILES.
+    :param manifest: an already loaded manifest to update.
+    :return: the manifest, a dict ``{module_name: {'mtime':..., 'plugins': [...]}}``.
+        Modules that fail to import have no plugins and the error message
+        under 'error'.
+    """
+    if path is None: path = MANIFEST
+    if modules is None: modules = PLUGINS_FILES
+    if manifest is None: manifest = {}
+    for name in modules:
+        mtime = os.path.getmtime(_module_file(name))
+        try:
+            manifest[name] = {'mtime': mtime, 'plugins': describe_module(name)}
+        except Exception, e:
+            # Recorded, so that the module is not imported again until it changes
+            manifest[name] = {'mtime': mtime, 'plugins': [], 'error': str(e)}
+    for name in manifest.keys():
+        if name not in PLUGINS_FILES: del manifest[name]
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(manifest, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+    return manifest
+
+
+class PluginRegistry(object):
+    """
+    Index of the available plugins, by unique id. Example ::
+
+    >>> from bsPlugins.base.registry import PluginRegistry
+    >>> registry = PluginRegistry()
+    >>> [p['title'] for p in registry.plugins()]
+    >>> plugin = registry.plugin(uid)  # imports the plugin module
+    >>> plugin(**kw)
+    """
+    def __init__(self, path=None):
+        self.path = path or MANIFEST
+        self._manifest = None
+        self._by_uid = None
+
+    def _load(self):
+        if self._manifest is not None: return
+        try:
+            with open(self.path, 'rb') as f:
+                manifest = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            manifest = {}
+        stale = [name for name in PLUGINS_FILES if name not in manifest
+                 or manifest[name]['mtime'] < os.path.getmtime(_module_file(name))]
+        if stale or any(name not in PLUGINS_FILES for name in manifest):
+            manifest = build_manifest(self.path, stale, manifest)
+        self._manifest = manifest
+        self._by_uid = dict((p['uid'], p) for name in PLUGINS_FILES
+                            for p in manifest.get(name, {}).get('plugins', []))
+
+    def plugins(self):
+        """Descriptions of all plugins, in the order of PLUGINS_FILES."""
+        self._load()
+        return [p for name in PLUGINS_FILES for p in self._manifest.get(name, {}).get('plugins', [])]
+
+    def info(self, uid):
+        """Description of the plugin with unique id *uid*: the keys of its `info`
+        dict, plus 'module', 'class' and 'uid'."""
+        self._load()
+        return self._by_uid[uid]
+
+    def unique_id(self, module, clsname):
+        self._load()
+        for p in self._manifest.get(module, {}).get('plugins', []):
+            if p['class'] == clsname: return p['uid']
+        raise KeyError("%s.%s" % (module, clsname))
+
+    def plugin_class(self, uid):
+        """Import the module of plugin *uid* and return its class."""
+        entry = self.info(uid)
+        return getattr(_import(entry['module']), entry['class'])
+
+    def plugin(self, uid):
+        """Return a new instance of plugin *uid*, ready to be called."""
+        return self.plugin_class(uid)()
+
+
+if __name__ == '__main__':
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else MANIFEST
+    manifest = build_manifest(path)
+    print "%d plugins from %d modules written to %s" \
+        % (sum(len(m['plugins']) for m in manifest.values()), len(manifest), path)
+    for name, m in sorted(manifest.items()):
+        if 'error' in m: print "Skipped plugin module %s: %s" % (name, m['error'])
@@ -0,0 +1,105 @@
+"""
+Estimation of the shift between the forward and reverse strand densities of
+a ChIP-seq experiment, from their cross-correlation on high-signal regions.
+"""
+import os
+import hashlib
+import numpy
+
+from bsPlugins.base.arrays import stream_arrays
+from bsPlugins.base.cache import cache_path, load_json, save_json, file_digest
+
+MAX_LAG = 300
+NREGIONS = 1000
+REGION_SIZE = 2048
+
+
+def _top_regions(tracks, chrmeta, nregions, region_size):
+    """Centers of the *nregions* highest features of *tracks*, as (chrom, start) pairs."""
+    candidates = []
+    for chrom in chrmeta:
+        for t in tracks:
+            s, e, v = stream_arrays(t.read(chrom, fields=['start','end','score']))
+            if not len(v): continue
+            top = numpy.argsort(v)[-nregions:]
+            centers = (s[top]+e[top])//2
+            candidates.extend(zip(v[top].tolist(), [chrom]*len(top),
+                                  numpy.maximum(centers-region_size//2, 0).tolist()))
+    candidates.sort(reverse=True)
+    return sorted(set((chrom, start) for _, chrom, start in candidates[:nregions]))
+
+
+def _densify(starts, ends, scores, lo, size):
+    """Per-basepair signal on ``[lo, lo+size)`` of sorted, non-overlapping features."""
+    i = numpy.searchsorted(ends, lo, side='right')
+    j = numpy.searchsorted(starts, lo+size, side='left')
+    delta = numpy.zeros(size+1)
+    numpy.add.at(delta, numpy.clip(starts[i:j]-lo, 0, size), scores[i:j])
+    numpy.add.at(delta, numpy.clip(ends[i:j]-lo, 0, size), -scores[i:j])
+    return numpy.cumsum(delta[:-1])
+
+
+def region_matrices(forward, reverse, regions, size):
+    """Signals of both strands on each region, as two 2D arrays (one row per region)."""
+    fwd = numpy.zeros((len(regions), size))
+    rev = numpy.zeros((len(regions), size))
+    chrom = None
+    for n,(c,lo) in enumerate(regions):
+        if c != chrom:
+            chrom = c
+            f = stream_arrays(forward.read(chrom, fields=['start','end','score']))
+            r = stream_arrays(reverse.read(chrom, fields=['start','end','score']))
+        fwd[n] = _densify(f[0], f[1], f[2], lo, size)
+        rev[n] = _densify(r[0], r[1], r[2], lo, size)
+    return fwd, rev
+
+
+def cross_correlation(fwd, rev, max_lag=MAX_LAG):
+    """
+    Correlation between ``fwd[:,x]`` and ``rev[:,x+lag]`` over all rows, for
+    lags in ``[-max_lag, max_lag]``, computed with one FFT per row.
+    """
+    fwd = fwd-fwd.mean(axis=1)[:,None]
+    rev = rev-rev.mean(axis=1)[:,None]
+    n = 2*fwd.shape[1]
+    spectrum = (numpy.conj(numpy.fft.rfft(fwd, n)) * numpy.fft.rfft(rev, n)).sum(axis=0)
+    xcor = numpy.fft.irfft(spectrum, n)
+    xcor = numpy.concatenate((xcor[-max_lag:], xcor[:max_lag+1]))
+    norm = numpy.sqrt((fwd**2).sum()*(rev**2).sum())
+    if norm > 0: xcor /= norm
+    return xcor
+
+
+def estimate_shift(forward, reverse, chrmeta=None, max_lag=MAX_LAG,
+                   nregions=NREGIONS, region_size=REGION_SIZE, cache=True):
+    """
+    Estimate the shift between the *forward* and *reverse* densities (paths)
+    as half the lag maximizing their cross-correlation on the *nregions*
+    regions of *region_size* bp around the highest features.
+
+    The result is cached in CACHE_DIR for each pair of input files (by content).
+    :return: ``(shift, confidence)``, where *confidence* is the correlation at
+        the chosen lag, between -1 and 1.
+    """
+    from bbcflib.track import track
+    key = hashlib.sha1(':'.join([file_digest(forward), file_digest(reverse),
+                                 str(max_lag), str(nregions), str(region_size)])).hexdigest()
+    path = cache_path('shifts', key+'.json')
+    if cache:
+        cached = load_json(path)
+        if cached is not None:
+            return cached['shift'], cached['confidence']
+    region_size = max(region_size, 2*max_lag+1)
+    with track(forward, chrmeta=chrmeta) as tfwd:
+        with track(reverse, chrmeta=chrmeta or tfwd.chrmeta) as trev:
+            regions = _top_regions([tfwd, trev], tfwd.chrmeta, nregions, region_size)
+            fwd, rev = region_matrices(tfwd, trev, regions, region_size)
+    if not len(regions):
+        return 0, 0.0
+    xcor = cross_correlation(fwd, rev, max_lag)
+    best = int(xcor.argmax())
+    shift, confidence = (best-max_lag)//2, float(xcor[best])
+    if cache:
+        save_json(path, {'shift': shift, 'confidence': confidence,
+                         'forward': os.path.abspath(forward), 'reverse': os.path.abspath(reverse)})
+    return shift, confidence
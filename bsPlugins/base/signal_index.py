@@ -0,0 +1,197 @@
+"""
+Prefix-sum index of a signal track, to quantify the signal on any set of
+intervals without reading the track again.
+
+The index of ``signal.bedGraph`` is saved in ``signal.bedGraph.sidx/``
+(or in CACHE_DIR if the track's directory is not writable), in one
+sub-directory per chrmeta, as one .npy file per chromosome and column, so
+that each chromosome can be memory-mapped alone. It is rebuilt when the
+track is modified.
+"""
+import os
+import json
+import hashlib
+import numpy
+
+from bsPlugins.base.columns import read_columns
+from bsPlugins.base.cache import cache_path, file_digest
+from bsPlugins.base.parallel import chrmeta_key
+
+INDEX_EXT = '.sidx'
+COLUMNS = ('starts', 'ends', 'scores')
+
+_indexes = {}
+
+
+class ChromIndex(object):
+    """
+    Sorted, non-overlapping signal segments of one chromosome with the
+    cumulative sums of their integral and of their lengths. Sum and mean
+    over an interval take two binary searches; min and max use a sparse
+    table built on first use. Uncovered basepairs count as 0.
+    """
+    def __init__(self, starts, ends, scores):
+        self.starts = numpy.asarray(starts, dtype=int)
+        self.ends = numpy.asarray(ends, dtype=int)
+        self.scores = numpy.asarray(scores, dtype=float)
+        lengths = self.ends-self.starts
+        self.cum = numpy.concatenate(([0.], numpy.cumsum(lengths*self.scores)))
+        self.cumlen = numpy.concatenate(([0], numpy.cumsum(lengths)))
+        self._tables = None
+
+    def _prefix(self, cum, x, weights):
+        """Value of the cumulative array *cum* at positions *x* (interpolated in segments)."""
+        k = numpy.searchsorted(self.starts, x, side='right')
+        j = numpy.maximum(k-1, 0)
+        if not len(self.starts):
+            return numpy.zeros(len(x))
+        inside = numpy.clip(x-self.starts[j], 0, self.ends[j]-self.starts[j])*weights[j]
+        return numpy.where(k > 0, cum[j]+inside, 0)
+
+    def sum(self, starts, ends):
+        """Integral of the signal (score x bp) on each interval ``[start, end)``."""
+        return self._prefix(self.cum, ends, self.scores)-self._prefix(self.cum, starts, self.scores)
+
+    def mean(self, starts, ends):
+        return self.sum(starts, ends)/numpy.maximum(ends-starts, 1)
+
+    def coverage(self, starts, ends):
+        """Number of basepairs of each interval covered by a segment."""
+        ones = numpy.ones(len(self.starts))
+        return self._prefix(self.cumlen, ends, ones)-self._prefix(self.cumlen, starts, ones)
+
+    def _segments(self, starts, ends):
+        """Range ``[i, j)`` of the segments overlapping each interval."""
+        return (numpy.searchsorted(self.ends, starts, side='right'),
+                numpy.searchsorted(self.starts, ends, side='left'))
+
+    def _sparse_tables(self):
+        if self._tables is None:
+            self._tables = [(self.scores, self.scores)]
+            width = 1
+            while 2*width <= len(self.scores):
+                lo, hi = self._tables[-1]
+                self._tables.append((numpy.minimum(lo[:-width], lo[width:]),
+                                     numpy.maximum(hi[:-width], hi[width:])))
+                width *= 2
+        return self._tables
+
+    def _range(self, starts, ends, which):
+        i, j = self._segments(starts, ends)
+        empty = j <= i
+        n = numpy.maximum(j-i, 1)
+        level = numpy.floor(numpy.log2(n)).astype(int)
+        result = numpy.zeros(len(i))
+        tables = self._sparse_tables() if len(self.scores) else []
+        for k in numpy.unique(level[~empty]).tolist():
+            sel = (level == k) & ~empty
+            table = tables[k][which]
+            a, b = table[i[sel]], table[j[sel]-(1 << k)]
+            result[sel] = numpy.minimum(a, b) if which == 0 else numpy.maximum(a, b)
+        # Uncovered basepairs count as 0
+        gaps = self.coverage(starts, ends) < ends-starts
+        result[empty] = 0
+        if which == 0:
+            return numpy.where(gaps, numpy.minimum(result, 0), result)
+        return numpy.where(gaps, numpy.maximum(result, 0), result)
+
+    def min(self, starts, ends):
+        return self._range(starts, ends, 0)
+
+    def max(self, starts, ends):
+        return self._range(starts, ends, 1)
+
+    def median(self, starts, ends):
+        """Median of the basepair values, from the sorted values of the overlapping segments."""
+        i, j = self._segments(starts, ends)
+        result = numpy.zeros(len(i))
+        for n in xrange(len(i)):
+            s, e = starts[n], ends[n]
+            if e <= s: continue
+            lengths = numpy.minimum(self.ends[i[n]:j[n]], e)-numpy.maximum(self.starts[i[n]:j[n]], s)
+            values = numpy.append(self.scores[i[n]:j[n]], 0.)
+            lengths = numpy.append(lengths, (e-s)-lengths.sum())
+            order = numpy.argsort(values, kind='mergesort')
+            values, cum = values[order], numpy.cumsum(lengths[order])
+            at = lambda p: values[numpy.searchsorted(cum, p, side='right')]
+            m = e-s
+            result[n] = at((m-1)//2) if m % 2 else (at(m//2-1)+at(m//2))/2.
+        return result
+
+    def query(self, method, starts, ends):
+        """Apply *method* (one of 'sum', 'mean', 'median', 'min', 'max') to each interval."""
+        return getattr(self, method)(numpy.asarray(starts, dtype=int), numpy.asarray(ends, dtype=int))
+
+
+class SignalIndex(object):
+    """
+    Per-chromosome :class:`ChromIndex` of a signal track, each read from its
+    memory-mapped columns when it is requested. Example::
+
+    >>> index = SignalIndex.open('signal.bedGraph', chrmeta='mm9')
+    >>> index['chr1'].query('mean', starts, ends)
+    """
+    def __init__(self, directory, chroms):
+        self.directory = directory
+        self.chroms = set(chroms)
+
+    def _file(self, chrom, column):
+        return os.path.join(self.directory, '%s.%s.npy' % (chrom, column))
+
+    def __getitem__(self, chrom):
+        if chrom not in self.chroms:
+            return ChromIndex([], [], [])
+        return ChromIndex(*[numpy.load(self._file(chrom, column), mmap_mode='r') for column in COLUMNS])
+
+    @staticmethod
+    def index_dir(path, chrmeta=None):
+        """Directory of the index of track *path* read with *chrmeta*."""
+        path = os.path.abspath(path)
+        meta = hashlib.sha1(json.dumps(chrmeta_key(chrmeta))).hexdigest()
+        if os.access(os.path.dirname(path), os.W_OK):
+            return os.path.join(path+INDEX_EXT, meta)
+        return os.path.dirname(cache_path('signal_index', file_digest(path), meta, 'chroms.json'))
+
+    @classmethod
+    def build(cls, path, chrmeta=None):
+        """Read the track and save its index, the list of chromosomes last."""
+        from bbcflib.track import track
+        directory = cls.index_dir(path, chrmeta)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with track(path, chrmeta=chrmeta) as t:
+            chromlist = list(t.chrmeta)
+        index = cls(directory, [])
+        for chrom in chromlist:
+            arrays = read_columns(path, chrom, chrmeta)
+            if not len(arrays[0]): continue
+            c = ChromIndex(*arrays)
+            for column, a in zip(COLUMNS, [c.starts, c.ends, c.scores]):
+                tmp = index._file(chrom, column)+'.%i.npy' % os.getpid()
+                numpy.save(tmp, a)
+                os.rename(tmp, index._file(chrom, column))
+            index.chroms.add(chrom)
+        chroms = os.path.join(directory, 'chroms.json')
+        with open(chroms+'.%i' % os.getpid(), 'w') as f:
+            json.dump(sorted(index.chroms), f)
+        os.rename(chroms+'.%i' % os.getpid(), chroms)
+        return index
+
+    @classmethod
+    def open(cls, path, chrmeta=None):
+        """
+        The index of track *path* read with *chrmeta*, built if missing or
+        older than the track. Open it before starting the workers: they then
+        only load the chromosomes they query.
+        """
+        path = os.path.abspath(path)
+        key = (path, os.path.getmtime(path), chrmeta_key(chrmeta))
+        if key not in _indexes:
+            directory = cls.index_dir(path, chrmeta)
+            chroms = os.path.join(directory, 'chroms.json')
+            if os.path.exists(chroms) and os.path.getmtime(chroms) >= key[1]:
+                with open(chroms) as f:
+                    _indexes[key] = cls(directory, json.load(f))
+            else:
+                _indexes[key] = cls.build(path, chrmeta)
+        return _indexes[key]
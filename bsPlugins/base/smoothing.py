@@ -0,0 +1,83 @@
+"""
+Moving averages of piecewise constant signals computed from prefix sums, so
+that the cost does not depend on the window size.
+"""
+import numpy
+
+from bsPlugins.base.arrays import CHUNK_SIZE, stream_arrays
+from bsPlugins.base.intervals import merge_intervals
+
+
+def _integral(starts, ends, scores):
+    """
+    Return ``F(x)``, the integral of the signal on ``[0, x)``, as a function
+    of an array of positions. Features must be sorted and non-overlapping.
+    """
+    cum = numpy.concatenate(([0.], numpy.cumsum((ends-starts)*scores)))
+    def F(x):
+        k = numpy.searchsorted(starts, x, side='right')
+        j = numpy.maximum(k-1, 0)
+        inside = numpy.clip(x-starts[j], 0, ends[j]-starts[j])*scores[j]
+        return numpy.where(k > 0, cum[j]+inside, 0.)
+    return F
+
+
+def _runs(starts, ends, values):
+    """Merge consecutive segments with the same value and drop the zeros."""
+    if not len(values):
+        return starts, ends, values
+    new = numpy.ones(len(values), dtype=bool)
+    new[1:] = (values[1:] != values[:-1]) | (starts[1:] != ends[:-1])
+    first = numpy.flatnonzero(new)
+    last = numpy.append(first[1:], len(values))-1
+    keep = values[first] != 0
+    return starts[first][keep], ends[last][keep], values[first][keep]
+
+
+def bp_smoothing(stream, window_size, step_size=1, chrom=None, size=CHUNK_SIZE):
+    """
+    Mean of the signal in ``[x-L, x+L]`` (L = *window_size*) for every *x*
+    multiple of *step_size*, written on ``[x, x+step_size)``. Successive equal
+    values are merged and zeros are omitted.
+    :return: generator of ``(chrom, start, end, score)``.
+    """
+    starts, ends, scores = stream_arrays(stream)
+    if not len(starts):
+        return
+    F = _integral(starts, ends, scores.astype(float))
+    L, step = window_size, step_size
+    denom = 2.*L+1
+    pending = None
+    for rs, re in zip(*[x.tolist() for x in merge_intervals(starts-L, ends+L)]):
+        first = ((max(rs, 0)+step-1)//step)*step
+        for x0 in xrange(first, re, size*step):
+            x = numpy.arange(x0, min(x0+size*step, re), step)
+            values = (F(x+L+1)-F(x-L))/denom
+            for s,e,v in zip(*[a.tolist() for a in _runs(x, x+step, values)]):
+                if pending is not None and pending[2] == s and pending[3] == v:
+                    pending = (chrom, pending[1], e, v)
+                    continue
+                if pending is not None: yield pending
+                pending = (chrom, s, e, v)
+    if pending is not None: yield pending
+
+
+def feature_smoothing(stream, window_size, step_size=1):
+    """
+    Every *step_size* feature, with its score replaced by the mean score of
+    the *window_size* features on each side of it and itself (fewer at the
+    ends of the chromosome).
+    :return: generator of rows with the fields of *stream*.
+    """
+    rows = list(stream)
+    if not rows:
+        return
+    ks = stream.fields.index('score')
+    scores = numpy.asarray([x[ks] for x in rows], dtype=float)
+    cum = numpy.concatenate(([0.], numpy.cumsum(scores)))
+    idx = numpy.arange(0, len(rows), step_size)
+    lo = numpy.maximum(idx-window_size, 0)
+    hi = numpy.minimum(idx+window_size+1, len(rows))
+    means = (cum[hi]-cum[lo])/(hi-lo)
+    for n,v in zip(idx.tolist(), means.tolist()):
+        yield tuple(rows[n][:ks])+(v,)+tuple(rows[n][ks+1:])
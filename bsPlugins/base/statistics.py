@@ -0,0 +1,129 @@
+"""
+Statistics of a track accumulated by chunks of features in one pass and
+bounded memory, mergeable across chromosomes.
+"""
+import numpy
+
+from bsPlugins.base.histogram import QuantileSketch
+
+STAT_NAMES = ['min', 'max', 'sum', 'mean', 'sd', 'median', 'q1', 'q3']
+
+
+def _bins(values):
+    """Values rounded to 3 significant digits, the keys of the histograms."""
+    values = numpy.asarray(values, dtype=float)
+    magnitude = numpy.floor(numpy.log10(numpy.maximum(numpy.abs(values), 1e-300)))
+    scale = 10.**(2-magnitude)
+    return numpy.where(values == 0, 0., numpy.round(values*scale)/scale)
+
+
+class Distribution(object):
+    """
+    Count, extremes, mean and variance (merged as in Chan et al.), a histogram
+    of the values rounded to 3 significant digits and a :class:`QuantileSketch`
+    of a stream of values.
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.total = 0.
+        self.min = None
+        self.max = None
+        self.histogram = {}
+        self.sketch = QuantileSketch()
+
+    def _combine(self, n, total, mean, m2, vmin, vmax):
+        if not n: return
+        delta = mean-self.mean
+        count = self.n+n
+        self.m2 += m2+delta*delta*self.n*n/count
+        self.mean += delta*n/count
+        self.n = count
+        self.total += total
+        self.min = vmin if self.min is None else min(self.min, vmin)
+        self.max = vmax if self.max is None else max(self.max, vmax)
+
+    def add(self, values):
+        values = numpy.asarray(values, dtype=float)
+        if not len(values): return
+        mean = values.mean()
+        self._combine(len(values), float(values.sum()), float(mean),
+                      float(((values-mean)**2).sum()), float(values.min()), float(values.max()))
+        keys, counts = numpy.unique(_bins(values), return_counts=True)
+        for k,c in zip(keys.tolist(), counts.tolist()):
+            self.histogram[k] = self.histogram.get(k, 0)+c
+        self.sketch.add(values)
+
+    def merge(self, other):
+        self._combine(other.n, other.total, other.mean, other.m2, other.min, other.max)
+        for k,c in other.histogram.iteritems():
+            self.histogram[k] = self.histogram.get(k, 0)+c
+        self.sketch.merge(other.sketch)
+
+    def stats(self):
+        """The statistics in the order of STAT_NAMES."""
+        if not self.n:
+            return [0]*len(STAT_NAMES)
+        sd = float(numpy.sqrt(self.m2/(self.n-1))) if self.n > 1 else 0.
+        median, q1, q3 = self.sketch.quantile([.5, .25, .75]).tolist()
+        return [self.min, self.max, self.total, self.mean, sd, median, q1, q3]
+
+
+class TrackStats(object):
+    """
+    Number of features, distributions of their lengths and scores, and
+    number of basepairs covered (features of each chromosome sorted by start).
+    Example::
+
+    >>> st = TrackStats()
+    >>> st.add(starts, ends, scores)  # chunk after chunk
+    >>> genome.merge(st)
+    """
+    def __init__(self):
+        self.lengths = Distribution()
+        self.scores = Distribution()
+        self.coverage = 0
+        self._last_end = None
+
+    @property
+    def count(self):
+        return self.lengths.n
+
+    def add(self, starts, ends, scores=None):
+        starts = numpy.asarray(starts, dtype=int)
+        ends = numpy.asarray(ends, dtype=int)
+        if not len(starts): return
+        self.lengths.add(ends-starts)
+        if scores is not None:
+            self.scores.add(scores)
+        # Basepairs not already covered by a previous feature
+        reach = numpy.maximum.accumulate(ends)
+        before = numpy.concatenate(([self._last_end if self._last_end is not None else starts[0]], reach[:-1]))
+        if self._last_end is not None:
+            before = numpy.maximum(before, self._last_end)
+        self.coverage += int(numpy.maximum(ends-numpy.maximum(starts, before), 0).sum())
+        self._last_end = int(reach[-1]) if self._last_end is None else max(self._last_end, int(reach[-1]))
+
+    def merge(self, other):
+        """Add the statistics of another chromosome."""
+        self.lengths.merge(other.lengths)
+        self.scores.merge(other.scores)
+        self.coverage += other.coverage
+
+    def as_dict(self):
+        """The statistics in the format of ``bbcflib.track.stats(..., out={})``."""
+        out = {'feat_stats': (self.count, self.lengths.histogram, self.lengths.stats()),
+               'coverage': self.coverage}
+        if self.scores.n:
+            out['score_stats'] = (self.scores.histogram, self.scores.stats())
+        return out
+
+    def write(self, out):
+        """Write a text report to the file object *out*."""
+        out.write("Number of features: %d\n" % self.count)
+        out.write("Coverage: %d bp\n" % self.coverage)
+        record = "%s:\t"+"\t".join("%s=%%.6g" % x for x in STAT_NAMES)+"\n"
+        out.write(record % (("Feature length",)+tuple(self.lengths.stats())))
+        if self.scores.n:
+            out.write(record % (("Score",)+tuple(self.scores.stats())))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Timings of the plugins' critical paths. Usage::
+
+    python benchmarks.py startup smoothing
+"""
+import os, sys, time, subprocess
+
+import bsPlugins
+
+
+def _timeit(func, *args, **kw):
+    t0 = time.time()
+    func(*args, **kw)
+    return time.time()-t0
+
+
+def startup():
+    """Cold import of every plugin module, in a fresh interpreter each time,
+    with the assemblies list read from the cache then fetched from GenRep."""
+    def _import(env):
+        for name in bsPlugins.PLUGINS_FILES:
+            subprocess.call([sys.executable, '-c', 'import bsPlugins.%s' % name], env=env)
+    cached = dict(os.environ)
+    uncached = dict(os.environ, BSPLUGINS_ASSEMBLIES_TTL='0')
+    _import(cached) # make sure the cache is filled
+    print "with cache:    %.2fs" % _timeit(_import, cached)
+    print "without cache: %.2fs" % _timeit(_import, uncached)
+
+
+def _signal(nfeat=100000, seed=0):
+    """Random bedGraph-like signal of *nfeat* features on one chromosome."""
+    import random
+    random.seed(seed)
+    rows, pos = [], 0
+    for n in xrange(nfeat):
+        pos += random.randint(0, 50)
+        end = pos+random.randint(1, 100)
+        rows.append(('chr1', pos, end, float(random.randint(1, 20))))
+        pos = end
+    return rows
+
+
+def smoothing():
+    """Window smoothing of a 100k features signal, basepair windows with step 1:
+    gfminer's window_smoothing against the prefix sums engine."""
+    from bbcflib.track import FeatureStream
+    from bbcflib.gfminer.stream import window_smoothing
+    from bsPlugins.base.smoothing import bp_smoothing
+    fields = ['chr','start','end','score']
+    rows = _signal()
+    for wsize in [11, 101, 1001]:
+        t0 = _timeit(lambda: list(window_smoothing(FeatureStream(iter(rows), fields=fields),
+                                                   window_size=wsize, step_size=1)))
+        t1 = _timeit(lambda: list(bp_smoothing(FeatureStream(iter(rows), fields=fields),
+                                               wsize, 1, chrom='chr1')))
+        print "window %4i: window_smoothing %.2fs, prefix sums %.2fs (x%.1f)" % (wsize, t0, t1, t0/t1)
+
+
+if __name__ == '__main__':
+    for bench in sys.argv[1:] or ['startup']:
+        print "### %s" % bench
+        globals()[bench]()
@@ -1,5 +1,6 @@
 from unittest2 import TestCase, skip
-from bbcflib.track import track
+from bbcflib.track import track, FeatureStream
+from bsPlugins.base.intervals import sweep_combine
 from bsPlugins.Combine import IntersectPlugin,UnionPlugin,ComplementPlugin,SubtractPlugin
 import os
 
@@ -24,6 +25,15 @@ class Test_CombinePlugin(TestCase):
             expected = [('chr1',10,15,17.0),('chr1',24,35,107.0)]
             self.assertListEqual(content,expected)
 
+    def test_intersect_min_tracks(self):
+        self.intersect(**dict(self.kw, min_tracks=1))
+        self.union(**self.kw)
+        with track(self.intersect.output_files[0][0]) as t:
+            content = list(t.read(fields=self.fields))
+        with track(self.union.output_files[0][0]) as t:
+            expected = list(t.read(fields=self.fields))
+        self.assertListEqual(content,expected)
+
     def test_union(self):
         self.union(**self.kw)
         with track(self.union.output_files[0][0]) as t:
@@ -49,6 +59,17 @@ class Test_CombinePlugin(TestCase):
             expected = [('chr1',21,24,17.0)]
             self.assertListEqual(content,expected)
 
+    def test_sweep_combine(self):
+        fields = ['chr','start','end','score','name','strand']
+        a = [('chr1',0,100,1.0,'a1','+'),('chr1',10,20,2.0,'a2','+'),('chr1',50,60,3.0,'a3','-')]
+        b = [('chr1',5,55,4.0,'b1','+')]
+        expected = [('chr1',5,10,5.0,'a1|b1','+'),('chr1',10,20,7.0,'a1|a2|b1','+'),
+                    ('chr1',20,50,5.0,'a1|b1','+'),('chr1',50,55,8.0,'a1|a3|b1','.')]
+        for size in [1, 2, 100]:
+            streams = [FeatureStream(iter(a), fields=fields), FeatureStream(iter(b), fields=fields)]
+            s = sweep_combine(streams, lambda X: X.all(axis=0), chrom='chr1', size=size)
+            self.assertListEqual(list(s), expected)
+
     def tearDown(self):
         for f in os.listdir('.'):
             if f.startswith('tmp'):
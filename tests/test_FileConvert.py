@@ -0,0 +1,92 @@
+from unittest2 import TestCase, skip
+from bsPlugins import FileConvert
+from bsPlugins.FileConvert import FileConvertPlugin, _chrom_ranges, _data_line
+from bbcflib.track import track
+import os
+
+path = 'testing_files/'
+
+def _write(fname, lines):
+    with open(fname, 'wb') as f:
+        f.write("".join(lines))
+    return fname
+
+def _lines(chroms, n, comments=False):
+    lines = ['track type=bedGraph\n']
+    for c in chroms:
+        for k in range(n):
+            if comments and k % 7 == 3:
+                lines.append('# comment\n')
+            lines.append("%s\t%i\t%i\t%i\n" % (c, 10*k, 10*k+5, k))
+    return lines
+
+def _expected_ranges(lines):
+    """Byte range of each chromosome, from one scan of the lines."""
+    ranges, pos = [], 0
+    header = None
+    for line in lines:
+        if not line.startswith(FileConvert._comments):
+            c = line.split(None, 1)[0]
+            if header is None: header = pos
+            if not ranges or ranges[-1][0] != c:
+                if ranges: ranges[-1][2] = pos
+                ranges.append([c, pos, None])
+        pos += len(line)
+    ranges[-1][2] = pos
+    return [tuple(r) for r in ranges]
+
+
+class Test_FileConvertPlugin(TestCase):
+    def setUp(self):
+        self.plugin = FileConvertPlugin()
+        self.block = FileConvert._block
+
+    def test_data_line(self):
+        lines = ['track type=bedGraph\n', '# comment\n', 'chr1\t0\t5\t1\n', 'chr2\t0\t5\t1\n']
+        fname = _write('tmp_lines.bedGraph', lines)
+        with open(fname, 'rb') as f:
+            self.assertEqual(_data_line(f, 0), (30, 'chr1'))
+            self.assertEqual(_data_line(f, 31), (41, 'chr2'))
+            self.assertEqual(_data_line(f, 41), (41, 'chr2'))
+            self.assertEqual(_data_line(f, 42), (52, None))
+
+    def test_chrom_ranges(self):
+        chroms = ['chr1', 'chr2', 'chr10', 'chrX']
+        for block in [64, self.block]:  # ranges longer, then shorter than the block
+            FileConvert._block = block
+            for comments in [False, True]:
+                lines = _lines(chroms, 50, comments)
+                header, ranges = _chrom_ranges(_write('tmp_sorted.bedGraph', lines))
+                self.assertEqual(header, lines[0])
+                self.assertListEqual(ranges, _expected_ranges(lines))
+
+    def test_chrom_ranges_unsorted(self):
+        lines = _lines(['chr1', 'chr2', 'chr1'], 50)
+        for block in [64, self.block]:
+            FileConvert._block = block
+            header, ranges = _chrom_ranges(_write('tmp_unsorted.bedGraph', lines))
+            self.assertIsNone(ranges)
+
+    def test_convert_chunks(self):
+        infile = path+'test3.bedGraph'
+        expected = {}
+        with open(infile) as f:
+            for line in f:
+                c, start, end, score = line.split()
+                expected.setdefault(c, []).append((c, int(start), int(end), float(score)))
+        # One process converts line by line, several by chromosome
+        for processes in [1, 2]:
+            self.plugin(**{'infile': infile, 'to': 'sql', 'processes': processes})
+            with track(self.plugin.output_files[-1][0]) as t:
+                self.assertItemsEqual(t.chrmeta.keys(), expected.keys())
+                for c in expected:
+                    self.assertListEqual(list(t.read(c, fields=['chr','start','end','score'])), expected[c])
+        # The part files are deleted once read
+        parts = [f for _,_,files in os.walk('.') for f in files if f.startswith('part_')]
+        self.assertListEqual(parts, [])
+
+    def tearDown(self):
+        FileConvert._block = self.block
+        for f in os.listdir('.'):
+            if f.startswith('tmp'):
+                os.system("rm -rf %s" % f)
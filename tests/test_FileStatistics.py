@@ -1,5 +1,6 @@
 from unittest2 import TestCase, skip
-from bsPlugins.Statistics import FileStatisticsPlugin
+from bsPlugins.FileStatistics import FileStatisticsPlugin, _stats_chrom
+from bbcflib.track import track, stats
 import os
 
 path = 'testing_files/'
@@ -17,6 +18,36 @@ class Test_StatisticsPlugin(TestCase):
             for x in content: print x.strip()
             raise
 
+    def test_stats_by_chrom(self):
+        sample = path+'KO50.bedGraph'
+        self.plugin(**{'sample':sample, 'by_chrom':True, 'output':'txt', 'processes':2})
+        with open(self.plugin.output_files[0][0],'rb') as f:
+            content = f.read()
+        t = track(sample, chrmeta="guess")
+        for chrom in t.chrmeta:
+            self.assertIn("Chromosome %s\n--------------------\n" % chrom, content)
+            # Same numbers as bbcflib's stats
+            expected = {}
+            stats(t, out=expected, selection=chrom)
+            result = _stats_chrom(chrom, sample).as_dict()
+            self.assertEqual(result['feat_stats'][0], expected['feat_stats'][0])
+            for key, n in [('feat_stats', 2), ('score_stats', 1)]:
+                for x, y in zip(result[key][n][:4], expected[key][n][:4]):
+                    self.assertAlmostEqual(x, y, places=4)
+
+    def test_stats_values(self):
+        self.plugin(**{'sample':path+'test1.bedGraph', 'output':'txt'})
+        with open(self.plugin.output_files[0][0],'rb') as f:
+            lines = f.read().splitlines()
+        self.assertListEqual(lines[:2], ["Number of features: 2", "Coverage: 19 bp"])
+        # features chr1:10-15 (score 5) and chr1:21-35 (score 17)
+        expected = {'Feature length': ['min=5', 'max=14', 'sum=19', 'mean=9.5', 'sd=6.36396'],
+                    'Score': ['min=5', 'max=17', 'sum=22', 'mean=11', 'sd=8.48528']}
+        for line in lines[2:]:
+            name, values = line.split(':\t')
+            self.assertListEqual(values.split('\t')[:5], expected.pop(name))
+        self.assertDictEqual(expected, {})
+
     def tearDown(self):
         for f in os.listdir('.'):
             if f.startswith('tmp'):
@@ -0,0 +1,61 @@
+from unittest2 import TestCase, skip
+from bsPlugins.FragLength import FragLengthPlugin
+import os, shutil, random
+import pysam
+
+def _paired_bam(bampath, nfrags=1000, length=20000, seed=1):
+    """Sorted bam of *nfrags* properly paired fragments of random sizes on 3 chromosomes."""
+    random.seed(seed)
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+              'SQ': [{'SN': c, 'LN': length} for c in ['chr1', 'chr2', 'chr3']]}
+    reads = []
+    for n in range(nfrags):
+        tid, pos, size = random.randint(0,2), random.randint(0, length-600), random.randint(100, 500)
+        for first in (True, False):
+            a = pysam.AlignedRead()
+            a.qname = "frag%i" % n
+            a.tid = a.rnext = tid
+            a.pos = pos if first else pos+size-50
+            a.pnext = pos+size-50 if first else pos
+            a.flag = 0x1 | 0x2 | (0x20 | 0x40 if first else 0x10 | 0x80)
+            a.isize = size if first else -size
+            a.seq = "A"*50
+            a.qual = "I"*50
+            a.cigar = [(0, 50)]
+            a.mapq = 50
+            reads.append(a)
+    reads.sort(key=lambda a: (a.tid, a.pos))
+    out = pysam.Samfile(bampath, 'wb', header=header)
+    for a in reads: out.write(a)
+    out.close()
+    return bampath
+
+def _reads(bampath):
+    bam = pysam.Samfile(bampath, 'rb')
+    reads = [(bam.getrname(r.tid), r.pos, r.qname, r.isize) for r in bam]
+    bam.close()
+    return reads
+
+
+class Test_FragLengthPlugin(TestCase):
+    def setUp(self):
+        self.plugin = FragLengthPlugin()
+        self.indexed = _paired_bam('tmp_indexed.bam')
+        pysam.index(self.indexed)
+        self.unindexed = 'tmp_unindexed.bam'
+        shutil.copy(self.indexed, self.unindexed)
+
+    def test_filter(self):
+        kw = {'minlength': 200, 'maxlength': 350}
+        expected = [r for r in _reads(self.indexed) if 200 <= abs(r[3]) <= 350]
+        self.assertGreater(len(expected), 0)
+        self.plugin(bamfiles=self.unindexed, **kw)
+        for processes in [1, 3]:
+            self.plugin(bamfiles=self.indexed, processes=processes, **kw)
+        for output in self.plugin.output_files:
+            self.assertListEqual(_reads(output[0]), expected)
+
+    def tearDown(self):
+        for f in os.listdir('.'):
+            if f.startswith('tmp'):
+                os.system("rm -rf %s" % f)
@@ -15,6 +15,22 @@ class Test_IntersectionsPlugin(TestCase):
                                   },
                        'column':1})
 
+    def test_compare(self):
+        files = []
+        for n, elements in enumerate(["a b c d", "b c e", "c d e f"]):
+            files.append('tmp_list%i.txt' % n)
+            with open(files[-1], 'w') as f:
+                f.write("".join("%s\t%i\n" % (x, n) for x in elements.split()))
+        output = self.plugin.temporary_path(fname='intersections.')
+        counts, legend = self.plugin.compare(files, output)
+        self.assertDictEqual(counts, {'0': 4, '1': 3, '2': 4, '0|1': 2, '0|2': 2, '1|2': 2, '0|1|2': 1})
+        self.assertDictEqual(legend, dict(enumerate(files)))
+        expected = {'2-by-2/0|1.txt': ['b','c'], '2-by-2/0|2.txt': ['c','d'],
+                    '2-by-2/1|2.txt': ['c','e'], '3-by-3/0|1|2.txt': ['c']}
+        for name, elements in expected.iteritems():
+            with open(os.path.join(output, name)) as f:
+                self.assertListEqual(sorted(f.read().split()), elements)
+
     def tearDown(self):
         for f in os.listdir('.'):
             if f.startswith('tmp'):
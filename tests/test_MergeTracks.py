@@ -1,5 +1,6 @@
 from unittest2 import TestCase, skip
-from bsPlugins.MergeTracks import MergeTracksPlugin
+from bsPlugins.MergeTracks import MergeTracksPlugin, method_opts
+from bbcflib.track import track
 import os
 
 path = 'testing_files/'
@@ -15,6 +16,25 @@ class Test_MergeTracksPlugin(TestCase):
             content = f.readlines()
             self.assertEqual(len(content),95)
 
+    def test_merge_values(self):
+        with open('tmp_forward.bedGraph', 'w') as f:
+            f.write("track type=bedGraph\nchr1\t10\t20\t4\n")
+        with open('tmp_reverse.bedGraph', 'w') as f:
+            f.write("track type=bedGraph\nchr1\t15\t25\t2\n")
+        kw = {'forward':'tmp_forward.bedGraph', 'reverse':'tmp_reverse.bedGraph',
+              'shift':5, 'format':'bedGraph'}
+        # both shifted to [15,25) and [10,20), missing scores count as 0
+        expected = {'mean': [1,3,2], 'median': [1,3,2], 'sum': [2,6,4],
+                    'min': [0,2,0], 'max': [2,4,4], 'geometric': [0,8**.5,0]}
+        for method in method_opts:
+            self.plugin.output_files = []
+            self.plugin(method=method, **kw)
+            with track(self.plugin.output_files[0][0]) as t:
+                content = list(t.read(fields=['start','end','score']))
+            self.assertListEqual([x[:2] for x in content], [(10,15),(15,20),(20,25)])
+            for x,y in zip(content, expected[method]):
+                self.assertAlmostEqual(x[2], y, places=5)
+
     def tearDown(self):
         for f in os.listdir('.'):
             if f.startswith('tmp'):
@@ -1,7 +1,8 @@
 from unittest2 import TestCase, skip
 from bsPlugins.NumericOperation import NumericOperationPlugin
 from bbcflib.track import track
-import os
+from math import log, log10
+import os, tarfile
 
 path = './testing_files/'
 
@@ -17,6 +18,39 @@ class Test_NumericOperationPlugin(TestCase):
                        'assembly':'mm9', "format":"",'function':'log2'})
         #self.plugin(**{'track':[path+'wb3-mm10UniqChr.bigwig'],'assembly':'mm10', "format":"bedGraph",'function':'log2'})
 
+    def test_functions(self):
+        with open('tmp_scores.bedGraph', 'w') as f:
+            f.write("track type=bedGraph\nchr1\t0\t5\t4\nchr1\t5\t10\t0\nchr1\t10\t15\t-1\nchr1\t15\t20\t100\n")
+        # features where the function is not defined are dropped
+        expected = {'log2': [(0,5,2), (15,20,log(100,2))],
+                    'log10': [(0,5,log10(4)), (15,20,2)],
+                    'sqrt': [(0,5,2), (5,10,0), (15,20,10)]}
+        for func, values in sorted(expected.items()):
+            self.plugin.output_files = []
+            self.plugin(**{'track':'tmp_scores.bedGraph', 'function':func, 'output':'bedGraph'})
+            with track(self.plugin.output_files[0][0], chrmeta='guess') as t:
+                content = list(t.read(fields=['start','end','score']))
+            self.assertListEqual([x[:2] for x in content], [x[:2] for x in values])
+            for x, y in zip(content, values):
+                self.assertAlmostEqual(x[2], y[2], places=4)
+
+    def test_expression(self):
+        self.plugin(**{'track':[path+'test1.bedGraph', path+'test2.bedGraph'],
+                       'expression':'log2(x+1)', 'output':'bedGraph', 'processes':2})
+        tar = tarfile.open(self.plugin.output_files[0][0])
+        tar.extractall('tmp_expression')
+        tar.close()
+        expected = {'test1': [(10,15,log(6,2)), (21,35,log(18,2))],
+                    'test2': [(8,19,log(13,2)), (24,39,log(91,2))]}
+        for name, values in expected.iteritems():
+            with track(os.path.join('tmp_expression', name+'_expression.bedGraph'), chrmeta='guess') as t:
+                content = list(t.read(fields=['start','end','score']))
+            self.assertListEqual([x[:2] for x in content], [x[:2] for x in values])
+            for x, y in zip(content, values):
+                self.assertAlmostEqual(x[2], y[2], places=4)
+        with self.assertRaises(ValueError):
+            self.plugin(**{'track':[path+'test1.bedGraph'], 'expression':'__import__("os")'})
+
     def tearDown(self):
         for f in os.listdir('.'):
             if f.startswith('tmp'):
@@ -17,6 +17,16 @@ class Test_OverlapPlugin(TestCase):
             content = list(s)
             self.assertEqual(len(content),3)
 
+    def test_overlap_values(self):
+        with open('tmp_features.bed', 'w') as f:
+            f.write("chr1\t0\t10\ta\nchr1\t5\t30\tb\nchr1\t40\t50\tc\nchr1\t60\t70\td\nchr2\t0\t10\te\n")
+        with open('tmp_filter.bed', 'w') as f:
+            f.write("chr1\t8\t12\tf1\nchr1\t45\t46\tf2\nchr1\t70\t80\tf3\nchr2\t20\t30\tf4\n")
+        self.plugin(**{'filter':'tmp_filter.bed', 'features':'tmp_features.bed'})
+        with track(self.plugin.output_files[0][0]) as t:
+            content = list(t.read(fields=['chr','start','end','name']))
+        self.assertListEqual(content, [('chr1',0,10,'a'), ('chr1',5,30,'b'), ('chr1',40,50,'c')])
+
     def tearDown(self):
         for f in os.listdir('.'):
             if f.startswith('tmp'):
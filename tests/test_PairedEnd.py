@@ -0,0 +1,103 @@
+from unittest2 import TestCase, skip
+from bsPlugins.PairedEnd import PairedEndPlugin
+from bbcflib.track import track
+import os, random
+import pysam
+
+def _paired_bam(bampath, nfrags=2000, length=20000, seed=1):
+    """Sorted and indexed bam of *nfrags* properly paired fragments, with duplicates."""
+    random.seed(seed)
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+              'SQ': [{'SN': 'chr1', 'LN': length}, {'SN': 'chr2', 'LN': length}]}
+    frags = []
+    for n in range(nfrags):
+        if frags and random.random() < .2:
+            frags.append(frags[-1])
+        else:
+            frags.append((random.randint(0,1), random.randint(0, length-600), random.randint(100, 500)))
+    reads = []
+    for n,(tid,pos,size) in enumerate(frags):
+        for first in (True, False):
+            a = pysam.AlignedRead()
+            a.qname = "frag%i" % n
+            a.tid = a.rnext = tid
+            a.pos = pos if first else pos+size-50
+            a.pnext = pos+size-50 if first else pos
+            a.flag = 0x1 | 0x2 | (0x20 | 0x40 if first else 0x10 | 0x80)
+            a.isize = size if first else -size
+            a.seq = "A"*50
+            a.qual = "I"*50
+            a.cigar = [(0, 50)]
+            a.mapq = 50
+            reads.append(a)
+    reads.sort(key=lambda a: (a.tid, a.pos))
+    out = pysam.Samfile(bampath, 'wb', header=header)
+    for a in reads: out.write(a)
+    out.close()
+    pysam.index(bampath)
+    return frags
+
+
+def _legacy_stats(bam):
+    """The per-position loop of the former ``_compute_stats``, counting every read."""
+    frag_size, frag_rep, nb_frag = {}, {}, 0
+    for chrom, cval in bam.chrmeta.iteritems():
+        _plast, _buff = -1, {}
+        for read in bam.fetch(chrom, 0, cval['length']):
+            if read.is_reverse or not read.is_proper_pair or read.isize < 0: continue
+            nb_frag += 1
+            if read.pos != _plast:
+                for _size,_rep in _buff.iteritems():
+                    frag_size[_size] = frag_size.get(_size,0)+_rep
+                    frag_rep[_rep] = 1+frag_rep.get(_rep,0)
+                _plast, _buff = read.pos, {}
+            _buff[read.isize] = _buff.get(read.isize,0)+1
+        for _size,_rep in _buff.iteritems():
+            frag_size[_size] = frag_size.get(_size,0)+_rep
+            frag_rep[_rep] = 1+frag_rep.get(_rep,0)
+    return nb_frag, frag_size, frag_rep
+
+
+def _coverage(stream):
+    """Score at each covered position."""
+    scores = {}
+    idx = [stream.fields.index(f) for f in ['start','end','score']]
+    for x in stream:
+        start, end, score = [x[i] for i in idx]
+        for p in xrange(start, end): scores[p] = score
+    return scores
+
+
+class Test_PairedEndPlugin(TestCase):
+    def setUp(self):
+        self.plugin = PairedEndPlugin()
+        self.bampath = 'tmp_paired.bam'
+        _paired_bam(self.bampath)
+
+    def test_stats(self):
+        self.plugin(**{'bamfiles': self.bampath, 'plot_only': True})
+        nb_frag, frag_size, frag_rep = _legacy_stats(track(self.bampath))
+        self.assertEqual(self.plugin.nb_frag, nb_frag)
+        self.assertDictEqual(self.plugin.frag_size, frag_size)
+        self.assertDictEqual(self.plugin.frag_rep, frag_rep)
+
+    def test_fragment_track(self):
+        bam = track(self.bampath)
+        for midpoint in [False, True]:
+            for processes in [1, 2]:
+                self.plugin = PairedEndPlugin()
+                self.plugin(**{'bamfiles': self.bampath, 'output': 'bedGraph',
+                               'midpoint': midpoint, 'processes': processes})
+                self.assertDictEqual(self.plugin.frag_size, _legacy_stats(bam)[1])
+                with track(self.plugin.output_files[0][0], chrmeta=bam.chrmeta) as t:
+                    for chrom in bam.chrmeta:
+                        content = _coverage(t.read(selection=chrom, fields=['start','end','score']))
+                        expected = _coverage(bam.PE_fragment_size(chrom, midpoint=midpoint))
+                        self.assertItemsEqual(content.keys(), expected.keys())
+                        for p, score in expected.iteritems():
+                            self.assertAlmostEqual(content[p], score, places=2)
+
+    def tearDown(self):
+        for f in os.listdir('.'):
+            if f.startswith('tmp'):
+                os.system("rm -rf %s" % f)
@@ -1,7 +1,10 @@
 from unittest2 import TestCase, skip
 from bbcflib.track import track
 from bsPlugins.QuantifyTable import QuantifyTablePlugin
-import os
+from bsPlugins.base import cache
+from bsPlugins.base.cache import ResultCache
+from bsPlugins.base.signal_index import SignalIndex, INDEX_EXT
+import os, shutil
 
 path = 'testing_files/'
 
@@ -26,7 +29,74 @@ class Test_QuantifyTablePlugin(TestCase):
             content = list(s)
             self.assertEqual(len(content),9)
 
+    def test_quantify_table_values(self):
+        with open('tmp_sig1.bedGraph', 'w') as f:
+            f.write("track type=bedGraph\nchr1\t0\t10\t2\nchr1\t20\t30\t4\n")
+        with open('tmp_sig2.bedGraph', 'w') as f:
+            f.write("track type=bedGraph\nchr1\t5\t25\t1\n")
+        with open('tmp_features.bed', 'w') as f:
+            f.write("chr1\t0\t20\tf1\nchr1\t15\t30\tf2\nchr1\t40\t50\tf3\n")
+        kw = {'signals':['tmp_sig1.bedGraph', 'tmp_sig2.bedGraph'],
+              'features':'tmp_features.bed', 'feature_type':3, 'format':'sql'}
+        fields = ["chr","start","end","name","score0","score1"]
+        # (score0, score1) of f1, f2, f3; uncovered basepairs count as 0
+        expected = {'sum': [(20,15), (40,10), (0,0)],
+                    'mean': [(1,.75), (40/15.,10/15.), (0,0)],
+                    'min': [(0,0), (0,0), (0,0)],
+                    'max': [(2,1), (4,1), (0,0)],
+                    'median': [(1,1), (4,1), (0,0)]}
+        for score_op, scores in sorted(expected.items()):
+            self.plugin.output_files = []
+            self.plugin(score_op=score_op, **kw)
+            with track(self.plugin.output_files[0][0]) as t:
+                content = list(t.read(fields=fields))
+            self.assertListEqual([x[:4] for x in content],
+                                 [('chr1',0,20,'f1'), ('chr1',15,30,'f2'), ('chr1',40,50,'f3')])
+            for x,y in zip(content, scores):
+                self.assertAlmostEqual(x[4], y[0], places=5)
+                self.assertAlmostEqual(x[5], y[1], places=5)
+
+    def test_signal_index_chrmeta(self):
+        with open('tmp_sig.bedGraph', 'w') as f:
+            f.write("track type=bedGraph\nchr1\t0\t10\t2\nchrUn_1\t0\t10\t3\n")
+        index = SignalIndex.open('tmp_sig.bedGraph', {'chr1': {'length': 1000}})
+        self.assertListEqual(index['chrUn_1'].query('sum', [0], [10]).tolist(), [0])
+        # Another chrmeta has its own index
+        index = SignalIndex.open('tmp_sig.bedGraph', 'guess')
+        self.assertListEqual(index['chr1'].query('sum', [0], [10]).tolist(), [20])
+        self.assertListEqual(index['chrUn_1'].query('sum', [0], [10]).tolist(), [30])
+        self.assertEqual(len(os.listdir('tmp_sig.bedGraph'+INDEX_EXT)), 2)
+
+    def test_quantify_table_cache(self):
+        kw = {'signals':[path+'KO50.bedGraph', path+'WT50.bedGraph'],
+              'features':path+'features.bed', 'feature_type':3, 'assembly':'mm9', 'format':'txt'}
+        cache_dir, get = cache.CACHE_DIR, ResultCache.get
+        hits = []
+        def _get(results, key, dest):
+            hits.append(get(results, key, dest))
+            return hits[-1]
+        cache.CACHE_DIR = os.path.abspath('tmp_cache')
+        ResultCache.get = _get
+        try:
+            self.plugin.cache_results = True
+            self.plugin(**kw)
+            self.plugin(**kw)
+        finally:
+            cache.CACHE_DIR, ResultCache.get = cache_dir, get
+        self.assertListEqual(hits, [False, True])
+        self.assertEqual(len(os.listdir(os.path.join('tmp_cache', 'quantify'))), 1)
+        self.plugin.cache_results = False
+        self.plugin(**kw)
+        with open(self.plugin.output_files[2][0]) as f:
+            expected = f.read()
+        for n in range(2):
+            with open(self.plugin.output_files[n][0]) as f:
+                self.assertEqual(f.read(), expected)
+
     def tearDown(self):
+        for f in os.listdir(path):
+            if f.endswith(INDEX_EXT):
+                shutil.rmtree(os.path.join(path, f))
         for f in os.listdir('.'):
             if f.startswith('tmp'):
                 os.system("rm -rf %s" % f)
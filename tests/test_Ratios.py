@@ -1,6 +1,8 @@
 from unittest2 import TestCase, skip
 from bbcflib.track import track
 from bsPlugins.Ratios import RatiosPlugin
+from bsPlugins.base.arrays import CHUNK_SIZE
+from math import log
 import os
 
 path = 'testing_files/'
@@ -17,6 +19,29 @@ class Test_RatiosPlugin(TestCase):
         #print content
         #raise
 
+    def test_ratios_values(self):
+        with open('tmp_num.bedGraph', 'w') as f:
+            f.write("track type=bedGraph\nchr1\t0\t10\t4\nchr1\t10\t20\t1\n")
+        with open('tmp_den.bedGraph', 'w') as f:
+            f.write("track type=bedGraph\nchr1\t5\t15\t2\n")
+        kw = {'numerator':'tmp_num.bedGraph', 'denominator':'tmp_den.bedGraph', 'format':'bedGraph'}
+        l2 = lambda x: log(x,2)
+        expected = {(False, 0): [9.0, 1.8, 0.6, 3.0],
+                    (True, 0): [l2(4.5/.5), l2(4.5/2.5), l2(1.5/2.5), l2(1.5/.5)],
+                    (False, 2): [9.0, 1.8, 1, 1],
+                    (True, 2): [l2(4.5/.5), l2(4.5/2.5), 0, 0]}
+        for batch_size in [1, 3, CHUNK_SIZE]:
+            self.plugin.batch_size = batch_size
+            for (logratios, threshold), ratios in sorted(expected.items()):
+                self.plugin.output_files = []
+                self.plugin(**dict(kw, log=logratios, threshold=threshold))
+                with track(self.plugin.output_files[0][0]) as t:
+                    content = list(t.read(fields=['chr','start','end','score']))
+                self.assertListEqual([x[:3] for x in content],
+                                     [('chr1',0,5), ('chr1',5,10), ('chr1',10,15), ('chr1',15,20)])
+                for x, r in zip(content, ratios):
+                    self.assertAlmostEqual(x[3], r, places=4)
+
     def tearDown(self):
         for f in os.listdir('.'):
             if f.startswith('tmp'):
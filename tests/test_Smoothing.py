@@ -1,5 +1,6 @@
 from unittest2 import TestCase, skip
 from bsPlugins.Smoothing import SmoothingPlugin
+from bsPlugins.base import cache, columns
 from bbcflib.track import track
 import os
 
@@ -15,6 +16,59 @@ class Test_SmoothingPlugin(TestCase):
             content = list(t.read())
             self.assertEqual(len(content),501)
 
+    def test_smoothing_processes(self):
+        kw = {'track':path+'KO50.bedGraph', 'assembly':'mm9', 'format':'bedGraph'}
+        self.plugin(**kw)
+        self.plugin(processes=2, **kw)
+        with track(self.plugin.output_files[0][0]) as t:
+            expected = list(t.read())
+        with track(self.plugin.output_files[1][0]) as t:
+            self.assertListEqual(list(t.read()), expected)
+
+    def test_smoothing_values(self):
+        with open('tmp_signal.bedGraph', 'w') as f:
+            f.write("track type=bedGraph\nchr1\t0\t5\t1\nchr1\t5\t8\t2\nchr1\t20\t30\t6\n")
+        kw = {'track':'tmp_signal.bedGraph', 'format':'bedGraph', 'window_size':1}
+        # mean of the 3 bp [x-1, x+1], written on [x, x+step)
+        expected = {1: [(0,1,2/3.),(1,4,1),(4,5,4/3.),(5,6,5/3.),(6,7,2),(7,8,4/3.),(8,9,2/3.),
+                        (19,20,2),(20,21,4),(21,29,6),(29,30,4),(30,31,2)],
+                    2: [(0,2,2/3.),(2,4,1),(4,6,4/3.),(6,8,2),(8,10,2/3.),(20,22,4),(22,30,6),(30,32,2)]}
+        for step, values in sorted(expected.items()):
+            self.plugin.output_files = []
+            self.plugin(**dict(kw, window_step=step))
+            with track(self.plugin.output_files[0][0]) as t:
+                content = list(t.read(fields=['start','end','score']))
+            self.assertListEqual([x[:2] for x in content], [x[:2] for x in values])
+            for x,y in zip(content, values):
+                self.assertAlmostEqual(x[2], y[2], places=5)
+        # mean of the feature and its neighbour on each side
+        self.plugin.output_files = []
+        self.plugin(**dict(kw, by_feature=True))
+        with track(self.plugin.output_files[0][0]) as t:
+            content = list(t.read(fields=['start','end','score']))
+        self.assertListEqual(content, [(0,5,1.5),(5,8,3.0),(20,30,4.0)])
+
+    def test_smoothing_track_cache(self):
+        kw = {'track':path+'KO50.bedGraph', 'assembly':'mm9', 'format':'bedGraph', 'window_size':5}
+        self.plugin(**kw)
+        cache_dir = cache.CACHE_DIR
+        cache.CACHE_DIR = os.path.abspath('tmp_cache')
+        columns.TRACK_CACHE = True
+        try:
+            self.plugin(**kw)  # builds the columns
+            self.plugin(**kw)  # reads the memory maps
+        finally:
+            cache.CACHE_DIR = cache_dir
+            columns.TRACK_CACHE = False
+        npy = [f for _,_,files in os.walk(os.path.join('tmp_cache', 'columns'))
+               for f in files if f.endswith('.npy')]
+        self.assertItemsEqual(npy, ['chr1.start.npy', 'chr1.end.npy', 'chr1.score.npy'])
+        with track(self.plugin.output_files[0][0]) as t:
+            expected = list(t.read())
+        for output in self.plugin.output_files[1:]:
+            with track(output[0]) as t:
+                self.assertListEqual(list(t.read()), expected)
+
     def tearDown(self):
         for f in os.listdir('.'):
             if f.startswith('tmp'):
@@ -25,6 +25,34 @@ class Test_VennDiagramPlugin(TestCase):
                                             path+'test3.bedGraph',path+'test4.bedGraph']},
                        'assembly':'mm9', 'format':'png', 'type':'tag count', 'names':''})
 
+    def test_table(self):
+        table = self.plugin.temporary_path(fname='table.txt')
+        with open(table,'w') as f:
+            f.write("id\ta\tb\tc\n")
+            f.write("g0\t3\t0.1\t1\ng1\t-2\t0.9\t0\ng2\t0\t0.2\t5\ng3\t1\t0.7\t-1\n")
+        self.plugin(**{'input_type':'Table', 'table':table, 'id_columns':'2,3,4',
+                       'filters':'>=2 OR <=-2,<0.5,>0', 'output':'png'})
+        # g0 passes all rules, g1 only A, g2 B and C, g3 none
+        with open(self.plugin.output_files[-1][0]) as f:
+            self.assertListEqual(f.read().splitlines(),
+                                 ["Group\tCoverage\tCumulative coverage",
+                                  "A\t1.00\t2", "B\t0.00\t2", "C\t0.00\t2",
+                                  "A|B\t0.00\t1", "A|C\t0.00\t1", "B|C\t1.00\t2",
+                                  "A|B|C\t1.00\t1"])
+
+    def test_tracks(self):
+        kw = {'input_type':'Tracks', 'files':[path+'../test1.bedGraph',path+'../test2.bedGraph'],
+              'output':'png', 'processes':2}
+        # Coverage in % of the 29 covered bp (see below), then score x bp summed
+        # over the covering tracks: A|B is 5*(5+12)+11*(17+90) = 1262
+        expected = {'intervals': ["A\t10.34\t66", "B\t34.48\t90", "A|B\t55.17\t55"],
+                    'score': ["A\t51.00\t1313", "B\t432.00\t1694", "A|B\t1262.00\t1262"]}
+        for type, lines in sorted(expected.items()):
+            self.plugin.output_files = []
+            self.plugin(type=type, **kw)
+            with open(self.plugin.output_files[-1][0]) as f:
+                self.assertListEqual(f.read().splitlines()[1:], lines)
+
     #@skip('Set par() options so that it looks like it should in pdf format')
     def test_allkinds(self):
         format = 'pdf'
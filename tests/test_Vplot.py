@@ -0,0 +1,94 @@
+from unittest2 import TestCase, skip
+from bsPlugins.Vplot import VplotPlugin
+from bsPlugins.base.histogram import Histogram2D
+from bbcflib.track import track
+import os, random
+import numpy, pysam
+
+def _paired_bam(bampath, nfrags=3000, length=20000, seed=1):
+    """Sorted and indexed bam of *nfrags* properly paired fragments of random sizes."""
+    random.seed(seed)
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'}, 'SQ': [{'SN': 'chr1', 'LN': length}]}
+    reads = []
+    for n in range(nfrags):
+        pos, size = random.randint(0, length-600), random.randint(60, 500)
+        for first in (True, False):
+            a = pysam.AlignedRead()
+            a.qname = "frag%i" % n
+            a.tid = a.rnext = 0
+            a.pos = pos if first else pos+size-50
+            a.pnext = pos+size-50 if first else pos
+            a.flag = 0x1 | 0x2 | (0x20 | 0x40 if first else 0x10 | 0x80)
+            a.isize = size if first else -size
+            a.seq = "A"*50
+            a.qual = "I"*50
+            a.cigar = [(0, 50)]
+            a.mapq = 50
+            reads.append(a)
+    reads.sort(key=lambda a: a.pos)
+    out = pysam.Samfile(bampath, 'wb', header=header)
+    for a in reads: out.write(a)
+    out.close()
+    pysam.index(bampath)
+    return bampath
+
+def _per_fragment(bam, features, extra_window=1000):
+    """Fragment midpoints and sizes, with the former loop over the regions."""
+    X = []; Y = []
+    with track(features) as t:
+        for chrom, start, end, name, score, strand in t.read(fields=['chr','start','end','name','score','strand']):
+            for read in bam.fetch(chrom, max(0,start-extra_window), end+extra_window):
+                if read.is_proper_pair and read.isize>0 and not read.is_reverse:
+                    _rs = read.isize
+                    if strand < 0: rpos = end-read.pos-_rs
+                    else:          rpos = read.pos-start
+                    if rpos < -_rs: continue
+                    if rpos >= end-start+_rs: break
+                    Y.append(_rs)
+                    X.append(rpos+_rs/2)
+    return numpy.asarray(X), numpy.asarray(Y)
+
+
+class Test_VplotPlugin(TestCase):
+    def setUp(self):
+        self.plugin = VplotPlugin()
+        self.bampath = _paired_bam('tmp_paired.bam')
+        self.features = 'tmp_features.bed'
+        random.seed(2)
+        with open(self.features, 'w') as f:
+            for n in range(40):
+                start = random.randint(0, 19000)
+                width = random.choice([400, 600])
+                f.write("chr1\t%i\t%i\tf%i\t0\t%s\n" % (start, start+width, n, random.choice('+-')))
+
+    def test_histogram2d(self):
+        x = numpy.random.randint(-50, 450, 5000)
+        y = numpy.random.randint(0, 500, 5000)
+        h = Histogram2D(0, 400, 5, 5)
+        h.add(x[:2000], y[:2000])
+        h.add(x[2000:], y[2000:])
+        keep = (x >= 0) & (x < 400)
+        expected, _, _ = numpy.histogram2d(x[keep], y[keep], bins=[numpy.arange(0, 405, 5), h.yedges()])
+        self.assertListEqual(h.counts.tolist(), expected.astype(int).tolist())
+        self.assertEqual(h.total, keep.sum())
+
+    def test_vplot_matrix(self):
+        self.plugin(bamfiles=self.bampath, features=self.features, bin_size=10)
+        with open(self.plugin.output_files[1][0]) as f:
+            f.readline()
+            counts = numpy.asarray([[int(c) for c in line.split('\t')[1:]] for line in f])
+        bam = pysam.Samfile(self.bampath, 'rb')
+        X, Y = _per_fragment(bam, self.features)
+        bam.close()
+        # The x bins span the widest region
+        self.assertEqual(counts.shape[0], 60)
+        expected = numpy.zeros(counts.shape, dtype=int)
+        keep = (X >= 0) & (X < 600)
+        numpy.add.at(expected, (X[keep]//10, Y[keep]//10), 1)
+        self.assertGreater(expected.sum(), 0)
+        self.assertListEqual(counts.tolist(), expected.tolist())
+
+    def tearDown(self):
+        for f in os.listdir('.'):
+            if f.startswith('tmp'):
+                os.system("rm -rf %s" % f)
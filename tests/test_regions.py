@@ -0,0 +1,57 @@
+from unittest2 import TestCase, skip
+from bsPlugins.base.regions import sweep_regions, merged_blocks
+import random
+
+
+class Read(object):
+    def __init__(self, pos, length):
+        self.pos = pos
+        self.aend = pos+length
+
+
+class Fetch(object):
+    """Like ``pysam.Samfile.fetch``: the reads overlapping [start, end), sorted by position."""
+    def __init__(self, reads):
+        self.reads = dict((c, sorted(r, key=lambda x: x.pos)) for c,r in reads.iteritems())
+        self.calls = 0
+
+    def __call__(self, chrom, start, end):
+        self.calls += 1
+        return [r for r in self.reads.get(chrom, []) if r.pos < end and r.aend > start]
+
+
+class Test_Regions(TestCase):
+    def test_merged_blocks(self):
+        self.assertListEqual(merged_blocks([(0,10), (5,20), (20,30), (40,50)]),
+                             [[0, 30, [0,1,2]], [40, 50, [3]]])
+
+    def test_overlapping_reads(self):
+        early, late = Read(80, 50), Read(150, 10)
+        fetch = Fetch({'chr1': [early, late]})
+        # *early* starts before both regions and overlaps them
+        regions = [('chr1', 120, 200), ('chr1', 100, 110)]
+        result = list(sweep_regions(fetch, regions, ordered=True))
+        self.assertListEqual([r for r,_ in result], regions)
+        self.assertListEqual(result[0][1], [early, late])
+        self.assertListEqual(result[1][1], [early])
+        self.assertEqual(fetch.calls, 2)
+
+    def test_sweep_regions(self):
+        for trial in range(100):
+            random.seed(trial)
+            fetch = Fetch(dict((c, [Read(random.randint(0,2000), random.randint(1,150))
+                                    for _ in range(random.randint(0,300))])
+                               for c in ['chr1','chr2']))
+            regions = []
+            for n in range(random.randint(0,30)):
+                start, end = sorted(random.sample(range(2000), 2))
+                regions.append((random.choice(['chr1','chr2']), start, end, "region%i" % n))
+            padding = random.choice([0, 10, 100])
+            for ordered in [False, True]:
+                result = list(sweep_regions(fetch, regions, padding=padding, ordered=ordered))
+                if ordered:
+                    self.assertListEqual([r for r,_ in result], regions)
+                else:
+                    self.assertItemsEqual([r for r,_ in result], regions)
+                for (chrom, start, end, name), reads in result:
+                    self.assertListEqual(reads, Fetch(fetch.reads)(chrom, max(0,start-padding), end+padding))
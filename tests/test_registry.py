@@ -0,0 +1,73 @@
+from unittest2 import TestCase, skip
+from bsPlugins import PLUGINS_FILES
+from bsPlugins.base import registry
+import cPickle as pickle
+import os, sys
+
+
+class Test_PluginRegistry(TestCase):
+    def setUp(self):
+        self.path = os.path.abspath('tmp_plugins.manifest')
+        self.imported = []
+        self.failing = set()
+        self._import = registry._import
+        def _import(name):
+            self.imported.append(name)
+            if name in self.failing: raise ImportError("No module named %s" % name)
+            return self._import(name)
+        registry._import = _import
+
+    def _manifest(self, stale):
+        """Up-to-date entries without plugins, except for the modules *stale*."""
+        manifest = dict((name, {'mtime': os.path.getmtime(registry._module_file(name)), 'plugins': []})
+                        for name in PLUGINS_FILES if name not in stale)
+        with open(self.path, 'wb') as f:
+            pickle.dump(manifest, f)
+
+    def test_build_manifest(self):
+        self.failing.add('Ratios')
+        manifest = registry.build_manifest(self.path, ['Smoothing', 'Ratios'])
+        self.assertListEqual([p['class'] for p in manifest['Smoothing']['plugins']], ['SmoothingPlugin'])
+        self.assertListEqual(manifest['Ratios']['plugins'], [])
+        self.assertIn('Ratios', manifest['Ratios']['error'])
+        with open(self.path, 'rb') as f:
+            self.assertDictEqual(pickle.load(f), manifest)
+
+    def test_stale(self):
+        self._manifest(['Smoothing', 'Ratios'])
+        self.failing.add('Ratios')
+        registry.PluginRegistry(self.path).plugins()
+        self.assertItemsEqual(self.imported, ['Smoothing', 'Ratios'])
+        # Failures are recorded: nothing is imported until a module changes
+        self.imported = []
+        titles = [p['class'] for p in registry.PluginRegistry(self.path).plugins()]
+        self.assertListEqual(self.imported, [])
+        self.assertListEqual(titles, ['SmoothingPlugin'])
+        with open(self.path, 'rb') as f:
+            manifest = pickle.load(f)
+        manifest['Ratios']['mtime'] -= 1
+        with open(self.path, 'wb') as f:
+            pickle.dump(manifest, f)
+        registry.PluginRegistry(self.path).plugins()
+        self.assertListEqual(self.imported, ['Ratios'])
+
+    def test_lazy_loading(self):
+        self._manifest(['Smoothing'])
+        registry.PluginRegistry(self.path).plugins()
+        sys.modules.pop('bsPlugins.Smoothing', None)
+        self.imported = []
+        reg = registry.PluginRegistry(self.path)
+        entry = reg.plugins()[0]
+        self.assertEqual(entry['class'], 'SmoothingPlugin')
+        self.assertEqual(reg.info(entry['uid'])['title'], entry['title'])
+        self.assertListEqual(self.imported, [])
+        self.assertNotIn('bsPlugins.Smoothing', sys.modules)
+        plugin = reg.plugin(entry['uid'])
+        self.assertEqual(plugin.__class__.__name__, 'SmoothingPlugin')
+        self.assertIn('bsPlugins.Smoothing', sys.modules)
+
+    def tearDown(self):
+        registry._import = self._import
+        for f in os.listdir('.'):
+            if f.startswith('tmp'):
+                os.system("rm -rf %s" % f)
@@ -0,0 +1,58 @@
+from unittest2 import TestCase, skip
+from bsPlugins.base.shift import cross_correlation, estimate_shift, _densify
+import numpy, os
+
+
+def _strands(shift, nrows=20, size=1024, seed=0):
+    """Random peaks on the forward strand, and the same peaks 2*shift bp downstream on the reverse."""
+    rng = numpy.random.RandomState(seed)
+    fwd = numpy.zeros((nrows, size))
+    for row in fwd:
+        for p in rng.randint(0, size-2*shift-30, 5):
+            row[p:p+30] += rng.randint(1, 10)
+    rev = numpy.zeros((nrows, size))
+    rev[:, 2*shift:] = fwd[:, :size-2*shift]
+    return fwd, rev
+
+
+def _write_bedgraph(fname, chrom, signal):
+    """Runs of equal values of the per-basepair *signal*, zeros left out."""
+    bounds = numpy.flatnonzero(numpy.diff(signal))+1
+    starts = numpy.concatenate(([0], bounds))
+    ends = numpy.concatenate((bounds, [len(signal)]))
+    with open(fname, 'w') as f:
+        for s, e in zip(starts, ends):
+            if signal[s]: f.write("%s\t%i\t%i\t%g\n" % (chrom, s, e, signal[s]))
+    return fname
+
+
+class Test_Shift(TestCase):
+    def test_densify(self):
+        starts, ends, scores = numpy.array([10, 50]), numpy.array([20, 60]), numpy.array([1., 2.])
+        expected = numpy.zeros(60)
+        expected[5:15] = 1
+        expected[45:55] = 2
+        self.assertListEqual(_densify(starts, ends, scores, 5, 60).tolist(), expected.tolist())
+
+    def test_cross_correlation(self):
+        for shift in [0, 12, 37, 80]:
+            fwd, rev = _strands(shift)
+            xcor = cross_correlation(fwd, rev, max_lag=200)
+            self.assertEqual(len(xcor), 401)
+            self.assertEqual((int(xcor.argmax())-200)//2, shift)
+            self.assertGreater(xcor.max(), .9)
+
+    def test_estimate_shift(self):
+        fwd, rev = _strands(45, nrows=1, size=50000)
+        forward = _write_bedgraph('tmp_fwd.bedGraph', 'chr1', fwd[0])
+        reverse = _write_bedgraph('tmp_rev.bedGraph', 'chr1', rev[0])
+        chrmeta = {'chr1': {'length': 50000}}
+        shift, confidence = estimate_shift(forward, reverse, chrmeta=chrmeta, max_lag=150,
+                                           nregions=20, region_size=1024, cache=False)
+        self.assertEqual(shift, 45)
+        self.assertGreater(confidence, .5)
+
+    def tearDown(self):
+        for f in os.listdir('.'):
+            if f.startswith('tmp'):
+                os.system("rm -rf %s" % f)